@@ -0,0 +1,140 @@
+#-*-coding:utf8-*-
+'''
+autosub.py
+
+How much a substitute is worth: the chance he is brought on automatically.
+
+---
+A substitute only scores for the team when a starter doesn't play and the
+autosub rules bring him on. With a flat `benchfrac` every substitute is
+worth the same fraction of his points, whatever his position and however
+likely the starters are to miss the game. `bench_table` estimates instead,
+for each position, the probability that a substitute of that position who
+is available gets on the pitch:
+
+ * The keeper on the bench only ever replaces the starting keeper.
+ * The three outfield substitutes are tried in bench order. Each one comes
+   on for a starter who didn't play if the team can still end up with at
+   least 3 defenders, 3 midfielders and 1 forward (the squad rules in
+   optimize_roster.solve_roster); otherwise the next one is tried.
+ * A starter misses the game with the average chance of not playing
+   (see simulate.distributions) of the players in the top `starters` share
+   of his position by score, i.e. the ones the optimizer would start.
+
+The table is averaged over every formation and every bench order, with
+`draws` simulated gameweeks per combination, vectorized over the draws. It
+is computed once per pool, so it costs nothing at solve time: each sub
+candidate's score is simply its points times the value for its position.
+
+Usage:
+>>> table = autosub.bench_table(players)
+>>> table
+{'keeper': 0.08, 'defender': 0.21, 'midfielder': 0.17, 'forward': 0.19}
+
+or `--autosub` with optimize_roster.py.
+
+---
+Joe Nudell
+'''
+
+from itertools import permutations
+import numpy as np
+import simulate
+import metrics
+
+
+positions = ['defender', 'midfielder', 'forward']
+minimums = {'defender': 3, 'midfielder': 3, 'forward': 1}
+squad_counts = {'defender': 5, 'midfielder': 5, 'forward': 3}
+
+
+
+def absence_rates(players, score='total_points', starters=.25):
+    '''Chance of not playing of a likely starter, per position (singular
+    names, as in the candidates).'''
+    dist = simulate.distributions(players)
+    rates = {}
+
+    for pos in positions + ['keeper']:
+        mine = [i for i, p in enumerate(players) if p.position == pos + 's']
+        if not mine:
+            rates[pos] = 0.
+            continue
+
+        ranked = sorted(mine, key=lambda i: -float(getattr(players[i],
+            score)))
+        top = ranked[:max(1, int(round(len(ranked) * starters)))]
+        rates[pos] = 1. - dist['play'][top].mean()
+
+    return rates
+
+
+
+def _bench_order(rates, lineup, bench, draws, rnd):
+    '''Times each bench slot came on and was available, over `draws`
+    gameweeks of one formation (`lineup`: starters per position) and one
+    bench order.'''
+    playing = {}
+    missing = np.zeros(draws, dtype=int)
+
+    for pos in positions:
+        absent = rnd.binomial(lineup[pos], rates[pos], size=draws)
+        playing[pos] = lineup[pos] - absent
+        missing += absent
+
+    came_on = np.zeros(len(bench))
+    available = np.zeros(len(bench))
+
+    for slot, pos in enumerate(bench):
+        plays = rnd.random_sample(draws) >= rates[pos]
+
+        # After bringing him on, the remaining gaps must still be able to
+        # cover whatever the formation is short of
+        short = sum(np.maximum(minimums[p] - playing[p] - (p == pos), 0)
+            for p in positions)
+        on = plays & (missing > 0) & (short <= missing - 1)
+
+        playing[pos] = playing[pos] + on
+        missing -= on
+
+        came_on[slot] = on.sum()
+        available[slot] = plays.sum()
+
+    return came_on, available
+
+
+
+@metrics.timed('bench_table')
+def bench_table(players, score='total_points', starters=.25, draws=20000,
+    seed=0):
+    '''Probability that an available substitute of each position is
+    brought on, as {position: probability}.'''
+    rates = absence_rates(players, score=score, starters=starters)
+    rnd = np.random.RandomState(seed)
+
+    came_on = dict((pos, 0.) for pos in positions)
+    available = dict((pos, 0.) for pos in positions)
+
+    for d in range(3, 6):
+        for m in range(3, 6):
+            f = 10 - d - m
+            if not 1 <= f <= 3:
+                continue
+
+            lineup = {'defender': d, 'midfielder': m, 'forward': f}
+            bench = sum([[pos] * (squad_counts[pos] - lineup[pos])
+                for pos in positions], [])
+
+            for order in set(permutations(bench)):
+                on, avail = _bench_order(rates, lineup, order, draws, rnd)
+                for slot, pos in enumerate(order):
+                    came_on[pos] += on[slot]
+                    available[pos] += avail[slot]
+
+    table = dict((pos, came_on[pos] / available[pos]
+        if available[pos] else 0.) for pos in positions)
+
+    # The bench keeper is on whenever the starting keeper isn't
+    table['keeper'] = rates['keeper']
+
+    return table
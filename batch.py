@@ -0,0 +1,449 @@
+#-*-coding:utf8-*-
+'''
+batch.py
+
+Rosters for many managers at once, from a JSONL file of requests.
+
+---
+Every line of the input is one manager's request, a JSON object with any of
+
+    id          anything, echoed back with the result
+    budget      total budget (default: value of `squad` plus `bank`, or 100)
+    squad       current squad, as the `roster` of a JSON roster file
+    bank        money in the bank, with `squad`
+    transfers   most players to bring in from outside `squad`
+    exclude     players not to pick, as `First Last (CLUB)`
+    rules       league rules, one string each (see rules.py)
+    risk        trade mean for a safer floor (see robust.py), with `alpha`
+
+Squad players are sold at their current price.
+
+The pool is fetched and the roster model (see model.py) built once. Every
+request is then a delta on that model, worked out in the main process:
+
+ * the budget replaces the right hand side of the cost row
+ * exclusions and price ceilings set column upper bounds to 0
+ * other rules and the transfer limit add a few sparse rows
+
+The model, the candidate columns and one set of simulated gameweeks for
+`risk` requests are written to shared memory once (see shared.py).
+`--processes` workers attach to them and solve, so a task is just its delta.
+Each worker remembers the deltas it has solved, so managers asking the
+same thing cost one solve.
+
+Results are written as JSONL in input order, while later requests are
+still solving, one line per request:
+
+    {"id": .., "ok": true, "score": .., "cost": .., "breakdown": {..},
+     "roster": [..], "in": [..], "out": [..], "seconds": ..}
+
+`roster` entries are shaped like those of JSON roster files, player ids
+included, and `in` and `out` hold the keys of the players bought and sold.
+A request that can't be solved gets `{"id": .., "ok": false, "error": ..}`
+and doesn't stop the batch. Requests per second are reported at the end.
+
+Usage:
+    $ python batch.py requests.jsonl -o results.jsonl --processes 4
+
+The `exact` solver takes budgets, exclusions and price ceilings only.
+
+---
+Joe Nudell
+'''
+
+from itertools import imap
+from multiprocessing import Pool
+from sys import stderr, stdin, stdout
+from roster import PoolIndex
+import optimize_roster as optr
+import robust
+import rules as rls
+import model
+import shared
+import metrics
+import numpy as np
+import scipy.sparse as sp
+import argparse
+import json
+import time
+
+
+# Candidate positions, as coded in the shared `position` column
+positions = ['forward', 'midfielder', 'defender', 'keeper']
+
+
+
+def base_arrays(candidates, players, scenarios=200, seed=0):
+    '''The roster model over `candidates`, the candidate columns and the
+    relative scenario points of `players`, as a dict of arrays.'''
+    m = model.roster_model(candidates)
+    arrays = {
+        'f' : m['f'],
+        'b' : m['b'],
+        'beq' : m['beq'],
+        'position' : np.array([positions.index(c['position'])
+            for c in candidates], dtype=np.int8)
+    }
+
+    for name in ['A', 'Aeq']:
+        M = m[name].tocsr()
+        arrays[name + '_data'] = M.data
+        arrays[name + '_indices'] = M.indices
+        arrays[name + '_indptr'] = M.indptr
+
+    arrays.update(('candidate_' + k, v) for k, v in
+        shared.candidate_columns(candidates).items())
+
+    if scenarios:
+        with metrics.span('scenarios', scenarios=scenarios):
+            arrays['relative'] = robust.scenario_points(players, scenarios,
+                seed=seed)
+
+    return arrays
+
+
+
+def make_delta(request, candidates, players, index):
+    '''What one request changes in the base model.'''
+    delta = {
+        'id' : request.get('id'),
+        'risk' : request.get('risk'),
+        'alpha' : request.get('alpha', .2),
+        'excluded' : np.zeros(0, dtype=int),
+        'ub' : model.Rows(),
+        'eq' : model.Rows(),
+        'squad' : []
+    }
+
+    rules = rls.parse(request.get('rules', []) +
+        ['exclude %s' % x for x in request.get('exclude', [])])
+    if rules:
+        compiled = rls.compile_rules(rules, candidates, players)
+        delta['excluded'] = np.flatnonzero(compiled.excluded)
+        delta['ub'], delta['eq'] = compiled.ub, compiled.eq
+
+    budget = 100.
+    if 'squad' in request:
+        delta['squad'] = index.indices(request['squad'])
+        budget = sum(players[i].cost for i in delta['squad']) + \
+            float(request.get('bank', 0.))
+
+        if request.get('transfers') is not None:
+            mine = set(i + 1 for i in delta['squad'])
+            outside = [j for j, c in enumerate(candidates)
+                if c['pid'] not in mine]
+            delta['ub'].add(outside, np.ones(len(outside)),
+                int(request['transfers']))
+
+    delta['budget'] = float(request.get('budget', budget))
+
+    return delta
+
+
+
+_candidates = {}
+
+def _pool_candidates(arrays):
+    '''Just enough of every candidate for exact.py and robust.py, built
+    once per process. Names are column numbers.'''
+    if id(arrays) not in _candidates:
+        _candidates[id(arrays)] = [{
+            'pid' : int(pid),
+            'position' : positions[pos],
+            'cost' : float(cost),
+            'score' : float(score),
+            'bench' : 'sub' if sub else 'starter',
+            'captain' : int(captain),
+            'name' : str(j)
+        } for j, (pid, pos, cost, score, sub, captain) in enumerate(zip(
+            arrays['candidate_pid'], arrays['position'],
+            arrays['candidate_cost'], arrays['candidate_score'],
+            arrays['candidate_sub'], arrays['candidate_captain']))]
+
+    return _candidates[id(arrays)]
+
+
+
+def _model(arrays, delta):
+    '''The base model with a request's delta applied.'''
+    n = len(arrays['f'])
+    m = {'f': arrays['f'], 'n': n, 'pids': arrays['candidate_pid']}
+
+    for name, rhs in [('A', 'b'), ('Aeq', 'beq')]:
+        M = sp.csr_matrix((arrays[name + '_data'], arrays[name + '_indices'],
+            arrays[name + '_indptr']), shape=(len(arrays[rhs]), n))
+        extra, more = delta['ub' if name == 'A' else 'eq'].matrix(n)
+        m[name] = sp.vstack([M, extra]).tocsr()
+        m[rhs] = np.concatenate([arrays[rhs], more])
+
+    # The cost row is the first one
+    m['b'][0] = delta['budget']
+
+    m['upper'] = np.ones(n)
+    m['upper'][delta['excluded']] = 0.
+
+    return m
+
+
+
+def solve_delta(arrays, delta, solver='glpk'):
+    '''Solve one request. Returns (chosen columns, objective, extras).'''
+    rows = len(delta['ub'].rhs) + len(delta['eq'].rhs)
+
+    if solver == 'exact':
+        if rows or delta['risk'] is not None:
+            raise ValueError("The exact solver only takes budgets, "
+                "exclusions and price ceilings")
+        import exact
+        keep = np.ones(len(arrays['f']), dtype=bool)
+        keep[delta['excluded']] = False
+        candidates = _pool_candidates(arrays)
+        r = exact.solve([c for c, k in zip(candidates, keep) if k],
+            budget=delta['budget'])
+        return sorted(int(name) for name in r.xf), r.ff, {}
+
+    m = _model(arrays, delta)
+
+    if delta['risk'] is not None:
+        if 'relative' not in arrays:
+            raise ValueError("No scenarios to weigh risk with")
+        r = robust.solve(_pool_candidates(arrays), None,
+            alpha=delta['alpha'], risk=delta['risk'], solver=solver,
+            model=m, relative=arrays['relative'])
+        extras = {'mean': r.mean, 'cvar': r.cvar}
+        columns = sorted(int(name) for name in r.xf)
+    else:
+        r = model.solve_milp(m['f'], m['A'], m['b'], m['Aeq'], m['beq'],
+            lb=np.zeros(m['n']), ub=m['upper'], int_vars=range(m['n']),
+            solver=solver)
+        extras = {}
+        columns = [int(j) for j in np.flatnonzero(np.asarray(r.xf) > .5)]
+
+    if not r.isFeasible:
+        raise ValueError("No feasible roster")
+
+    return columns, r.ff, extras
+
+
+
+def fingerprint(delta, solver):
+    '''Everything about a delta that changes its solution.'''
+    rows = lambda r: (tuple(r.rows), tuple(r.cols), tuple(r.vals),
+        tuple(r.rhs))
+    return (solver, float(delta['budget']), tuple(delta['excluded']),
+        rows(delta['ub']), rows(delta['eq']), delta['risk'],
+        delta['alpha'])
+
+
+
+# Solutions in this process by fingerprint: many managers ask the same
+_solved = {}
+solved_cache_size = 1024
+
+def _solve(args):
+    '''Worker: one (arrays or shared.Handle, delta, solver) task. Never
+    raises, so one bad request doesn't stop the batch.'''
+    source, delta, solver = args
+
+    if 'error' in delta:
+        return delta
+
+    arrays = source
+    if isinstance(source, shared.Handle):
+        arrays = shared.attach(source)
+
+    start = time.time()
+    try:
+        key = fingerprint(delta, solver)
+        if key not in _solved:
+            if len(_solved) >= solved_cache_size:
+                _solved.clear()
+            _solved[key] = solve_delta(arrays, delta, solver=solver)
+        columns, ff, extras = _solved[key]
+    except Exception as e:
+        return {'id': delta['id'], 'error': str(e)}
+
+    return {'id': delta['id'], 'columns': columns, 'ff': ff,
+        'extras': extras, 'squad': delta['squad'],
+        'seconds': time.time() - start}
+
+
+
+def result_line(result, candidates, players):
+    '''The JSON output of one solved (or failed) request.'''
+    if 'error' in result:
+        return {'id': result['id'], 'ok': False, 'error': result['error']}
+
+    solution = optr.Solution([candidates[j] for j in result['columns']],
+        candidates, players)
+    before = set(result['squad'])
+    after = set(solution.indices)
+
+    line = {
+        'id' : result['id'],
+        'ok' : True,
+        'score' : float(result['ff']),
+        'cost' : solution.cost,
+        'breakdown' : solution.breakdown,
+        'roster' : solution.entries(),
+        'in' : [k for i, k in zip(solution.indices, solution.keys)
+            if before and i not in before],
+        'out' : [optr.player_key(players[i]) for i in result['squad']
+            if i not in after],
+        'seconds' : round(result['seconds'], 4)
+    }
+    line.update((k, float(v)) for k, v in result['extras'].items())
+
+    return line
+
+
+
+def run(requests, candidates, players, out, solver='glpk', processes=None,
+    scenarios=200, seed=0, chunksize=1):
+    '''Solve a stream of requests (dicts, or JSON lines) over one pool,
+    writing a JSON line per request to `out` in input order. Returns (requests, failures,
+    seconds).'''
+    index = PoolIndex(players)
+
+    with metrics.span('base_model'):
+        arrays = base_arrays(candidates, players, scenarios=scenarios,
+            seed=seed)
+
+    # Nothing may raise in here: with processes this runs in the pool's
+    # task feeder thread, where an exception leaves imap waiting forever
+    def tasks(source):
+        for request in requests:
+            try:
+                if isinstance(request, basestring):
+                    request = json.loads(request)
+                if not isinstance(request, dict):
+                    raise ValueError("A request must be a JSON object")
+                delta = make_delta(request, candidates, players, index)
+            except Exception as e:
+                delta = {'id': request.get('id')
+                    if isinstance(request, dict) else None, 'error': str(e)}
+            yield source, delta, solver
+
+    start = time.time()
+    done, failed = 0, 0
+
+    with metrics.span('batch'):
+        if processes:
+            handle = shared.share(arrays)
+            pool = Pool(processes)
+            try:
+                results = pool.imap(_solve, tasks(handle), chunksize)
+                done, failed = _write(results, candidates, players, out)
+            finally:
+                pool.close()
+                pool.join()
+                handle.unlink()
+        else:
+            results = imap(_solve, tasks(arrays))
+            done, failed = _write(results, candidates, players, out)
+
+    metrics.count('requests', done)
+    metrics.count('requests_failed', failed)
+
+    return done, failed, time.time() - start
+
+
+
+def _write(results, candidates, players, out):
+    done, failed = 0, 0
+
+    for result in results:
+        line = result_line(result, candidates, players)
+        print >>out, json.dumps(line)
+        out.flush()
+
+        done += 1
+        failed += not line['ok']
+
+    return done, failed
+
+
+
+def read_requests(fh):
+    '''Lines of a JSONL file of requests, skipping blank ones. They are
+    parsed by `run`, so a malformed line fails only its own request.'''
+    for line in fh:
+        if line.strip():
+            yield line
+
+
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('requests', type=str,
+        help="JSONL file of requests, or - for stdin")
+    parser.add_argument('-o', '--out', type=str, default=None,
+        help="Write results here instead of stdout")
+    parser.add_argument('--processes', type=int, default=None,
+        help="Solve in this many worker processes")
+    parser.add_argument('--chunksize', type=int, default=1,
+        help="Requests handed to a worker at a time")
+    parser.add_argument('-S', '--solver', type=str, default='glpk',
+        help="Solver: glpk, or exact for simple requests")
+    parser.add_argument('--scenarios', type=int, default=200,
+        help="Simulated gameweeks shared by all requests with `risk`")
+    parser.add_argument('--seed', type=int, default=0,
+        help="Random seed for the scenarios")
+    parser.add_argument('-s', '--score', type=str, default='total_points',
+        help="Stat or expression to score players by")
+    parser.add_argument('-e', '--bench', type=float, default=.1,
+        help="Fraction of points expected from substitutes")
+    parser.add_argument('-c', '--captain', type=float, default=2.,
+        help="Captain's points multiplier")
+    parser.add_argument('-a', '--adjustments', type=str, default=None,
+        help="File of injury adjustments")
+    parser.add_argument('-r', '--threshold', type=float, default=1.,
+        help="Ignore adjustments at or above this factor")
+    parser.add_argument('-y', '--season', type=int, default=2014,
+        help="ESPN endpoint only currently supports 2014 season")
+    parser.add_argument('-u', '--username', type=str, default='',
+        help="Username (for official EPL site)")
+    parser.add_argument('-p', '--password', type=str, default='',
+        help="Password (for official EPL site)")
+    parser.add_argument('-w', '--source', type=str, default='espn',
+        help="Stats source website. ESPN and EPL are supported.")
+    parser.add_argument('-C', '--cache', type=str, default=None,
+        help="Directory to keep downloaded pages in for revalidation")
+    parser.add_argument('--replay', type=str, default=None,
+        help="Replay responses from this fixture archive, offline")
+    parser.add_argument('--base-url', type=str, default=None,
+        help="Send requests to this host instead (see fakeserver.py)")
+    parser.add_argument('--metrics', type=str, default=None,
+        help="Write stage timings and counters to this JSON file")
+
+    cli = parser.parse_args()
+
+    print >>stderr, "Fetching stats from %s ..." % cli.source
+    candidates, players = optr.get_player_stats(season=cli.season,
+        benchfrac=cli.bench, score=cli.score, adjustments=cli.adjustments,
+        source=cli.source, username=cli.username, password=cli.password,
+        threshold=cli.threshold, captain=cli.captain, cache_dir=cli.cache,
+        replay=cli.replay, base_url=cli.base_url)
+    print >>stderr, "Done."
+
+    fh = stdin if cli.requests == '-' else open(cli.requests)
+    out = stdout if cli.out is None else open(cli.out, 'w')
+
+    try:
+        done, failed, seconds = run(read_requests(fh), candidates, players,
+            out, solver=cli.solver, processes=cli.processes,
+            scenarios=cli.scenarios, seed=cli.seed, chunksize=cli.chunksize)
+    finally:
+        if out is not stdout:
+            out.close()
+
+    print >>stderr, "%d requests (%d failed) in %.2fs: %.1f requests/s" % (
+        done, failed, seconds, done / max(seconds, 1e-9))
+
+    if cli.metrics is not None:
+        metrics.report()
+        metrics.dump(cli.metrics)
@@ -0,0 +1,6 @@
+'''
+Benchmarks for the EPL fantasy tools. Run each one as a module from the top
+of the repository, e.g.
+
+    $ python -m benchmarks.startup
+'''
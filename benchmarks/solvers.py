@@ -0,0 +1,174 @@
+#-*-coding:utf8-*-
+'''
+benchmarks/solvers.py
+
+Compare solver backends on pools whose optimum is known.
+
+---
+Every pool in the corpus is first solved with the exact dynamic programming
+solver (exact.py), which proves the optimum. Then each backend is run on
+it in a child process, so peak memory can be measured per run and a
+backend that never finishes can be stopped. For each run we record:
+
+ * time to the first feasible roster (from the solver's iteration callback
+   where it has one, otherwise the total time)
+ * time to the final answer, and whether it is the optimum
+ * the remaining gap to the optimum, as a fraction of it (n/a if no
+   feasible roster was found)
+ * peak resident memory of the child process
+
+Usage:
+    $ python -m benchmarks.solvers --solvers glpk,interalg --timeout 300
+'''
+
+from multiprocessing import Process, Queue
+import argparse
+import resource
+import json
+import time
+
+import synthetic
+import optimize_roster as optr
+from benchmarks.stages import quiet
+
+
+# Fixed corpus: (players, seed, budget)
+corpus = [
+    (30, 1, 100.),
+    (45, 2, 90.),
+    (60, 3, 85.),
+    (90, 4, 100.),
+    (150, 5, 95.)
+]
+
+backends = ['exact', 'glpk', 'interalg']
+
+
+
+def candidates_for(n, seed):
+    candidates, _ = optr.get_player_stats(
+        downloader=synthetic.SyntheticDownloader(n=n, seed=seed))
+    return candidates
+
+
+
+def _run(queue, solver, n, seed, budget, timeout):
+    '''Child process body: solve and report timings and memory.'''
+    with quiet():
+        candidates = candidates_for(n, seed)
+
+    first_feasible = []
+    start = time.time()
+
+    def callback(p):
+        if not first_feasible and p.isFeas(p.xk):
+            first_feasible.append(time.time() - start)
+        return False
+
+    kwargs = {}
+    if solver != 'exact':
+        kwargs = {'callback': callback, 'maxTime': timeout}
+
+    try:
+        with quiet():
+            r = optr.solve_roster(candidates, budget=budget, solver=solver,
+                **kwargs)
+        elapsed = time.time() - start
+        feasible = getattr(r, 'isFeasible', True)
+        value = float(r.ff) if feasible and r.ff is not None else None
+    except Exception as e:
+        queue.put({'error': str(e)})
+        return
+
+    queue.put({
+        'value' : value,
+        'seconds' : elapsed,
+        'first_feasible' : first_feasible[0] if first_feasible \
+            else (elapsed if value is not None else None),
+        'peak_rss_mb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            / 1024.
+    })
+
+
+
+def run(solver, n, seed, budget, timeout):
+    '''Run one backend on one pool in a child process.'''
+    queue = Queue()
+    proc = Process(target=_run, args=(queue, solver, n, seed, budget,
+        timeout))
+    proc.start()
+    # Leave the solver's own time limit a moment to wind down
+    proc.join(timeout + 30)
+
+    if proc.is_alive():
+        proc.terminate()
+        proc.join()
+        return {'error': 'timeout'}
+
+    if queue.empty():
+        return {'error': 'exit code %s' % proc.exitcode}
+
+    return queue.get()
+
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--solvers', type=str, default=','.join(backends),
+        help="Comma separated backends to compare")
+    parser.add_argument('--timeout', type=float, default=120.,
+        help="Seconds allowed per backend and pool")
+    parser.add_argument('--max-players', type=int, default=None,
+        help="Skip corpus pools larger than this")
+    parser.add_argument('--json', type=str, default=None,
+        help="Write results to this file")
+
+    cli = parser.parse_args()
+
+    solvers = cli.solvers.split(',')
+    results = []
+    row_format = "{:<10}{:>8}{:>12}{:>12}{:>12}{:>10}{:>10}"
+
+    print row_format.format("Solver", "Players", "Feas. (s)", "Final (s)",
+        "Gap", "Optimal", "Peak MB")
+
+    for n, seed, budget in corpus:
+        if cli.max_players is not None and n > cli.max_players:
+            continue
+
+        reference = run('exact', n, seed, budget, cli.timeout)
+        optimum = reference.get('value')
+
+        for solver in solvers:
+            res = reference if solver == 'exact' else \
+                run(solver, n, seed, budget, cli.timeout)
+            res = dict(res, solver=solver, players=n, seed=seed,
+                budget=budget, optimum=optimum)
+
+            if 'error' in res:
+                print row_format.format(solver, n, res['error'], "", "",
+                    "", "")
+                results.append(res)
+                continue
+
+            gap = None
+            if optimum and res['value'] is not None:
+                gap = (optimum - res['value']) / optimum
+            res['gap'] = gap
+
+            print row_format.format(solver, n,
+                "none" if res['first_feasible'] is None \
+                    else "%.3f" % res['first_feasible'],
+                "%.3f" % res['seconds'],
+                "n/a" if gap is None else "%.2f%%" % (gap * 100),
+                "yes" if gap is not None and abs(gap) < 1e-6 else "no",
+                "%.0f" % res['peak_rss_mb'])
+
+            results.append(res)
+
+    if cli.json is not None:
+        with open(cli.json, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
@@ -0,0 +1,254 @@
+#-*-coding:utf8-*-
+'''
+benchmarks/stages.py
+
+Time every stage of the pipeline on synthetic player pools.
+
+---
+Stages:
+ * get_player_stats     candidate construction from a fetched pool,
+                        including adjustment matching
+ * optimize             model build and solve (needs OpenOpt)
+ * player_in_roster     matching every player against a roster
+ * team_similarity      teamdiff similarity of two rosters
+ * print_results        formatting a solved roster
+
+Each stage runs at every pool size given with --sizes, unless the size is
+over the stage's limit. get_player_stats builds one uniqueness field per
+player on every candidate, so its time and memory grow quadratically, and
+the OpenOpt model grows with it; beyond the limits they run out of memory
+long before they finish. Use --no-limits to run them anyway.
+
+Results are written as JSON with the commit they were measured at, so runs
+can be compared:
+    $ python -m benchmarks.stages --json before.json
+    ... change things ...
+    $ python -m benchmarks.stages --json after.json --compare before.json
+'''
+
+from contextlib import contextmanager
+from StringIO import StringIO
+import subprocess
+import argparse
+import platform
+import tempfile
+import json
+import time
+import os
+
+import synthetic
+import optimize_roster as optr
+import roster as rst
+import teamdiff
+
+
+
+@contextmanager
+def quiet():
+    '''Silence stdout/stderr at the file descriptor level. The tools bind
+    `stderr` at import time and the solvers print from C, so swapping
+    sys.stdout is not enough.'''
+    saved = [os.dup(1), os.dup(2)]
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+
+    try:
+        yield
+    finally:
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + [devnull]:
+            os.close(fd)
+
+
+
+def _candidates(players):
+    '''Just the candidate fields print_results needs, without building the
+    full model.'''
+    candidates = []
+    for i, p in enumerate(players):
+        for captain in [0, 1]:
+            for bench in ['starter', 'sub']:
+                uid = 990000 + len(candidates) + 1
+                candidates.append({
+                    'uid' : uid,
+                    'fname' : p.first_name,
+                    'lname' : p.last_name,
+                    'position' : p.position[:-1],
+                    'bench' : bench,
+                    'captain' : captain,
+                    'club' : p.club,
+                    'cost' : p.cost,
+                    'name' : "%s %s (%d)" % (p.first_name, p.last_name, uid)
+                })
+    return candidates
+
+
+
+# Each setup function takes a pool and returns the callable to time.
+
+def setup_get_player_stats(players, tmpdir):
+    adjfile = os.path.join(tmpdir, 'adjustments.txt')
+    with open(adjfile, 'w') as fh:
+        synthetic.write_adjustments(fh,
+            synthetic.make_adjustments(players, seed=1))
+
+    downloader = synthetic.SyntheticDownloader(players)
+
+    return lambda: optr.get_player_stats(adjustments=adjfile,
+        downloader=downloader)
+
+
+def setup_optimize(players, tmpdir, solver='glpk'):
+    candidates, _ = optr.get_player_stats(
+        downloader=synthetic.SyntheticDownloader(players))
+
+    return lambda: optr.solve_roster(candidates, solver=solver)
+
+
+def setup_player_in_roster(players, tmpdir):
+    roster = synthetic.make_roster(players, seed=1)
+
+    def run():
+        for p in players:
+            rst.player_in_roster(p, roster)
+
+    return run
+
+
+def setup_team_similarity(players, tmpdir):
+    roster1 = synthetic.make_roster(players, seed=1)
+    roster2 = synthetic.make_roster(players, seed=2)
+
+    return lambda: teamdiff.team_similarity(roster1, roster2, players)
+
+
+def setup_print_results(players, tmpdir):
+    candidates = _candidates(players)
+
+    r = optr.NS()
+    r.xf = [c['name'] for c in candidates[::4][:15]]
+
+    return lambda: optr.print_results(r, candidates, fh=StringIO())
+
+
+# name, setup, largest pool size to run by default
+stages = [
+    ('get_player_stats', setup_get_player_stats, 600),
+    ('optimize', setup_optimize, 100),
+    ('player_in_roster', setup_player_in_roster, None),
+    ('team_similarity', setup_team_similarity, None),
+    ('print_results', setup_print_results, None)
+]
+
+
+
+def run_stage(setup, players, repeat, tmpdir):
+    '''Returns sorted wall times (s) of `repeat` runs.'''
+    with quiet():
+        fn = setup(players, tmpdir)
+
+        times = []
+        for i in range(repeat):
+            start = time.time()
+            fn()
+            times.append(time.time() - start)
+
+    return sorted(times)
+
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--sizes', type=str, default='100,600,5000,50000',
+        help="Comma separated pool sizes")
+    parser.add_argument('--stages', type=str, default=None,
+        help="Comma separated stages to run (default all)")
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+        help="Timed runs per stage and size")
+    parser.add_argument('--seed', type=int, default=0,
+        help="Seed for the synthetic pools")
+    parser.add_argument('-S', '--solver', type=str, default='glpk',
+        help="Solver for the optimize stage")
+    parser.add_argument('--no-limits', action='store_true',
+        help="Run every stage at every size")
+    parser.add_argument('--json', type=str, default=None,
+        help="Write results to this file")
+    parser.add_argument('--compare', type=str, default=None,
+        help="Earlier results file to compare against")
+
+    cli = parser.parse_args()
+
+    sizes = [int(s) for s in cli.sizes.split(',')]
+    selected = cli.stages.split(',') if cli.stages else \
+        [name for name, _, _ in stages]
+
+    previous = {}
+    if cli.compare is not None:
+        with open(cli.compare) as fh:
+            previous = json.load(fh)['results']
+
+    results = {}
+    tmpdir = tempfile.mkdtemp()
+    row_format = "{:<18}{:>8}{:>12}{:>12}{:>10}"
+
+    print row_format.format("Stage", "Players", "Min (s)", "Med (s)",
+        "vs. prev")
+
+    for size in sizes:
+        players = synthetic.make_players(size, seed=cli.seed)
+
+        for name, setup, limit in stages:
+            if name not in selected:
+                continue
+
+            if limit is not None and size > limit and not cli.no_limits:
+                print row_format.format(name, size, "skipped", "", "")
+                continue
+
+            if name == 'optimize':
+                setup = lambda p, d: setup_optimize(p, d, cli.solver)
+
+            try:
+                times = run_stage(setup, players, cli.repeat, tmpdir)
+            except ImportError:
+                print row_format.format(name, size, "n/a", "", "")
+                continue
+
+            best, median = times[0], times[len(times)//2]
+            results.setdefault(name, {})[str(size)] = {
+                'min' : best,
+                'median' : median,
+                'times' : times
+            }
+
+            ratio = ""
+            prev = previous.get(name, {}).get(str(size))
+            if prev is not None:
+                ratio = "%.2fx" % (best / prev['min'])
+
+            print row_format.format(name, size, "%.4f" % best,
+                "%.4f" % median, ratio)
+
+    if cli.json is not None:
+        with open(cli.json, 'w') as fh:
+            json.dump({
+                'commit' : git_commit(),
+                'python' : platform.python_version(),
+                'date' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'repeat' : cli.repeat,
+                'seed' : cli.seed,
+                'results' : results
+            }, fh, indent=2, sort_keys=True)
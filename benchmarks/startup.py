@@ -0,0 +1,92 @@
+#-*-coding:utf8-*-
+'''
+benchmarks/startup.py
+
+Measure how long it takes to start the command line tools.
+
+---
+Every target is imported in a fresh interpreter, several times over, and the
+wall time is compared to an empty interpreter. The `eager` targets import
+the heavy dependencies up front, the way the tools used to, to show what
+lazy loading saves.
+
+Usage:
+    $ python -m benchmarks.startup -n 20 --json startup.json
+'''
+
+import subprocess
+import argparse
+import json
+import time
+import sys
+import os
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+targets = [
+    ('python', 'pass'),
+    ('roster', 'import roster'),
+    ('eplstats', 'import eplstats'),
+    ('teamdiff', 'import teamdiff'),
+    ('optimize_roster', 'import optimize_roster'),
+    ('eager bs4', 'import bs4, eplstats'),
+    ('eager openopt', 'import openopt, bs4, optimize_roster')
+]
+
+
+def time_import(statement, repeat):
+    '''Wall times (s) of running `statement` in new interpreters. Returns
+    None if the statement fails, e.g. because a dependency is missing.'''
+    times = []
+
+    for i in range(repeat):
+        start = time.time()
+        rc = subprocess.call([sys.executable, '-c', statement], cwd=root)
+        times.append(time.time() - start)
+
+        if rc != 0:
+            return None
+
+    return sorted(times)
+
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('-n', '--repeat', type=int, default=10,
+        help="Interpreter starts per target")
+    parser.add_argument('--json', type=str, default=None,
+        help="Write results to this file")
+
+    cli = parser.parse_args()
+
+    results = {}
+    row_format = "{:<18}{:>10}{:>10}{:>12}"
+
+    print row_format.format("Target", "Min (ms)", "Med (ms)", "Import (ms)")
+
+    baseline = None
+    for name, statement in targets:
+        times = time_import(statement, cli.repeat)
+
+        if times is None:
+            print row_format.format(name, "n/a", "n/a", "n/a")
+            continue
+
+        best = times[0] * 1000.
+        median = times[len(times)//2] * 1000.
+        if baseline is None:
+            baseline = best
+
+        results[name] = {'min_ms': best, 'median_ms': median,
+            'import_ms': best - baseline}
+
+        print row_format.format(name, "%.1f" % best, "%.1f" % median,
+            "%.1f" % (best - baseline))
+
+    if cli.json is not None:
+        with open(cli.json, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
@@ -0,0 +1,237 @@
+#-*-coding:utf8-*-
+'''
+changes.py
+
+What changed between two fetches of the pool, and whether the last
+solution still stands.
+
+---
+`diff(old, new)` compares two lists of Players and returns a feed of
+Changes, one per changed field:
+
+ * added, removed       a player appeared in or left the pool
+ * price                cost
+ * chance               chance_of_playing_next_round / _this_round
+ * status               status, news
+ * points               total_points, average_points, event_points, form
+
+Players are matched by `id` when the source has one, otherwise by name and
+club (see identity.espn_key).
+
+eplstats.Downloader keeps the feed of every page it had to parse again in
+`changes` (pages answered with a 304 don't change anything), which needs a
+`cache_dir` to work across runs.
+
+`SolveRecord` remembers the last roster solved for, and the cost and the
+four candidate scores (starter or sub, captain or not) of every player in
+the pool at the time. A roster stays optimal when the budget, solver
+and league rules (see rules.py) are the same and
+
+ * nobody got cheaper and nobody joined the pool
+ * no chosen candidate's score went down
+ * no other candidate's score went up
+ * the chosen roster still fits the budget
+ * with league rules, nobody changed price or club
+
+so in that case there is nothing to solve. The check runs over the
+candidates themselves rather than over the feed, so anything that moves
+scores (injuries from another source, fixtures, autosubs, form) is covered
+too.
+
+Usage:
+>>> for c in changes.diff(old_players, new_players): print c
+>>> record = changes.SolveRecord.load('.eplcache/last_solve.json')
+>>> ok, why = record.still_optimal(candidates, budget=100., solver='glpk')
+
+---
+Joe Nudell
+'''
+
+from collections import namedtuple
+from identity import espn_key
+import json
+import os
+
+
+Change = namedtuple('Change', 'kind key name field old new')
+
+fields = {
+    'cost' : 'price',
+    'chance_of_playing_next_round' : 'chance',
+    'chance_of_playing_this_round' : 'chance',
+    'status' : 'status',
+    'news' : 'status',
+    'total_points' : 'points',
+    'average_points' : 'points',
+    'event_points' : 'points',
+    'form' : 'points'
+}
+
+# Kinds that change the adjustments file
+injury_kinds = set(['added', 'removed', 'chance', 'status'])
+
+# Candidate variants per player, in SolveRecord order
+_variants = [('starter', 0), ('starter', 1), ('sub', 0), ('sub', 1)]
+
+
+
+def key(player):
+    '''Identity of a Player across fetches.'''
+    if player.get('id') is not None:
+        return "id:%s" % player.id
+    return espn_key(player)
+
+
+
+def _name(player):
+    return u"%s %s (%s)" % (player.first_name, player.last_name,
+        player.club)
+
+
+
+def diff(old, new):
+    '''Feed of Changes from pool `old` to pool `new`.'''
+    before = dict((key(p), p) for p in old)
+    after = dict((key(p), p) for p in new)
+    feed = []
+
+    for k, p in after.iteritems():
+        if k not in before:
+            feed.append(Change('added', k, _name(p), None, None, None))
+            continue
+
+        q = before[k]
+        for field in sorted(fields):
+            if q.get(field) != p.get(field):
+                feed.append(Change(fields[field], k, _name(p), field,
+                    q.get(field), p.get(field)))
+
+    for k, q in before.iteritems():
+        if k not in after:
+            feed.append(Change('removed', k, _name(q), None, None, None))
+
+    return feed
+
+
+
+def summarize(feed):
+    '''{kind: number of changes}.'''
+    counts = {}
+    for c in feed:
+        counts[c.kind] = counts.get(c.kind, 0) + 1
+    return counts
+
+
+
+def candidate_values(candidates, player_objs):
+    '''{player key: [cost, score of each of the four variants, club]} from
+    optimize_roster.get_player_stats output.'''
+    keys = [key(p) for p in player_objs]
+    values = {}
+
+    for c in candidates:
+        k = keys[c['pid'] - 1]
+        if k not in values:
+            values[k] = [c['cost'], 0., 0., 0., 0., c['club']]
+        values[k][1 + _variants.index((c['bench'], c['captain']))] = \
+            c['score']
+
+    return values
+
+
+
+class SolveRecord(object):
+    '''The last solved roster and the candidate values it was solved
+    over.'''
+
+    def __init__(self, path, budget=None, solver=None, values=None,
+        chosen=None, rules=None):
+        self.path = path
+        self.budget = budget
+        self.solver = solver
+        self.rules = rules or []        # source of every league rule
+        self.values = values or {}
+        self.chosen = chosen or []      # [player key, bench, captain]
+
+    @classmethod
+    def load(cls, path):
+        '''Record saved at `path`, or an empty one.'''
+        if not os.path.exists(path):
+            return cls(path)
+
+        with open(path) as fh:
+            data = json.load(fh)
+
+        return cls(path, data['budget'], data['solver'], data['values'],
+            [tuple(c) for c in data['chosen']], data.get('rules'))
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({
+                'budget' : self.budget,
+                'solver' : self.solver,
+                'values' : self.values,
+                'chosen' : self.chosen,
+                'rules' : self.rules
+            }, fh)
+        os.rename(tmp, self.path)
+
+    def remember(self, roster, candidates, player_objs, budget, solver,
+        rules=()):
+        '''Record `roster`, the chosen candidates, as the solution.'''
+        keys = [key(p) for p in player_objs]
+
+        self.budget = budget
+        self.solver = solver
+        self.rules = [r.source for r in rules]
+        self.values = candidate_values(candidates, player_objs)
+        self.chosen = [(keys[c['pid'] - 1], c['bench'], c['captain'])
+            for c in roster]
+
+    def still_optimal(self, candidates, player_objs, budget, solver,
+        rules=()):
+        '''(True, '') if the recorded roster is still optimal over
+        `candidates`, else (False, reason).'''
+        if not self.chosen:
+            return False, "nothing solved before"
+        if budget != self.budget or solver != self.solver:
+            return False, "budget or solver changed"
+        if [r.source for r in rules] != self.rules:
+            return False, "league rules changed"
+
+        values = candidate_values(candidates, player_objs)
+        chosen = dict((k, 1 + _variants.index((bench, captain)))
+            for k, bench, captain in self.chosen)
+
+        if any(k not in values for k in chosen):
+            return False, "a chosen player left the pool"
+        if sum(values[k][0] for k in chosen) > budget:
+            return False, "the roster no longer fits the budget"
+
+        for k, now in values.iteritems():
+            then = self.values.get(k)
+            if then is None:
+                return False, "new player %s" % k
+            if now[0] < then[0]:
+                return False, "price drop for %s" % k
+            if rules and (now[0] != then[0] or now[5:] != then[5:]):
+                # League rules may count clubs or cap prices
+                return False, "price or club change for %s" % k
+
+            for i in range(1, 5):
+                if chosen.get(k) == i:
+                    if now[i] < then[i]:
+                        return False, "score drop for chosen %s" % k
+                elif now[i] > then[i]:
+                    return False, "score rise for %s" % k
+
+        return True, ''
+
+    def roster(self, candidates, player_objs):
+        '''The recorded roster as candidates of the current pool.'''
+        keys = [key(p) for p in player_objs]
+        chosen = set(self.chosen)
+
+        return [c for c in candidates
+            if (keys[c['pid'] - 1], c['bench'], c['captain']) in chosen]
@@ -100,7 +100,13 @@ import urllib2
 import cookielib
 import re
 import json
-from bs4 import BeautifulSoup as bs
+import time
+import os
+import urlparse
+import transport
+import metrics
+import changes
+from replay import FixtureArchive, RecordProcessor, ReplayHandler
 from getpass import getpass
 from sys import stderr, exit
 
@@ -134,6 +140,12 @@ class Player(object):
             )
 
 
+def bs(markup):
+    '''Parse markup with BeautifulSoup, which is imported on first use so
+    that runs served entirely from cache don't pay for it.'''
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(markup)
+
 def toInt(v):
     _d = re.sub(r'[^\d]', '', v)
     if not len(_d):
@@ -164,6 +176,12 @@ def get_by_tag(soup, tag):
         return el.text.encode('utf8')
     return ''
 
+def rebase_url(url, base_url):
+    '''Swap scheme and host of `url` for those of `base_url`.'''
+    parts = urlparse.urlsplit(url)
+    base = urlparse.urlsplit(base_url)
+    return urlparse.urlunsplit((base.scheme, base.netloc) + parts[2:])
+
 def retryq(msg="Try again?"):
     t = raw_input("%s " % msg).strip()
     return (t+"es")[:3].lower() == 'yes'
@@ -221,22 +239,56 @@ class Downloader(object):
 
 
 
-    def __init__(self, source=None, username='', password=''):
-        '''Source must be `espn` or `premierleague`.'''
+    def __init__(self, source=None, username='', password='',
+        cache_dir=None, record=None, replay=None, base_url=None):
+        '''Source must be `espn` or `premierleague`. If `cache_dir` is given
+        the last response for every page is kept there, so later runs can
+        revalidate it instead of downloading it again.
+        `record` and `replay` are paths to a fixture archive (see replay.py)
+        to write responses to, or to serve them from instead of the network.
+        `base_url` points every endpoint at another host, e.g. a local
+        fakeserver.py.'''
         self.username = username
         self.password = password
         self.source = source
 
+        # Whether a login may prompt for credentials, see `login`
+        self.interactive = True
+        self._logged_in = False
+
+        if base_url is not None:
+            self._espn_data = dict(self._espn_data,
+                url=rebase_url(self._espn_data['url'], base_url))
+            self._pl_data = dict(self._pl_data,
+                url=rebase_url(self._pl_data['url'], base_url),
+                login_url=rebase_url(self._pl_data['login_url'], base_url))
+
         self._cache = dict()
 
+        # One entry per HTTP request, see `print_fetch_report`
+        self.fetch_log = []
+
+        # Changes since the last fetch of every page parsed again, see
+        # changes.py, and the pages whose last fetch we know about
+        self.changes = []
+        self._known = set()
+
+        self.store = transport.ResponseStore(cache_dir)
         self.cookiejar = cookielib.CookieJar()
-        self.opener = urllib2.build_opener(
+
+        handlers = [
             urllib2.HTTPRedirectHandler(),
-            urllib2.HTTPHandler(debuglevel=0),
-            urllib2.HTTPSHandler(debuglevel=0),
             urllib2.HTTPCookieProcessor(self.cookiejar),
             urllib2.ProxyHandler()    # Auto-detect proxies
-        )
+        ] + transport.handlers(self.store)
+
+        if record is not None:
+            handlers.append(RecordProcessor(FixtureArchive(record),
+                self.store))
+        if replay is not None:
+            handlers.append(ReplayHandler(FixtureArchive(replay)))
+
+        self.opener = urllib2.build_opener(*handlers)
 
         self.opener.addheaders = [
             ('User-agent', 'Mozilla/5.0')
@@ -244,6 +296,85 @@ class Downloader(object):
 
 
 
+    def _fetch(self, url, data=None):
+        '''Open url (POSTing `data` if given) and read the whole body.
+        Returns (body, not_modified), where not_modified is True when the
+        server answered 304 and the body came from the response store.'''
+        start = time.time()
+
+        try:
+            with metrics.span('fetch', url=url):
+                resp = self.opener.open(url, data)
+                body = resp.read()
+        except urllib2.HTTPError as e:
+            self._log_fetch(url, e.code, time.time() - start, 0, 0)
+            raise
+
+        not_modified = getattr(resp, 'not_modified', False)
+
+        self._log_fetch(url, 304 if not_modified else resp.code,
+            time.time() - start, getattr(resp, 'wire_bytes', len(body)),
+            len(body))
+
+        return body, not_modified
+
+
+
+    def _log_fetch(self, url, status, seconds, wire_bytes, nbytes):
+        self.fetch_log.append({
+            'url' : url,
+            'status' : status,
+            'seconds' : seconds,
+            'wire_bytes' : wire_bytes,
+            'bytes' : nbytes
+        })
+
+
+
+    def _parse(self, url, body, not_modified, parser):
+        '''Run `parser` on `body`, unless the page is unchanged since it was
+        last parsed, in which case the stored result is returned.'''
+        if not_modified:
+            parsed = self.store.get_parsed(url)
+            if parsed is not None:
+                metrics.count('parses_skipped')
+                self._known.add(url)
+                return parsed
+
+        with metrics.span('parse', url=url):
+            parsed = parser(body)
+
+        previous = self.store.get_previous(url)
+        if previous is not None:
+            with metrics.span('diff', url=url):
+                self.changes += changes.diff(previous, parsed)
+            self._known.add(url)
+
+        self.store.set_parsed(url, parsed)
+
+        return parsed
+
+
+
+    def print_fetch_report(self, fh=stderr):
+        '''Print latency and transfer size of every request made so far.'''
+        row_format = "{:>6} {:>9} {:>10} {:>10}  {}"
+
+        print >>fh, row_format.format("Status", "Time (s)", "Wire (B)",
+            "Body (B)", "URL")
+
+        for f in self.fetch_log:
+            print >>fh, row_format.format(f['status'],
+                "%.3f" % f['seconds'], f['wire_bytes'], f['bytes'],
+                f['url'][:60])
+
+        print >>fh, row_format.format("Total",
+            "%.3f" % sum(f['seconds'] for f in self.fetch_log),
+            sum(f['wire_bytes'] for f in self.fetch_log),
+            sum(f['bytes'] for f in self.fetch_log), "")
+
+
+
     def get(self, position, source=None, season=None, adjustments=None):
         '''Retrieve data from remote site for given position'''
         if season is None:
@@ -280,9 +411,8 @@ class Downloader(object):
         # Execute request, should set a cookie when logged in
         success = True
         try:
-            html = self.opener\
-                .open(self._pl_data['login_url'], urllib.urlencode(data))\
-                .read()
+            html, _ = self._fetch(self._pl_data['login_url'],
+                urllib.urlencode(data))
 
         except urllib2.HTTPError as e:
             raise AccessError(\
@@ -294,6 +424,7 @@ class Downloader(object):
 
 
 
+    @metrics.timed('interpret_pl_data')
     def interpret_pl_data(self, data):
         '''Take raw data from the website as dict (via json) and expand it
         into more sensible player data.'''
@@ -354,10 +485,11 @@ class Downloader(object):
         if html is None:
             # Site hasn't been accessed yet
             try:
-                html = self.opener.open(url)
+                html, _ = self._fetch(url)
             except urllib2.HTTPError as e:
                 if e.code==403:
-                    logged_in = False
+                    # Forbidden means no session, nothing more to check
+                    return False
                 else:
                     # A non-403 error was received from PL site. This means
                     # an unknown login status (there was a separate issue)
@@ -390,6 +522,11 @@ class Downloader(object):
         '''Set up login to EPL site. Returns string retry, fail, or success.'''
         print >>stderr, "Need to log in to Premier League website."
 
+        if not self.interactive and \
+            (len(self.username)<1 or len(self.password)<1):
+            print >>stderr, "No username and password given, can't prompt."
+            return "fail"
+
         # Prompt for username / password as needed
         if len(self.username)<1:
             username = raw_input("Username> ").strip()
@@ -412,7 +549,7 @@ class Downloader(object):
         if not s:
             # couldn't log in.
             print >>stderr, "Login did not succeed."
-            retry = retryq()
+            retry = self.interactive and retryq()
             return "retry" if retry else "fail"
 
         else:
@@ -424,6 +561,39 @@ class Downloader(object):
 
 
 
+    def login(self):
+        '''Log in to the Premier League website unless the session already
+        is, prompting for anything not given to the constructor. With
+        `interactive` off it never prompts and fails instead, for
+        downloads on a background thread. Returns whether logged in.'''
+        if self._logged_in:
+            return True
+
+        logged_in = self._pl_test_login()
+        retry = True
+
+        while not logged_in and retry:
+            resp = self._pl_login_mediator()
+
+            if resp == 'success':
+                logged_in = True
+            elif resp == 'retry':
+                print >>stderr, "Retrying login ..."
+                retry = True
+            elif resp == 'fail':
+                print >>stderr, "Failed to get stats."
+                retry = False
+            else:
+                print >>stderr, "Unknown response:", resp
+                retry = False
+
+        if logged_in:
+            print >>stderr, "Successfully logged in."
+        self._logged_in = logged_in
+        return logged_in
+
+
+
     def get_pl(self, position, season=None, adjustments=None):
         '''Get players / stats for given position, saving adjustments in
         given file.'''
@@ -437,52 +607,31 @@ class Downloader(object):
             # Pl data is cached to limit server load
             player_data = self._cache['pldata']
         else:
-            # Try to connect to PL website 
-            
-            # Check login
-            logged_in = self._pl_test_login()
-            retry = True
-
-            while not logged_in and retry:
-                resp = self._pl_login_mediator()
-
-                if resp == 'success':
-                    logged_in = True
-                elif resp == 'retry':
-                    print >>stderr, "Retrying login ..."
-                    retry = True
-                elif resp == 'fail':
-                    print >>stderr, "Failed to get stats."
-                    retry = False
-                else:
-                    print >>stderr, "Unknown response:", resp
-                    retry = False
-
-            if not logged_in:
+            # Try to connect to PL website
+            if not self.login():
                 return []
-            else:
-                print >>stderr, "Successfully logged in."
-
-            # Get the actual site
-            html = self.opener.open(self._pl_data['url'])
-
-            # Successfully loaded PL website in `html` variable
-            soup = bs(html)
 
-            # Pull out JSON data
-            data_s = soup.find('script', attrs={'type':'application/json'})
-            data = json.loads(data_s.text.encode('utf8'))
-
-            # Comprehend data from the site
-            player_data = self.interpret_pl_data(data)
+            # Get the actual site. If it hasn't changed since the last
+            # fetch the players parsed from it last time are reused.
+            url = self._pl_data['url']
+            html, not_modified = self._fetch(url)
+            player_data = self._parse(url, html, not_modified,
+                self._parse_pl)
 
             # now cache data
             self._cache['pldata'] = player_data
 
         # Now `player_data` has all the info from the website, and it
         # is well-formatted as instances of Player.
-        if adjustments is not None:
-            self._pl_write_adjustments(adjustments, player_data)
+        # The adjustments file only needs writing once per pool, and not at
+        # all if no injury news changed since the last fetch
+        if adjustments is not None and \
+            self._cache.get('adjustments') != adjustments:
+            unchanged = self._pl_data['url'] in self._known and not any(
+                c.kind in changes.injury_kinds for c in self.changes)
+            if not (unchanged and os.path.exists(adjustments)):
+                self._pl_write_adjustments(adjustments, player_data)
+            self._cache['adjustments'] = adjustments
 
         # Return all players matching `position`
         position = position.lower()
@@ -492,6 +641,20 @@ class Downloader(object):
 
 
 
+    def _parse_pl(self, html):
+        '''Pull the JSON data out of the PL squad selection page.'''
+        soup = bs(html)
+
+        # Pull out JSON data
+        data_s = soup.find('script', attrs={'type':'application/json'})
+        data = json.loads(data_s.string.encode('utf8'))
+
+        # Comprehend data from the site
+        return self.interpret_pl_data(data)
+
+
+
+
     def _pl_write_adjustments(self, adjfile, player_data):
         # Write adjustments to external file
 
@@ -531,8 +694,15 @@ class Downloader(object):
 
         url = base_url % (season, position)
 
-        html = self.opener.open(url).read()
+        html, not_modified = self._fetch(url)
+
+        return self._parse(url, html, not_modified,
+            lambda html: self._parse_espn(html, pos_lbl))
+
+
 
+    def _parse_espn(self, html, pos_lbl):
+        '''Read Players out of an ESPN players table.'''
         soup = bs(html)
 
         rows = soup.find('tbody').find_all('tr')
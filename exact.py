@@ -0,0 +1,206 @@
+#-*-coding:utf8-*-
+'''
+exact.py
+
+Exact roster solver by dynamic programming over positions.
+
+---
+Works on the same candidates as the KSP model (see
+optimize_roster.get_player_stats) and finds a proven optimum for it:
+
+ 1. Within each position, drop players that are beaten on both cost and
+    score by at least as many other players as the squad has slots for
+    that position. They can never be part of an optimal squad.
+ 2. For every formation and every choice of the captain's position, each
+    position's subsets are reduced to the best value per cost (in tenths
+    of a million), and the four positions are combined with a max-plus
+    convolution over the budget.
+
+Within a squad, starters are the players who gain most from starting and
+the captain is whoever gains most from the armband. That is exact as long
+as bench and captain scores are proportional to the starter score, which
+is how get_player_stats builds them.
+
+The number of subsets grows quickly with the pool that survives step 1,
+so this is meant for small pools and as a reference for the other solvers
+(see benchmarks/solvers.py). Select it with `--solver exact`.
+
+---
+Joe Nudell
+'''
+
+from itertools import combinations
+import numpy as np
+
+
+positions = ['keeper', 'defender', 'midfielder', 'forward']
+squad_counts = {'keeper': 2, 'defender': 5, 'midfielder': 5, 'forward': 3}
+
+# Starters per position as (keeper, defender, midfielder, forward)
+formations = [(1, d, m, 10-d-m) for d in range(3, 6) for m in range(3, 6)
+    if 1 <= 10-d-m <= 3]
+
+
+
+class Result(object):
+    '''Just enough of openopt's result object for print_results.'''
+    def __init__(self, xf, ff, elapsed=None):
+        self.xf = xf
+        self.ff = ff
+        self.elapsed = elapsed
+
+
+
+def player_table(candidates):
+    '''Collapse the four candidates of every player into one row:
+    {pid: {position, cost, starter, sub, cap_starter, cap_sub}} where the
+    last four hold (score, name) of each variant.'''
+    table = {}
+
+    for c in candidates:
+        row = table.setdefault(c['pid'], {
+            'pid' : c['pid'],
+            'position' : c['position'],
+            'cost' : int(round(c['cost'] * 10))
+        })
+        key = ('cap_' if c['captain'] else '') \
+            + ('starter' if c['bench'] == 'starter' else 'sub')
+        row[key] = (c['score'], c['name'])
+
+    return table
+
+
+
+def prune(rows, slots):
+    '''Drop rows dominated (cheaper or equal and better or equal, one
+    strictly) by `slots` or more other rows.'''
+    kept = []
+    for r in rows:
+        beaten = 0
+        for o in rows:
+            if o is r:
+                continue
+            if o['cost'] <= r['cost'] and \
+                o['starter'][0] >= r['starter'][0] and \
+                (o['cost'] < r['cost'] or o['starter'][0] > r['starter'][0]):
+                beaten += 1
+                if beaten >= slots:
+                    break
+        if beaten < slots:
+            kept.append(r)
+    return kept
+
+
+
+def subset_value(subset, starters, captain):
+    '''Value and chosen candidate names for a position's subset when
+    `starters` of them start, with the captain among them if `captain`.'''
+    ranked = sorted(subset,
+        key=lambda r: r['starter'][0] - r['sub'][0], reverse=True)
+
+    roles = ['starter'] * starters + ['sub'] * (len(ranked) - starters)
+    value = sum(r[role][0] for r, role in zip(ranked, roles))
+
+    names = [r[role][1] for r, role in zip(ranked, roles)]
+
+    if captain:
+        gains = [r['cap_' + role][0] - r[role][0]
+            for r, role in zip(ranked, roles)]
+        i = int(np.argmax(gains))
+        value += gains[i]
+        names[i] = ranked[i]['cap_' + roles[i]][1]
+
+    return value, names
+
+
+
+def position_table(rows, size, starters, captain, budget):
+    '''Best value with cost <= c for every c in [0, budget], and the names
+    achieving it.'''
+    best = np.empty(budget + 1)
+    best.fill(-np.inf)
+    names = [None] * (budget + 1)
+
+    for subset in combinations(rows, size):
+        cost = sum(r['cost'] for r in subset)
+        if cost > budget:
+            continue
+        value, chosen = subset_value(subset, starters, captain)
+        if value > best[cost]:
+            best[cost] = value
+            names[cost] = chosen
+
+    # Make it "cost at most c" rather than "cost exactly c"
+    running = np.maximum.accumulate(best)
+    idx = np.maximum.accumulate(np.where(best == running,
+        np.arange(budget + 1), 0))
+
+    return running, [names[i] for i in idx]
+
+
+
+def convolve(a, b):
+    '''Max-plus convolution of two "cost at most" tables. Returns the
+    combined table and, per budget, how much of it went to `a`.'''
+    n = len(a)
+    out = np.empty(n)
+    out.fill(-np.inf)
+    split = np.zeros(n, dtype=int)
+
+    for c in range(n):
+        if a[c] == -np.inf:
+            continue
+        cand = a[c] + b[:n-c]
+        better = cand > out[c:]
+        out[c:][better] = cand[better]
+        split[c:][better] = c
+
+    return out, split
+
+
+
+def solve(candidates, budget=100.):
+    '''Optimal roster for `candidates`. Returns a Result whose `xf` holds the
+    chosen candidate names and `ff` the objective value.'''
+    budget = int(round(budget * 10))
+    table = player_table(candidates)
+
+    rows = dict((pos, prune([r for r in table.values()
+        if r['position'] == pos], squad_counts[pos])) for pos in positions)
+
+    tables = {}
+    def get_table(pos, starters, captain):
+        key = (pos, starters, captain)
+        if key not in tables:
+            tables[key] = position_table(rows[pos], squad_counts[pos],
+                starters, captain, budget)
+        return tables[key]
+
+    best_value, best_names = -np.inf, None
+
+    for formation in formations:
+        for cap_pos in positions:
+            parts = [get_table(pos, k, pos == cap_pos)
+                for pos, k in zip(positions, formation)]
+
+            acc, splits = parts[0][0], []
+            for values, _ in parts[1:]:
+                acc, split = convolve(acc, values)
+                splits.append(split)
+
+            if acc[budget] <= best_value:
+                continue
+
+            # Walk the splits back to each position's share of the budget
+            names, c = [], budget
+            for (values, chosen), split in reversed(zip(parts[1:], splits)):
+                names += chosen[c - split[c]]
+                c = split[c]
+            names += parts[0][1][c]
+
+            best_value, best_names = acc[budget], names
+
+    if best_names is None:
+        raise ValueError("No feasible roster within budget")
+
+    return Result(best_names, best_value)
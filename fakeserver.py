@@ -0,0 +1,285 @@
+#-*-coding:utf8-*-
+'''
+fakeserver.py
+
+Local stand-in for the ESPN and Premier League fantasy endpoints.
+
+---
+Serves a generated pool of players in the same shape as the real sites:
+
+ * /premier-fantasy/<season>/en_GB/format/ajax/getPlayersTable?slotID=N
+        ESPN players table for one position
+ * /PremierUser/j_spring_security_check
+        PL login. Sets a session cookie and redirects to the squad page.
+ * /a/squad/selection
+        PL squad selection page with the player JSON embedded. 403 without
+        a session cookie.
+
+Responses are gzipped when asked and carry an ETag, so revalidation works
+as it does against the real sites.
+
+Point a Downloader at it with `base_url`, or from the command line:
+    $ python fakeserver.py --port 8000 --latency .2 --error-rate .05
+    $ python optimize_roster.py --base-url http://localhost:8000 --nosolve
+
+---
+Joe Nudell
+'''
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import urlparse
+import hashlib
+import random
+import gzip
+import json
+import time
+import argparse
+from StringIO import StringIO
+from sys import stderr
+import synthetic
+
+
+clubs = synthetic.clubs
+
+# ESPN slot ids and PL element types per position
+_slots = {1: 'keepers', 3: 'defenders', 8: 'midfielders', 13: 'forwards'}
+_element_types = {'keepers': 1, 'defenders': 2, 'midfielders': 3,
+    'forwards': 4}
+
+
+def make_pool(n=600, seed=0):
+    '''Deterministic list of player dicts for the server to hand out.'''
+    pool = []
+
+    for p in synthetic.make_players(n, seed):
+        chance = p.chance_of_playing_next_round
+        pool.append({
+            'id' : p.id,
+            'first_name' : p.first_name,
+            'last_name' : p.last_name,
+            'position' : p.position,
+            'club' : clubs.index(p.club),
+            'opponent' : clubs.index(p.opponent),
+            'place' : p.place,
+            'cost' : p.cost,
+            'average_points' : p.average_points,
+            'total_points' : p.total_points,
+            'ownership' : p.ownership * 100,
+            'minutes' : p.minutes,
+            'chance' : None if chance == 1. else int(chance * 100),
+            'news' : p.news
+        })
+
+    return pool
+
+
+
+def espn_table(pool, position):
+    rows = []
+    ranked = sorted([p for p in pool if p['position']==position],
+        key=lambda p: -p['total_points'])
+
+    for rank, p in enumerate(ranked):
+        rows.append(
+            '<tr><td><span id="pFN">%s</span> <span id="pLN">%s</span>'
+            '<span class="player_team">%s</span>'
+            '<span class="player_opp">%s(%s)</span></td>'
+            '<td class="st-frnk">%d</td><td>%.1f%%</td>'
+            '<td class="st-fpts">%d</td><td class="st-favg">%.1f</td>'
+            '<td class="player_cost">&pound;%.1fm</td>'
+            '<td class="player_capChange">0.0</td></tr>' % (
+                p['first_name'], p['last_name'], clubs[p['club']],
+                clubs[p['opponent']], p['place'], rank + 1,
+                p['ownership'], p['total_points'], p['average_points'],
+                p['cost']))
+
+    return '<table><thead></thead><tbody>%s</tbody></table>' % ''.join(rows)
+
+
+
+def pl_selection(pool):
+    fields = ['id', 'first_name', 'second_name', 'element_type_id',
+        'team_id', 'now_cost', 'total_points', 'points_per_game',
+        'selected_by_percent', 'minutes', 'chance_of_playing_next_round',
+        'chance_of_playing_this_round', 'news']
+
+    el_info = [[p['id'], p['first_name'], p['last_name'],
+        _element_types[p['position']], p['club'], int(p['cost'] * 10),
+        p['total_points'], p['average_points'], p['ownership'],
+        p['minutes'], p['chance'], p['chance'], p['news']] for p in pool]
+
+    data = {
+        'elInfo' : el_info,
+        'elStat' : dict((f, i) for i, f in enumerate(fields)),
+        'teamInfo' : [{'short_name': c} for c in clubs]
+    }
+
+    return '<html><body><script type="application/json">%s</script>' \
+        '</body></html>' % json.dumps(data).replace('</', '<\\/')
+
+
+login_form = '<html><body><form><input id="id_password" type="password">' \
+    '</form></body></html>'
+
+
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, fmt,
+                *args)
+
+    def _reply(self, code, body='', headers=()):
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+
+        if code == 200 and self.headers.get('If-None-Match') == etag:
+            code, body = 304, ''
+
+        gzipped = code == 200 and \
+            'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+                gz.write(body)
+            body = buf.getvalue()
+
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        if code in (200, 304):
+            self.send_header('ETag', etag)
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay_or_fail(self):
+        '''Apply configured latency, return True if this request should
+        fail.'''
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.rnd.random() < self.server.error_rate:
+            self._reply(503, 'Service Unavailable')
+            return True
+
+        return False
+
+    def _logged_in(self):
+        return 'session=%s' % self.server.session \
+            in self.headers.get('Cookie', '')
+
+    def do_GET(self):
+        if self._delay_or_fail():
+            return
+
+        url = urlparse.urlsplit(self.path)
+        query = urlparse.parse_qs(url.query)
+
+        if url.path.endswith('/getPlayersTable'):
+            slot = int(query.get('slotID', ['0'])[0])
+            if slot not in _slots:
+                return self._reply(404, 'Unknown slot')
+            return self._reply(200,
+                espn_table(self.server.pool, _slots[slot]))
+
+        elif url.path == '/a/squad/selection':
+            if not self._logged_in():
+                return self._reply(403, login_form)
+            return self._reply(200, pl_selection(self.server.pool))
+
+        self._reply(404, 'Not found')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = urlparse.parse_qs(self.rfile.read(length))
+
+        if self._delay_or_fail():
+            return
+
+        if urlparse.urlsplit(self.path).path \
+            != '/PremierUser/j_spring_security_check':
+            return self._reply(404, 'Not found')
+
+        password = form.get('j_password', [''])[0]
+        if self.server.password is not None \
+            and password != self.server.password:
+            return self._reply(200, login_form)
+
+        self._reply(302, '', [
+            ('Set-Cookie', 'session=%s; Path=/' % self.server.session),
+            ('Location', '/a/squad/selection')
+        ])
+
+
+
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''Threaded local server. `latency` is seconds added to every request,
+    `error_rate` the fraction of requests answered with a 503. If `password`
+    is given only that password is accepted at login.'''
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), pool=None, latency=0.,
+        error_rate=0., password=None, seed=0, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeHandler)
+        self.pool = pool if pool is not None else make_pool(seed=seed)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.password = password
+        self.session = hashlib.sha1(str(seed)).hexdigest()[:16]
+        self.rnd = random.Random(seed)
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address
+
+    def start(self):
+        '''Serve from a background thread. Returns self.'''
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+        help="Interface to listen on")
+    parser.add_argument('--port', type=int, default=8000,
+        help="Port to listen on")
+    parser.add_argument('-n', '--players', type=int, default=600,
+        help="Size of generated player pool")
+    parser.add_argument('--latency', type=float, default=0.,
+        help="Seconds to wait before answering each request")
+    parser.add_argument('--error-rate', type=float, default=0.,
+        help="Fraction of requests to answer with 503")
+    parser.add_argument('--password', type=str, default=None,
+        help="Only accept this password at PL login")
+    parser.add_argument('--seed', type=int, default=0,
+        help="Random seed for the pool and for errors")
+
+    cli = parser.parse_args()
+
+    server = FakeServer((cli.host, cli.port),
+        pool=make_pool(cli.players, cli.seed), latency=cli.latency,
+        error_rate=cli.error_rate, password=cli.password, seed=cli.seed,
+        verbose=True)
+
+    print >>stderr, "Serving fake ESPN / PL endpoints on %s" % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,150 @@
+#-*-coding:utf8-*-
+'''
+fixtures.py
+
+Fixture difficulty: scale projections by who a player is up against next,
+and where.
+
+---
+Club strengths are estimated from the pool itself. A club's attack is the
+average points of its midfielders and forwards, its defence the average
+points of its keepers and defenders, both relative to the league average.
+
+From them a table is built once per pool, indexed by
+
+    (group, club, opponent, venue)
+
+where group 0 is attacking players and group 1 defensive ones, and venue 0
+is home and 1 away. Attackers do better against weak defences, defenders
+against weak attacks, by the strength ratio to the power `weight`. A
+player's average was earned against every other club, home and away about
+equally, so each row is divided by the club's average over all of its
+possible opponents, and home and away are `1 + home` and `1 - home`.
+
+Projecting the whole pool is then a single fancy-indexing lookup:
+`table.factors(players)` gives one multiplier per player (1 for players
+without a known opponent, e.g. from the EPL source).
+
+Tables are cached per pool in memory, and can be saved and loaded with
+`save` and `load`.
+
+Usage:
+>>> table = fixtures.table_for(players)
+>>> scores * table.factors(players)
+
+or `--fixtures` with optimize_roster.py.
+
+---
+Joe Nudell
+'''
+
+import hashlib
+import numpy as np
+import metrics
+
+
+groups = {
+    'forwards' : 0,
+    'midfielders' : 0,
+    'defenders' : 1,
+    'keepers' : 1
+}
+venues = {'H': 0, 'A': 1}
+
+
+
+class FixtureTable(object):
+    '''Multiplier for every (group, club, opponent, venue).'''
+
+    def __init__(self, clubs, matrix):
+        self.clubs = list(clubs)
+        self.matrix = matrix
+        self._index = dict((c, i) for i, c in enumerate(self.clubs))
+
+    def factors(self, players):
+        '''Fixture multiplier of every player, as an array.'''
+        n = len(players)
+        g = np.zeros(n, dtype=int)
+        c = np.zeros(n, dtype=int)
+        o = np.zeros(n, dtype=int)
+        v = np.zeros(n, dtype=int)
+        known = np.zeros(n, dtype=bool)
+
+        for i, p in enumerate(players):
+            club = self._index.get(p.club)
+            opp = self._index.get(p.get('opponent'))
+            venue = venues.get(p.get('place'))
+
+            if club is None or opp is None or venue is None:
+                continue
+
+            g[i], c[i], o[i], v[i] = groups[p.position], club, opp, venue
+            known[i] = True
+
+        return np.where(known, self.matrix[g, c, o, v], 1.)
+
+    def save(self, path):
+        np.savez(path, clubs=np.array(self.clubs, dtype=object),
+            matrix=self.matrix)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=True)
+        return cls(list(data['clubs']), data['matrix'])
+
+
+
+def strengths(players, clubs):
+    '''(attack, defence) arrays over `clubs`, relative to the league.'''
+    index = dict((c, i) for i, c in enumerate(clubs))
+    totals = np.zeros((2, len(clubs)))
+    counts = np.zeros((2, len(clubs)))
+
+    for p in players:
+        g = groups[p.position]
+        totals[g, index[p.club]] += float(p.average_points)
+        counts[g, index[p.club]] += 1
+
+    means = totals / np.maximum(counts, 1)
+    league = means.mean(1, keepdims=True)
+
+    return means / np.where(league > 0, league, 1.)
+
+
+
+@metrics.timed('fixture_table')
+def build(players, home=.1, weight=.5):
+    '''Build the FixtureTable for a pool of players.'''
+    clubs = sorted(set(p.club for p in players))
+    n = len(clubs)
+    attack, defence = np.maximum(strengths(players, clubs), 1e-3)
+
+    # Opposition factor for attackers (their defence) and defenders (their
+    # attack), same for every club before normalizing
+    against = np.array([(1. / defence) ** weight, (1. / attack) ** weight])
+    raw = np.repeat(against[:, None, :], n, axis=1)
+
+    # Normalize each club's row by its schedule of every other club
+    others = 1. - np.eye(n)
+    schedule = (raw * others).sum(2) / (n - 1)
+    relative = raw / schedule[:, :, None]
+
+    matrix = np.empty((2, n, n, 2))
+    matrix[..., 0] = relative * (1. + home)
+    matrix[..., 1] = relative * (1. - home)
+
+    return FixtureTable(clubs, matrix)
+
+
+
+_cache = {}
+
+def table_for(players, home=.1, weight=.5):
+    '''FixtureTable for `players`, built once per distinct pool.'''
+    key = hashlib.sha1(repr((home, weight, sorted((p.club, p.position,
+        float(p.average_points)) for p in players)))).hexdigest()
+
+    if key not in _cache:
+        _cache[key] = build(players, home=home, weight=weight)
+
+    return _cache[key]
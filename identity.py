@@ -0,0 +1,228 @@
+#-*-coding:utf8-*-
+'''
+identity.py
+
+Persistent mapping between ESPN players and EPL fantasy player ids.
+
+---
+The two sources spell names differently and ESPN has no player ids, so
+until now the only join was `roster.player_in_roster`, which scans the
+other list with a few name heuristics every time and misses players those
+heuristics don't cover.
+
+The index is built once and kept on disk. Players are keyed on the ESPN
+side by normalized first name, last name and club. Matching blocks by club
+first: within a club, every unmatched ESPN player is compared with every
+unmatched EPL player by the overlap (Jaccard) of the character trigrams of
+their names, with accents stripped (see `similarity`), and pairs are taken
+best first, one to one, above `threshold`. Players still unmatched
+afterwards (e.g. because of a transfer between clubs) are tried once more
+against the whole remaining pool with a stricter threshold.
+
+`update` only looks at players the index doesn't know yet, so after the
+first run of a season keeping it current costs next to nothing, and joins
+are dict lookups. Ids whose ESPN key has disappeared (a transferred player
+under his old club) are free to be matched again, and the stale key is
+dropped when they are.
+
+Usage:
+>>> index = identity.IdentityIndex('ids-2014.json', season=2014)
+>>> index.update(espn_players, pl_players)
+>>> index.save()
+>>> for espn, pl in index.join(espn_players, pl_players): ...
+
+---
+Joe Nudell
+'''
+
+from sys import stderr
+import metrics
+import unicodedata
+import json
+import os
+import re
+
+
+# Stricter bar when matching across clubs
+cross_club_threshold = .75
+
+
+
+def normalize(s):
+    '''Lower case ASCII letters and digits only, accents stripped.'''
+    if isinstance(s, str):
+        s = s.decode('utf8', 'replace')
+    s = unicodedata.normalize('NFKD', s).encode('ascii', 'ignore')
+    return re.sub(r'[^\w]', '', s.lower())
+
+
+
+def espn_key(player):
+    return "%s|%s|%s" % (normalize(player.first_name),
+        normalize(player.last_name), normalize(player.club))
+
+
+
+def _trigrams(s):
+    s = "  %s " % s
+    return frozenset(s[i:i+3] for i in range(len(s) - 2))
+
+
+
+class Name(object):
+    '''Trigram sets of a player's name, computed once.'''
+
+    def __init__(self, player):
+        first = normalize(player.first_name)
+        last = normalize(player.last_name)
+
+        self.full = _trigrams(first + last)
+        self.last = _trigrams(last) if last else None
+        self.initial = first[:1]
+        words = re.split(r'[\s\-]+', u"%s %s" % (player.first_name,
+            player.last_name))
+        self.tokens = [_trigrams(normalize(w)) for w in words
+            if normalize(w)]
+        # Players known by one name, e.g. Oscar
+        self.mononym = not first or not last
+
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.
+    return len(a & b) / float(len(a | b))
+
+
+
+def similarity(a, b):
+    '''Name similarity in [0, 1]: the trigram overlap of full names, or a
+    little less for a matching last name with compatible initials, or a
+    one-word name matching any word of the other name.'''
+    score = jaccard(a.full, b.full)
+
+    if a.last and b.last and (not a.initial or not b.initial
+        or a.initial == b.initial):
+        score = max(score, .9 * jaccard(a.last, b.last))
+
+    for x, y in ((a, b), (b, a)):
+        if x.mononym:
+            score = max([score] + [.9 * jaccard(x.full, t)
+                for t in y.tokens])
+
+    return score
+
+
+
+def _assign(espn, pl, threshold):
+    '''Greedy one-to-one matching of [(key, Name)] against [(id, Name)],
+    best pairs first. Returns {key: (id, score)}.'''
+    pairs = []
+    for key, a in espn:
+        for pid, b in pl:
+            score = similarity(a, b)
+            if score >= threshold:
+                pairs.append((score, key, pid))
+
+    pairs.sort(reverse=True)
+    matched, taken = {}, set()
+
+    for score, key, pid in pairs:
+        if key in matched or pid in taken:
+            continue
+        matched[key] = (pid, score)
+        taken.add(pid)
+
+    return matched
+
+
+
+class IdentityIndex(object):
+    '''ESPN key -> EPL id mapping for one season, stored as JSON.'''
+
+    def __init__(self, path=None, season=None, threshold=.5):
+        self.path = path
+        self.season = season
+        self.threshold = threshold
+        self.ids = dict()
+        self.scores = dict()
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path) as fh:
+            data = json.load(fh)
+
+        if self.season is not None and data.get('season') != self.season:
+            print >>stderr, "Warning: identity index %s is for season %s, " \
+                "starting over" % (self.path, data.get('season'))
+            return
+
+        self.ids = data['ids']
+        self.scores = data['scores']
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({
+                'season' : self.season,
+                'ids' : self.ids,
+                'scores' : self.scores
+            }, fh, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    @metrics.timed('identity_update')
+    def update(self, espn_players, pl_players):
+        '''Match ESPN players not in the index yet. Returns the number of
+        new matches.'''
+        # Ids of keys no longer among the ESPN players (e.g. the old club of
+        # a transferred player) can be claimed again
+        current = set(espn_key(p) for p in espn_players)
+        taken = set(pid for key, pid in self.ids.items() if key in current)
+        new_espn = [p for p in espn_players if espn_key(p) not in self.ids]
+        new_pl = [p for p in pl_players if p.id not in taken]
+
+        if not new_espn:
+            return 0
+
+        by_club = {}
+        for p in new_pl:
+            by_club.setdefault(normalize(p.club), []).append(p)
+
+        matched = {}
+        for club in set(normalize(p.club) for p in new_espn):
+            matched.update(_assign(
+                [(espn_key(p), Name(p)) for p in new_espn
+                    if normalize(p.club) == club],
+                [(p.id, Name(p)) for p in by_club.get(club, [])],
+                self.threshold))
+
+        # Second chance across clubs for whoever is left
+        used = set(pid for pid, _ in matched.values())
+        matched.update(_assign(
+            [(espn_key(p), Name(p)) for p in new_espn
+                if espn_key(p) not in matched],
+            [(p.id, Name(p)) for p in new_pl if p.id not in used],
+            max(self.threshold, cross_club_threshold)))
+
+        claimed = set(pid for pid, _ in matched.values())
+        for key in [k for k, pid in self.ids.items() if pid in claimed]:
+            del self.ids[key]
+            self.scores.pop(key, None)
+
+        for key, (pid, score) in matched.items():
+            self.ids[key] = pid
+            self.scores[key] = round(score, 3)
+
+        metrics.count('identity_matched', len(matched))
+        return len(matched)
+
+    def lookup(self, espn_player):
+        '''EPL id of an ESPN player, or None.'''
+        return self.ids.get(espn_key(espn_player))
+
+    def join(self, espn_players, pl_players):
+        '''(espn player, EPL player or None) for every ESPN player.'''
+        by_id = dict((p.id, p) for p in pl_players)
+        return [(p, by_id.get(self.lookup(p))) for p in espn_players]
@@ -0,0 +1,328 @@
+#-*-coding:utf8-*-
+'''
+league.py
+
+Where every team of a league finishes: chances of each final rank, and of
+finishing ahead of a rival, over simulated gameweeks.
+
+---
+Player points are drawn as in simulate.py. Every team keeps its roster for
+the `weeks` gameweeks left, so its final total in a scenario is its
+`current` points plus the sum over those gameweeks. Rosters are rows of
+one sparse (teams x players) incidence matrix holding the weight each
+player is picked with (1 for starters, `captain` for the captain, `bench`
+for substitutes), so the totals of every team in a chunk of scenarios are
+one sparse-dense product.
+
+Each chunk's totals are sorted per scenario, and a team's rank is 1 plus
+the number of teams strictly ahead of it (teams level share a rank). Per
+team only running sums are kept: of totals and ranks, how often it won,
+finished in the top `top` share, and beat the `rival` (a draw counts
+half), plus a histogram of ranks in at most `rank_bins` bins. So memory
+grows with teams, not scenarios.
+
+Chunks are drawn from seeds derived from `seed` and the chunk number, as
+in simulate.py, so results don't depend on the number of processes. With
+`processes`, workers read the incidence matrix and distributions from
+shared memory (see shared.py).
+
+Usage:
+>>> dist = simulate.distributions(players)
+>>> idx, weights = simulate.encode(rosters, players)
+>>> summary = league.simulate_league(dist, idx, weights,
+...     scenarios=10000, weeks=5, rival=0, processes=4)
+>>> summary['p_first'], summary['rank_percentiles'], summary['p_ahead']
+
+From the command line, with roster files (or directories of them):
+    $ python league.py myteam.txt league/ --rival myteam.txt -n 10000
+
+---
+Joe Nudell
+'''
+
+from multiprocessing import Pool
+from sys import stderr
+from roster import read_team_file, roster_files
+from simulate import distributions, sample, encode, _percentiles, \
+    _positions
+import eplstats
+import metrics
+import shared
+import numpy as np
+import scipy.sparse as sp
+import argparse
+import codecs
+import json
+import os
+
+
+percentiles = [5, 50, 95]
+
+
+
+def incidence(idx, weights, n):
+    '''(teams x n players) sparse matrix of the weights from
+    simulate.encode.'''
+    teams = np.repeat(np.arange(len(idx)), idx.shape[1])
+    W = sp.csr_matrix((weights.ravel(), (teams, idx.ravel())),
+        shape=(len(idx), n))
+    W.eliminate_zeros()
+    return W
+
+
+
+def ranks(totals):
+    '''Ranks of the columns of every row of (scenarios, teams) totals: 1
+    plus the number of teams with more points.'''
+    T = totals.shape[1]
+    ordered = np.sort(totals, axis=1)
+    out = np.empty(totals.shape, dtype=np.int32)
+
+    for s in range(len(totals)):
+        out[s] = T + 1 - np.searchsorted(ordered[s], totals[s], side='right')
+
+    return out
+
+
+
+def _league_chunk(args):
+    '''Scenarios of one chunk. Returns per team the sums of totals, squared
+    totals and ranks, counts of wins, top finishes and finishes ahead of
+    the rival (draws count half), and a rank histogram.'''
+    data, scenarios, seed, dispersion, weeks, rival, top, bins = args
+
+    # Workers get the arrays as a shared.Handle
+    if isinstance(data, shared.Handle):
+        data = shared.attach(data)
+
+    dist = {'play': data['play'], 'mean': data['mean']}
+    W = sp.csr_matrix((data['W_data'], data['W_indices'], data['W_indptr']),
+        shape=(len(data['current']), len(dist['mean'])))
+    T = W.shape[0]
+
+    points = sample(dist, scenarios, seed=seed + [0], dispersion=dispersion)
+    for week in range(1, weeks):
+        points += sample(dist, scenarios, seed=seed + [week],
+            dispersion=dispersion)
+
+    # Rounded so that equal points compare equal whatever the order the
+    # weights were summed in
+    totals = np.round(W.dot(points.T.astype(float)).T + data['current'], 6)
+    r = ranks(totals)
+
+    b = (r - 1) * bins // T + np.arange(T) * bins
+    hist = np.bincount(b.ravel(), minlength=T * bins).reshape(T, bins)
+
+    ahead = np.zeros(T)
+    if rival is not None:
+        mine = totals[:, [rival]]
+        ahead = (totals > mine).sum(0) + .5 * (totals == mine).sum(0)
+
+    return {
+        'sums' : totals.sum(0),
+        'squares' : (totals ** 2).sum(0),
+        'rank_sums' : r.sum(0, dtype=float),
+        'first' : (r == 1).sum(0),
+        'top' : (r <= top).sum(0),
+        'ahead' : ahead,
+        'hist' : hist
+    }
+
+
+
+def simulate_league(dist, idx, weights, scenarios=10000, seed=0,
+    dispersion=2., weeks=1, current=None, rival=None, top=.1,
+    rank_bins=100, scenario_chunk=500, processes=None, q=percentiles):
+    '''Final standings of rosters (idx, weights) from simulate.encode over
+    `scenarios` runs of `weeks` gameweeks. `current` are points so far,
+    `rival` the index of a team to compare against and `top` the share of
+    the league counted as a top finish. Returns a dict of arrays over
+    teams: mean, std, mean_rank, p_first, p_top, p_ahead (NaN without a
+    rival), rank_percentiles (one column per entry of `q`) and rank_hist
+    (probability of each rank bin; bin k covers ranks from
+    k * teams / bins + 1).'''
+    T = len(idx)
+    bins = min(rank_bins, T)
+    top_rank = max(1, int(np.ceil(top * T)))
+
+    W = incidence(idx, weights, len(dist['mean']))
+    data = {
+        'play' : dist['play'],
+        'mean' : dist['mean'],
+        'current' : np.zeros(T) if current is None
+            else np.asarray(current, dtype=float),
+        'W_data' : W.data,
+        'W_indices' : W.indices,
+        'W_indptr' : W.indptr
+    }
+    parallel = processes and scenarios > scenario_chunk
+
+    # Processes read the arrays from shared memory instead of getting a
+    # pickled copy with every chunk
+    handle = shared.share(data) if parallel else None
+
+    tasks = [(handle or data, min(scenario_chunk, scenarios - start),
+        [seed, c], dispersion, weeks, rival, top_rank, bins)
+        for c, start in enumerate(range(0, scenarios, scenario_chunk))]
+
+    acc = None
+    with metrics.span('simulate_league', teams=T, scenarios=scenarios):
+        if parallel:
+            pool = Pool(processes)
+            try:
+                results = pool.imap(_league_chunk, tasks)
+                for result in results:
+                    acc = _add(acc, result)
+            finally:
+                pool.close()
+                pool.join()
+                handle.unlink()
+        else:
+            for task in tasks:
+                acc = _add(acc, _league_chunk(task))
+
+    metrics.count('team_scenarios', scenarios * T)
+
+    mean = acc['sums'] / scenarios
+    var = np.maximum(acc['squares'] / scenarios - mean ** 2, 0.)
+
+    # Bins are T / bins ranks wide; a percentile falling in the k-th rank
+    # of the league is rank k
+    rank_pct = np.ceil(_percentiles(acc['hist'], q, float(T) / bins))
+
+    return {
+        'mean' : mean,
+        'std' : np.sqrt(var),
+        'mean_rank' : acc['rank_sums'] / scenarios,
+        'p_first' : acc['first'] / float(scenarios),
+        'p_top' : acc['top'] / float(scenarios),
+        'top_rank' : top_rank,
+        'p_ahead' : acc['ahead'] / scenarios if rival is not None
+            else np.full(T, np.nan),
+        'rank_percentiles' : np.clip(rank_pct, 1, T),
+        'rank_hist' : acc['hist'] / float(scenarios),
+        'q' : list(q)
+    }
+
+
+
+def _add(acc, result):
+    if acc is None:
+        return result
+    return dict((k, acc[k] + result[k]) for k in acc)
+
+
+
+def print_standings(summary, labels, fh=None):
+    '''Table of teams by expected final rank.'''
+    row_format = u"{:<30}{:>9}{:>8}{:>10}{:>8}{:>9}{:>9}" + \
+        u"{:>7}" * len(summary['q'])
+
+    print >>fh, row_format.format("Team", "Mean", "Std", "Exp. rank",
+        "P(1st)", "P(top)", "P(>riv)", *["R%d" % q for q in summary['q']])
+
+    for i in np.argsort(summary['mean_rank'], kind='mergesort'):
+        ahead = summary['p_ahead'][i]
+        print >>fh, row_format.format(labels[i][-30:],
+            "%.1f" % summary['mean'][i], "%.1f" % summary['std'][i],
+            "%.1f" % summary['mean_rank'][i],
+            "%.3f" % summary['p_first'][i], "%.3f" % summary['p_top'][i],
+            "-" if np.isnan(ahead) else "%.3f" % ahead,
+            *["%.0f" % r for r in summary['rank_percentiles'][i]])
+
+    print >>fh, "\nP(top) is finishing in the top %d." % summary['top_rank']
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('rosters', type=str, nargs='+',
+        help="Roster files of the league, or directories of them")
+    parser.add_argument('--rival', type=str, default=None,
+        help="Roster file of the team to beat")
+    parser.add_argument('--points', type=str, default=None,
+        help="JSON file of points so far, {roster file: points}")
+    parser.add_argument('--weeks', type=int, default=1,
+        help="Gameweeks left to simulate")
+    parser.add_argument('-n', '--scenarios', type=int, default=10000,
+        help="Number of simulated seasons")
+    parser.add_argument('--seed', type=int, default=0,
+        help="Random seed for the scenarios")
+    parser.add_argument('--dispersion', type=float, default=2.,
+        help="Gamma shape of points; smaller means more variance")
+    parser.add_argument('--top', type=float, default=.1,
+        help="Share of the league that counts as a top finish")
+    parser.add_argument('--processes', type=int, default=None,
+        help="Simulate scenario chunks in this many processes")
+    parser.add_argument('-e', '--bench', type=float, default=.1,
+        help="Weight of substitutes' points")
+    parser.add_argument('-c', '--captain', type=float, default=2.,
+        help="Multiplier of the captain's points")
+    parser.add_argument('-y', '--season', type=int, default=2014,
+        help="ESPN endpoint only currently supports 2014 season")
+    parser.add_argument('-u', '--username', type=str, default='',
+        help="Username (for official EPL site)")
+    parser.add_argument('-p', '--password', type=str, default='',
+        help="Password (for official EPL site)")
+    parser.add_argument('-w', '--source', type=str, default='espn',
+        help="Stats source website. ESPN and EPL are supported.")
+    parser.add_argument('-C', '--cache', type=str, default=None,
+        help="Directory to keep downloaded pages in for revalidation")
+    parser.add_argument('--replay', type=str, default=None,
+        help="Replay responses from this fixture archive, offline")
+    parser.add_argument('--base-url', type=str, default=None,
+        help="Send requests to this host instead (see fakeserver.py)")
+    parser.add_argument('--metrics', type=str, default=None,
+        help="Write stage timings and counters to this JSON file")
+
+    cli = parser.parse_args()
+
+    files = roster_files(cli.rosters)
+    rival = None
+    if cli.rival is not None:
+        if cli.rival not in files:
+            files.append(cli.rival)
+        rival = files.index(cli.rival)
+
+    current = None
+    if cli.points is not None:
+        with open(cli.points) as fh:
+            points = json.load(fh)
+        current = [points.get(fn, points.get(os.path.basename(fn), 0.))
+            for fn in files]
+
+    print >>stderr, "Fetching stats from %s ..." % cli.source
+    downloader = eplstats.Downloader(source=cli.source,
+        username=cli.username, password=cli.password, cache_dir=cli.cache,
+        replay=cli.replay, base_url=cli.base_url)
+
+    players = []
+    for position in _positions:
+        players += downloader.get(position, source=cli.source,
+            season=cli.season)
+    print >>stderr, "Done."
+
+    rosters = []
+    for fn in files:
+        with codecs.open(fn, 'r', 'utf8') as fh:
+            rosters.append(read_team_file(fh))
+
+    idx, weights = encode(rosters, players, bench=cli.bench,
+        captain=cli.captain)
+
+    print >>stderr, "Simulating %d seasons of %d gameweeks for %d teams " \
+        "..." % (cli.scenarios, cli.weeks, len(files))
+    summary = simulate_league(distributions(players), idx, weights,
+        scenarios=cli.scenarios, seed=cli.seed, dispersion=cli.dispersion,
+        weeks=cli.weeks, current=current, rival=rival, top=cli.top,
+        processes=cli.processes)
+
+    print
+    print_standings(summary, files)
+    print
+
+    if cli.metrics is not None:
+        metrics.report()
+        metrics.dump(cli.metrics)
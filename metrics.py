@@ -0,0 +1,147 @@
+#-*-coding:utf8-*-
+'''
+metrics.py
+
+Lightweight timers and counters for finding out where a run spends its time.
+
+---
+Usage:
+>>> with metrics.span('fetch', url=url):
+...     html = opener.open(url).read()
+>>> metrics.count('candidates', len(players))
+>>> metrics.report()                 # summary table on stderr
+>>> metrics.dump('metrics.json')     # every span and counter as JSON
+
+Functions can be timed as a whole with the `timed` decorator. Spans nest;
+each one records the names of the spans it was opened inside of.
+
+Recording is always on. It costs a couple of microseconds per span, which
+is nothing next to an HTTP request or a solve.
+
+---
+Joe Nudell
+'''
+
+from contextlib import contextmanager
+from functools import wraps
+from sys import stderr
+import threading
+import json
+import time
+
+
+# Module-level registry. One run of a tool is one set of metrics. Spans
+# nest per thread, so downloads running side by side don't adopt each other.
+_spans = []
+_counters = {}
+_local = threading.local()
+_lock = threading.Lock()
+_epoch = time.time()
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def reset():
+    global _epoch
+    del _spans[:]
+    del _stack()[:]
+    _counters.clear()
+    _epoch = time.time()
+
+
+
+@contextmanager
+def span(name, **attrs):
+    '''Time the enclosed block under `name`. Extra keyword arguments are
+    stored with the span.'''
+    start = time.time()
+    stack = _stack()
+    stack.append(name)
+
+    try:
+        yield
+    finally:
+        stack.pop()
+        _spans.append({
+            'name' : name,
+            'parents' : list(stack),
+            'start' : start - _epoch,
+            'seconds' : time.time() - start,
+            'attrs' : attrs
+        })
+
+
+
+def timed(name):
+    '''Decorator version of `span`.'''
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+
+def count(name, n=1):
+    '''Add `n` to counter `name`.'''
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+
+def summary():
+    '''Aggregate spans by name: calls, total, mean and max seconds.'''
+    stages = {}
+
+    for s in _spans:
+        st = stages.setdefault(s['name'], {
+            'calls' : 0,
+            'total' : 0.,
+            'max' : 0.
+        })
+        st['calls'] += 1
+        st['total'] += s['seconds']
+        st['max'] = max(st['max'], s['seconds'])
+
+    for st in stages.values():
+        st['mean'] = st['total'] / st['calls']
+
+    return stages
+
+
+
+def report(fh=stderr):
+    '''Print the summary and counters, slowest stage first.'''
+    row_format = "{:<24}{:>7}{:>11}{:>11}{:>11}"
+
+    print >>fh, row_format.format("Stage", "Calls", "Total (s)",
+        "Mean (s)", "Max (s)")
+
+    stages = summary()
+    for name in sorted(stages, key=lambda n: -stages[n]['total']):
+        st = stages[name]
+        print >>fh, row_format.format(name, st['calls'],
+            "%.4f" % st['total'], "%.4f" % st['mean'], "%.4f" % st['max'])
+
+    if _counters:
+        print >>fh, ""
+        for name in sorted(_counters):
+            print >>fh, "{:<24}{:>7}".format(name, _counters[name])
+
+
+
+def dump(fn):
+    '''Write spans, summary and counters to `fn` as JSON.'''
+    with open(fn, 'w') as fh:
+        json.dump({
+            'wall' : time.time() - _epoch,
+            'stages' : summary(),
+            'counters' : _counters,
+            'spans' : _spans
+        }, fh, indent=2, sort_keys=True, default=str)
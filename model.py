@@ -0,0 +1,147 @@
+#-*-coding:utf8-*-
+'''
+model.py
+
+The roster problem as a sparse mixed integer program.
+
+---
+`roster_model` writes the same rules as the KSP constraints in
+optimize_roster.solve_roster (budget, squad shape, formation, one captain,
+each player at most once) as sparse matrices over the candidates returned
+by optimize_roster.get_player_stats. There is one column per candidate and
+one uniqueness row per player, so the model grows linearly with the pool
+rather than with pool size squared like the KSP `id%d` fields.
+
+Other formulations add their own columns and rows to the right of and below
+these (see robust.py) and hand the lot to `solve_milp`.
+
+Usage:
+>>> m = model.roster_model(candidates, budget=100.)
+>>> r = model.solve_milp(m['f'], m['A'], m['b'], m['Aeq'], m['beq'],
+...     lb=0., ub=1., int_vars=range(m['n']))
+
+---
+Joe Nudell
+'''
+
+import numpy as np
+import scipy.sparse as sp
+import metrics
+
+
+# (position, starters min, starters max, squad total)
+squad_shape = [
+    ('forward', 1, 3, 3),
+    ('midfielder', 3, 5, 5),
+    ('defender', 3, 5, 5),
+    ('keeper', 1, 1, 2)
+]
+substitutes = 4
+
+
+
+class Rows(object):
+    '''Accumulates sparse constraint rows as coordinate triplets.'''
+
+    def __init__(self):
+        self.rows = []
+        self.cols = []
+        self.vals = []
+        self.rhs = []
+
+    def add(self, cols, vals, rhs):
+        i = len(self.rhs)
+        self.rows += [i] * len(cols)
+        self.cols += list(cols)
+        self.vals += list(vals)
+        self.rhs.append(rhs)
+
+    def extend(self, other):
+        '''Append the rows of another Rows.'''
+        offset = len(self.rhs)
+        self.rows += [i + offset for i in other.rows]
+        self.cols += other.cols
+        self.vals += other.vals
+        self.rhs += other.rhs
+
+    def matrix(self, n):
+        return sp.csr_matrix((self.vals, (self.rows, self.cols)),
+            shape=(len(self.rhs), n)), np.array(self.rhs, dtype=float)
+
+
+
+def roster_model(candidates, budget=100., rules=None):
+    '''Objective and constraints of the roster problem over `candidates`.
+    Returns a dict with f (scores), A, b (A x <= b), Aeq, beq (Aeq x = beq),
+    n (number of columns), pids (player id of every column) and upper (upper
+    bound of every column). `rules` are extra league rules compiled by
+    rules.compile_rules.'''
+    n = len(candidates)
+    ub, eq = Rows(), Rows()
+    cols = np.arange(n)
+    ones = np.ones(n)
+
+    def field(name):
+        return np.array([c[name] for c in candidates], dtype=float)
+
+    ub.add(cols, field('cost'), budget)
+
+    for pos, lo, hi, total in squad_shape:
+        start, sub = field(pos), field('sub-' + pos)
+        on = cols[start > 0]
+
+        if lo == hi:
+            eq.add(on, ones[on], lo)
+        else:
+            ub.add(on, -ones[on], -lo)
+            ub.add(on, ones[on], hi)
+
+        both = cols[(start + sub) > 0]
+        eq.add(both, ones[both], total)
+
+    captains = cols[field('captain') > 0]
+    eq.add(captains, ones[captains], 1)
+
+    subs = cols[sum(field('sub-' + pos) for pos, _, _, _ in squad_shape) > 0]
+    eq.add(subs, ones[subs], substitutes)
+
+    # Every player at most once, whatever the role
+    pids = np.array([c['pid'] for c in candidates])
+    for pid in np.unique(pids):
+        mine = cols[pids == pid]
+        ub.add(mine, ones[mine], 1)
+
+    # League rules go below the standard ones
+    if rules is not None:
+        ub.extend(rules.ub)
+        eq.extend(rules.eq)
+
+    A, b = ub.matrix(n)
+    Aeq, beq = eq.matrix(n)
+
+    metrics.count('constraints', len(b) + len(beq))
+
+    return {
+        'f' : field('score'),
+        'A' : A,
+        'b' : b,
+        'Aeq' : Aeq,
+        'beq' : beq,
+        'n' : n,
+        'pids' : pids,
+        'upper' : rules.upper() if rules is not None else np.ones(n)
+    }
+
+
+
+def solve_milp(f, A, b, Aeq, beq, lb, ub, int_vars, solver='glpk',
+    **solver_args):
+    '''Maximize f.x subject to the given constraints with OpenOpt's MILP.
+    Returns openopt's solution object.'''
+    with metrics.span('build_model'):
+        from openopt import MILP
+        p = MILP(f=f, lb=lb, ub=ub, A=A, b=b, Aeq=Aeq, beq=beq,
+            intVars=int_vars, goal='max')
+
+    with metrics.span('solve', solver=solver):
+        return p.solve(solver, iprint=1, **solver_args)
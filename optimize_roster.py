@@ -30,168 +30,131 @@ optimization. See them with $ python optimize_roster.py -h
 Joe Nudell
 '''
 
-from openopt import *
 from pprint import pprint
-from sys import stderr, stdout, exit
+from sys import stderr, stdout, exit, exc_info
+from roster import roster_line_format, get_injured_list, get_adjustment, \
+    write_team_json
+from changes import key as player_key
 import eplstats
+import metrics
+import scoring
+import threading
 import argparse
 import os
 import re
 import codecs
 
 
-# globals
-roster_line_format= u"{:<15}{:<15}{:<15}{:<14}{:^6}{:<5}{:<7}"
-
-
 class NS(object):
     pass
 
 
-def get_injured_list(fn, has_header=True):
-    if not os.path.exists(fn):
-        raise IOError("Injured list file `%s` does not exist" % fn)
-
-    disabled_list = []
-
-    with open(fn) as fh:
-
-        for i, line in enumerate(fh.readlines()):
-            if has_header and i==0:
-                # Skip header line
-                continue
-
-            try:
-                # Sloppy splitting. Should maybe use struct module.
-                fname = line[:20].strip()
-                lname = line[20:40].strip()
-                club = line[40:50].strip()
-                factor = float(line[50:70].strip())
-                notes = line[70:].strip()
-
-            except Exception as e:
-                raise IOError("Injured list file `%s` is misformatted: %s" \
-                    %(fn, e))
-
-            try:
-                factor = float(factor)
-            except ValueError:
-                if i==0:
-                    if not has_header:
-                        print >>stderr, \
-                        "Warning: Header detected though has_header not set"
-                    continue
-                else:
-                    raise ValueError("Can't parse %s as float" % factor)
-
-            # Store player info
-            disabled_list.append({
-                'first_name' : fname,
-                'last_name' : lname,
-                'factor' : factor,
-                'club' : club,
-                'news' : notes
-            })
-
-    return disabled_list
-
-
-
-def sanitize(s):
-    try:
-        s = s.encode('ascii', 'replace')
-    except UnicodeDecodeError:
-        s = s.decode('utf8').encode('ascii', 'replace')
-
-    return re.sub(r'[^\w]', '', s.lower())
-
-
-
-
-def player_in_roster(player, roster,
-    first_name='first_name', last_name='last_name', club='club'):
-    '''Try to find given player (Player object) in roster (list of dicts).
-    Problem is hard because of possible variations in spelling, encoding, etc.
-    Heuristics used are to first match club, then try some variations of the
-    sanitized name.
-    Returns the player dict if found in roster, otherwise None.'''
-    fname = sanitize(player.first_name)
-    lname = sanitize(player.last_name)
-    pclub = sanitize(player.club)
-
-    for _aplayer in roster:
-        # Note : Right now the heuristics used for matching are *good enough*,
-        # but they could be better.
-
-        if sanitize(_aplayer[club]) == pclub:
-            # Correct club
-            _aln = sanitize(_aplayer[last_name])
-            _afn = sanitize(_aplayer[first_name])
-
-            if _aln==lname and _afn==fname:
-                # Simple case: total match for first name, last name
-                return _aplayer
-
-            elif _aln==lname and len(fname)==0:
-                # Helps match Brazilians, mostly
-                return _aplayer
-
-            elif _afn==fname and len(lname)==0:
-                # Same as previous
-                return _aplayer
-
-            elif fname[:1]==_afn[:1] and _aln==lname:
-                # First initial last name. Hopefully no collisions!
-                return _aplayer
-
-    return None
-
-
-
-
-def get_adjustment(player, adjustments, threshold=1, silent=False):
-    '''Determine whether player should be devalued at all. Find given
-    player in the adjustments list. Try to match player names via several
-    heuristics. Use threshold to ignore adjustments above a certain level.
-    Useful e.g. if you don't want to devalue players who have a .75 chance
-    of playing --- these people could be back for the rest of the season.'''
-    adj = 1.
-
-    adj_player = player_in_roster(player, adjustments)
-
-    if adj_player is not None:
-        adj = adj_player['factor']
-
-    if adj >= threshold:
-        adj = 1.
-
-    if not silent and adj!=1.:
-        print >>stderr, " * Ignoring %s %s (%s) ~ %s" % \
-        (
-            adj_player['first_name'],
-            adj_player['last_name'],
-            adj_player['club'],
-            adj_player['news']
-        )
-
-    return adj
-
-
-
 
+class Solution(object):
+    '''A solved roster, as optimize returns it.
+
+    roster      the chosen candidates, in pool order
+    indices     index of each chosen player in the list of Players
+    ids         source player id of each (None where the source has none)
+    keys        identity of each across fetches (see changes.key)
+    score       total score of the chosen candidates
+    cost        total cost
+    breakdown   {'starters', 'subs', 'captain'}: points from starters and
+                substitutes, and the captain's points on top of his own
+    solution    the solver's result object (None when nothing was solved)
+
+    `xf`, `ff` and `isFeasible` are the solver's, so a Solution can be used
+    where openopt's result object was.'''
+
+    def __init__(self, roster, candidates, player_objs, solution=None):
+        self.roster = roster
+        self.solution = solution
+        self.indices = [c['pid'] - 1 for c in roster]
+        self.ids = [player_objs[i].get('id') for i in self.indices]
+        self.keys = [player_key(player_objs[i]) for i in self.indices]
+        self.score = sum(c['score'] for c in roster)
+        self.cost = sum(c['cost'] for c in roster)
+
+        plain = dict(((c['pid'], c['bench']), c['score'])
+            for c in candidates if not c['captain'])
+        self.breakdown = {'starters': 0., 'subs': 0., 'captain': 0.}
+        for c in roster:
+            base = plain.get((c['pid'], c['bench']), c['score'])
+            self.breakdown['starters' if c['bench'] == 'starter'
+                else 'subs'] += base
+            if c['captain']:
+                self.breakdown['captain'] += c['score'] - base
+
+    @classmethod
+    def from_result(cls, r, candidates, player_objs):
+        '''Solution from a solver's result object.'''
+        return cls(chosen_candidates(r, candidates), candidates,
+            player_objs, solution=r)
+
+    @property
+    def xf(self):
+        if self.solution is not None:
+            return self.solution.xf
+        return [c['name'] for c in self.roster]
+
+    @property
+    def ff(self):
+        return getattr(self.solution, 'ff', self.score)
+
+    @property
+    def isFeasible(self):
+        return getattr(self.solution, 'isFeasible', True)
+
+    def entries(self):
+        '''The roster as dicts shaped like roster.read_team_file's, with
+        the `id` and `key` of every player.'''
+        return [{
+            'first_name' : c['fname'],
+            'last_name' : c['lname'],
+            'position' : c['position'],
+            'starting' : c['bench'],
+            'capt.' : bool(c['captain']),
+            'club' : c['club'],
+            'salary' : c['cost'],
+            'id' : pid,
+            'key' : k
+        } for c, pid, k in zip(self.roster, self.ids, self.keys)]
 
 
 def get_player_stats(score='total_points',
     season=2014, benchfrac=.1, adjustments=None,
     source='espn', username='', password='', threshold=1.,
-    captain=2.0):
+    captain=2.0, cache_dir=None, record=None, replay=None, base_url=None,
+    downloader=None, autosub=False, fixtures=False, home=.1,
+    injuries_from=None, identity_file=None, form_file=None, gameweek=None,
+    ownership_file=None):
     '''Get all the stats from ESPN.com and format them in the manner
     expected by the optimizer.
     Params:
-     score       Can be attribute of Player or callable expecting Player as arg
+     score       Expression over Player attributes (see scoring.py) or
+                 callable expecting Player as arg
      season      season to get stats for from ESPN
      benchfrac   Fraction of points awarded to substitutes
      adjustments Externally defined adjustments to player worth (injuries etc.)
+     cache_dir   Where to keep responses for revalidation between runs
+     record      Fixture archive to record responses to
+     replay      Fixture archive to serve responses from instead of network
+     base_url    Send requests to this host instead, e.g. fakeserver.py
+     downloader  Use this instead of a new eplstats.Downloader
+     autosub     Value substitutes by their chance of coming on (see
+                 autosub.py) instead of `benchfrac`
+     fixtures    Scale scores by the difficulty of the next fixture (see
+                 fixtures.py), with `home` the advantage of playing at home
+     injuries_from  Fetch this source too, at the same time, and devalue
+                 players by its chance of playing (instead of `adjustments`)
+     identity_file  Where to keep the player identity index between the
+                 sources (see identity.py)
+     form_file   Where to keep rolling form aggregates (see rolling.py).
+                 The pool is folded in as `gameweek` and the aggregates
+                 can be used in `score`
+     ownership_file  Ownership table of your league (see ownership.py),
+                 whose shares (league_owned, league_eo, ...) can be used
+                 in `score`
     '''
     players = []
     player_objs = []
@@ -206,13 +169,47 @@ def get_player_stats(score='total_points',
     _id = 0
     _uid = 990000
 
-    downloader = eplstats.Downloader(source=source,
-        username=username, password=password)
-
+    if downloader is None:
+        downloader = eplstats.Downloader(source=source,
+            username=username, password=password, cache_dir=cache_dir,
+            record=record, replay=replay, base_url=base_url)
+
+    injury_fetch = None
+    if injuries_from is not None:
+        injury_fetch = SourceFetch(injuries_from, season=season,
+            username=username, password=password, cache_dir=cache_dir,
+            record=_source_path(record, injuries_from),
+            replay=_source_path(replay, injuries_from), base_url=base_url)
+        injury_fetch.start()
+
+    # Fetch every position before scoring, so the other source downloads
+    # in the meantime
+    fetched = []
     for position in _positions:
         print >>stderr, "  Getting stats about %s ..." % position
-        _players = downloader.get(position,
-            source=source, season=season, adjustments=adjfile)
+        fetched.append((position, downloader.get(position,
+            source=source, season=season, adjustments=adjfile)))
+
+    injury_factors = None
+    if injury_fetch is not None:
+        injury_factors = injuries_by_identity(
+            sum([p for _, p in fetched], []), injury_fetch.result(),
+            threshold=threshold, season=season, identity_file=identity_file)
+
+    if form_file is not None:
+        import rolling
+        pool = sum([p for _, p in fetched], [])
+        form = rolling.FormState.load(form_file)
+        form.update(pool, gameweek)
+        form.annotate(pool)
+        form.save(form_file)
+
+    if ownership_file is not None:
+        import ownership
+        ownership.OwnershipTable.load(ownership_file).annotate(
+            sum([p for _, p in fetched], []), captain=captain)
+
+    for position, _players in fetched:
         player_objs += _players
 
 
@@ -222,7 +219,12 @@ def get_player_stats(score='total_points',
             adjustments = get_injured_list(adjfile)
 
 
-        for player in _players:
+        # Score every player of the position at once; the four candidate
+        # variants below share it.
+        with metrics.span('score'):
+            base_points = scoring.evaluate(score, _players)
+
+        for player, base in zip(_players, base_points):
             _id += 1
 
             # Find any external adjustment factoring to player worth
@@ -231,30 +233,25 @@ def get_player_stats(score='total_points',
             if adjustments is not None:
                 adj_factor = get_adjustment(player, adjustments,
                     threshold=threshold)
+            elif injury_factors is not None:
+                adj_factor = injury_factors[id(player)]
 
-            for captain in [0, 1]:
+            for is_captain in [0, 1]:
                 for pfx in ['', 'sub-']:
                     _uid += 1
 
                     # Create a postfix for the name including semantic details
                     # about the given options
                     postfix = "starter" if not len(pfx) else "sub"
-                    postfix += "- captain" if captain else ""
-
-                    # Get score from. Default is to pass string for attribute
-                    # on Player instance, but can do a lambda or other
-                    # callable as well.
-                    points = 0.
-                    if hasattr(score, '__call__'):
-                        points = score(player)
-                    else:
-                        points = getattr(player, score)
-
-                    if len(pfx)>0:
+                    postfix += "- captain" if is_captain else ""
+
+                    points = float(base)
+
+                    if len(pfx)>0 and not autosub:
                         # Severely down-weight scores of benched players
                         points *= benchfrac
 
-                    if captain:
+                    if is_captain:
                         # Captains earn double points by default
                         points *= captain
 
@@ -280,7 +277,7 @@ def get_player_stats(score='total_points',
                                 postfix,
                                 _uid
                             )).strip(),
-                        'captain' : captain,
+                        'captain' : is_captain,
                         'keeper' : 0,
                         'defender' : 0,
                         'midfielder' : 0,
@@ -296,11 +293,32 @@ def get_player_stats(score='total_points',
 
                     players.append(stats)
 
+    downloader.print_fetch_report()
+
+    if autosub:
+        # Needs the whole pool, so substitutes are scaled down afterwards
+        import autosub as asb
+        table = asb.bench_table(player_objs)
+        print >>stderr, "  Chance a substitute comes on: %s" % \
+            ", ".join("%s %.2f" % (pos, table[pos]) for pos in sorted(table))
+
+        for stats in players:
+            if stats['bench'] == 'sub':
+                stats['score'] *= table[stats['position']]
+
+    if fixtures:
+        import fixtures as fx
+        factor = fx.table_for(player_objs, home=home).factors(player_objs)
+
+        for stats in players:
+            stats['score'] *= factor[stats['pid'] - 1]
+
     # Create player id fields to build uniqueness constraints
     all_ids = range(_id + 1)
-    for player in players:
-        for i in all_ids:
-            player['id%d' % i] = float(player['pid']==i)
+    with metrics.span('id_fields'):
+        for player in players:
+            for i in all_ids:
+                player['id%d' % i] = float(player['pid']==i)
 
     return (players, player_objs)
 
@@ -308,24 +326,130 @@ def get_player_stats(score='total_points',
 
 
 
-def optimize(season=2014,
-    tolerance=1e-6, budget=100., bench=.1,
-    adjustments=None, score="total_points", solver="glpk",
-    username='', password='', source='espn', threshold=1., nosolve=False,
-    captain=2.0):
-    '''Configure and run KSP solver with given parameters. Returns openopt's
-    solution object'''
+def _source_path(path, source):
+    '''Fixture archive for a second source next to `path`.'''
+    if path is None:
+        return None
+    base, ext = os.path.splitext(path)
+    return "%s-%s%s" % (base, source, ext)
+
+
+
+class SourceFetch(threading.Thread):
+    '''Download every position from another source in the background.'''
+    daemon = True
+
+    def __init__(self, source, season=2014, **downloader_args):
+        threading.Thread.__init__(self)
+        self.source = source
+        self.season = season
+        self.downloader = eplstats.Downloader(source=source,
+            **downloader_args)
+        self.players = []
+        self.error = None
+
+    def start(self):
+        '''Log in on the calling thread, where prompts can be answered and
+        interrupted, then download without ever prompting.'''
+        if self.source.lower().strip() in ('pl', 'premierleague'):
+            self.downloader.login()
+        self.downloader.interactive = False
+        threading.Thread.start(self)
+
+    def run(self):
+        try:
+            for position in ['forwards', 'midfielders', 'defenders',
+                'keepers']:
+                self.players += self.downloader.get(position,
+                    source=self.source, season=self.season)
+        except Exception:
+            self.error = exc_info()
+
+    def result(self):
+        '''Wait for the download and return the players.'''
+        self.join()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        self.downloader.print_fetch_report()
+        return self.players
+
+
+
+def injuries_by_identity(players, others, threshold=1., season=None,
+    identity_file=None):
+    '''Adjustment factor for each of `players` (ESPN) from the chance of
+    playing of the same player in `others` (EPL), as {id(player): factor}.
+    Players are joined through an identity.IdentityIndex.'''
+    import identity
+
+    index = identity.IdentityIndex(identity_file, season=season)
+    index.update(players, others)
+    if identity_file is not None:
+        index.save()
+
+    factors = {}
+    missing = 0
+
+    for player, other in index.join(players, others):
+        factor = 1.
+        if other is None:
+            missing += 1
+        else:
+            factor = other.get('chance_of_playing_next_round', 1.)
+
+        if factor >= threshold:
+            factor = 1.
+        elif factor != 1.:
+            print >>stderr, " * Ignoring %s %s (%s) ~ %s" % (
+                player.first_name, player.last_name, player.club,
+                other.get('news'))
+
+        factors[id(player)] = factor
+
+    if missing:
+        print >>stderr, "  %d players have no match in the injury source" \
+            % missing
+
+    return factors
+
 
-    # Get stats
-    print >>stderr, "Getting current stats from %s ..." % source
-    players, player_objs = get_player_stats(season=season,
-        benchfrac=bench, score=score, adjustments=adjustments,
-        source=source, username=username, password=password,
-        threshold=threshold, captain=captain)
-    print >>stderr, "Finished getting stats."
 
-    if nosolve:
-        return None, player_objs
+
+
+def solve_roster(players, budget=100., tolerance=1e-6, solver="glpk",
+    rules=None, **solver_args):
+    '''Build the KSP model over candidates `players` (as returned by
+    get_player_stats) and solve it. `rules` are extra league rules compiled
+    by rules.compile_rules. Extra keyword arguments (e.g. maxTime or
+    callback) are passed on to openopt. Returns openopt's solution
+    object.'''
+
+    rule_rows = []
+    if rules is not None:
+        # Excluded candidates are left out altogether; every other rule is
+        # one more summed field per row
+        rule_rows = [('rule-ub%d' % i, rhs, False)
+            for i, rhs in enumerate(rules.ub.rhs)] + \
+            [('rule-eq%d' % i, rhs, True)
+            for i, rhs in enumerate(rules.eq.rhs)]
+
+        for player in players:
+            for field, _, _ in rule_rows:
+                player[field] = 0.
+        for prefix, rows in [('rule-ub', rules.ub), ('rule-eq', rules.eq)]:
+            for i, col, val in zip(rows.rows, rows.cols, rows.vals):
+                players[col]['%s%d' % (prefix, i)] = val
+
+        players = [p for p, out in zip(players, rules.excluded) if not out]
+
+    if solver == 'exact':
+        # Dynamic programming reference solver, no OpenOpt needed
+        if rule_rows:
+            raise ValueError("The exact solver only takes `exclude` and "
+                "`max price` rules")
+        import exact
+        with metrics.span('solve', solver=solver):
+            return exact.solve(players, budget=budget)
 
     # Define constraints
     print >>stderr, "Defining constraints ...",
@@ -355,7 +479,11 @@ def optimize(season=2014,
                 + values['sub-defender'] + values['sub-keeper'] == 4,
             ##
             # And now add uniqueness constraints: all pids must be unique
-        ) + tuple([values['id%d'%i]<=1 for i in all_ids])
+        ) + tuple([values['id%d'%i]<=1 for i in all_ids]) \
+        + tuple([values[field] == rhs if equal else values[field] <= rhs
+            for field, rhs, equal in rule_rows])
+
+    metrics.count('constraints', 15 + len(all_ids) + len(rule_rows))
 
     print >>stderr, "done."
 
@@ -368,20 +496,152 @@ def optimize(season=2014,
 
     print >>stderr, "Solving problem (may take a while) ..."
 
-    # Construct problem
-    p = KSP(objective, players, constraints=constraints, name='ksp_mop')
+    # Construct problem. OpenOpt is slow to import, so only pay for it
+    # when there is actually something to solve.
+    with metrics.span('build_model'):
+        from openopt import KSP
+        p = KSP(objective, players, constraints=constraints, name='ksp_mop')
 
     # Run optimizer
-    r = p.solve(solver, iprint=1, nProc=2)
+    with metrics.span('solve', solver=solver):
+        r = p.solve(solver, iprint=1, nProc=2, **solver_args)
+
+    return r
+
+
+
+
+
+def optimize(season=2014,
+    tolerance=1e-6, budget=100., bench=.1,
+    adjustments=None, score="total_points", solver="glpk",
+    username='', password='', source='espn', threshold=1., nosolve=False,
+    captain=2.0, cache_dir=None, record=None, replay=None, base_url=None,
+    risk=None, alpha=.2, scenarios=200, autosub=False, fixtures=False,
+    home=.1, injuries_from=None, identity_file=None, snapshots=None,
+    gameweek=None, form_file=None, rules=None, sensitivity=None,
+    ownership_file=None):
+    '''Configure and run KSP solver with given parameters. Returns a
+    Solution and the candidates, or None and the Players with `nosolve`.
+    If `risk` is given, optimize a mix of expected points and CVaR over
+    simulated gameweeks instead (see robust.py). If
+    `snapshots` is given, the fetched pool is also saved there as the
+    snapshot of `gameweek` (see snapshots.py), and with `form_file` rolling
+    form aggregates are kept up to date (see rolling.py). `ownership_file`
+    is a league ownership table (see ownership.py). With `cache_dir`,
+    the solve is skipped when the last roster solved for is provably still
+    optimal (see changes.py). `rules` are extra league rules, as parsed by
+    rules.parse. With `sensitivity`, a per-player sensitivity report on the
+    solved squad is written to that file (see sensitivity.py).'''
+
+    downloader = eplstats.Downloader(source=source,
+        username=username, password=password, cache_dir=cache_dir,
+        record=record, replay=replay, base_url=base_url)
+
+    # Get stats
+    print >>stderr, "Getting current stats from %s ..." % source
+    with metrics.span('get_player_stats'):
+        players, player_objs = get_player_stats(season=season,
+            benchfrac=bench, score=score, adjustments=adjustments,
+            source=source, username=username, password=password,
+            threshold=threshold, captain=captain, cache_dir=cache_dir,
+            record=record, replay=replay, base_url=base_url,
+            downloader=downloader, autosub=autosub, fixtures=fixtures,
+            home=home, injuries_from=injuries_from,
+            identity_file=identity_file, form_file=form_file,
+            gameweek=gameweek, ownership_file=ownership_file)
+    print >>stderr, "Finished getting stats."
+
+    if downloader.changes:
+        import changes
+        print >>stderr, "Changes since the last fetch: %s" % ", ".join(
+            "%d %s" % (n, kind) for kind, n in
+            sorted(changes.summarize(downloader.changes).items()))
+
+    metrics.count('players', len(player_objs))
+    metrics.count('candidates', len(players))
+
+    if snapshots is not None:
+        import snapshots as snap
+        path = snap.SnapshotStore(snapshots).append(player_objs, gameweek)
+        print >>stderr, "Snapshot saved to %s" % path
+
+    if nosolve:
+        return None, player_objs
+
+    compiled = None
+    if rules:
+        import rules as rls
+        compiled = rls.compile_rules(rules, players, player_objs)
+        print >>stderr, "League rules: %d rows, %d candidates excluded" % (
+            len(compiled), compiled.excluded.sum())
+
+    if risk is not None:
+        import robust
+        print >>stderr, "Solving over %d simulated gameweeks ..." % scenarios
+        r = robust.solve(players, player_objs, budget=budget,
+            scenarios=scenarios, alpha=alpha, risk=risk, solver=solver,
+            rules=compiled)
+        print >>stderr, "Mean %.2f, CVaR(%g) %.2f" % (r.mean, alpha, r.cvar)
+        return (Solution.from_result(r, players, player_objs), players)
+
+    solve_record = None
+    if cache_dir is not None:
+        import changes
+        solve_record = changes.SolveRecord.load(
+            os.path.join(cache_dir, 'last_solve.json'))
+        ok, why = solve_record.still_optimal(players, player_objs,
+            budget=budget, solver=solver, rules=rules or ())
+
+        if ok:
+            print >>stderr, "Last roster is still optimal, not solving."
+            metrics.count('solves_skipped')
+            solution = Solution(solve_record.roster(players, player_objs),
+                players, player_objs)
+            _write_sensitivity(sensitivity, solution, players, player_objs,
+                budget)
+            return (solution, players)
+
+        print >>stderr, "Solving again: %s" % why
+
+    r = solve_roster(players, budget=budget, tolerance=tolerance,
+        solver=solver, rules=compiled)
 
-    return (r, players)
+    solution = Solution.from_result(r, players, player_objs)
 
+    if solve_record is not None and solution.isFeasible:
+        solve_record.remember(solution.roster, players, player_objs,
+            budget=budget, solver=solver, rules=rules or ())
+        solve_record.save()
 
+    if solution.isFeasible:
+        _write_sensitivity(sensitivity, solution, players, player_objs,
+            budget)
 
+    return (solution, players)
 
 
-def build_popular_team(players):
-    '''Make a team of 15 from the most popular players in the pool'''
+
+def _write_sensitivity(path, solution, players, player_objs, budget):
+    '''Write the sensitivity report of a Solution to `path`, if given.'''
+    if path is None:
+        return
+
+    import sensitivity
+    report = sensitivity.analyze(players, player_objs, solution.roster,
+        budget=budget)
+    with codecs.open(path, 'w', 'utf8') as fh:
+        sensitivity.print_report(report, fh)
+    print >>stderr, "Sensitivity report written to %s" % path
+
+
+
+
+
+def build_popular_team(players, field='ownership'):
+    '''Make a team of 15 from the most popular players in the pool, by
+    `field`: site-wide `ownership`, or e.g. `league_eo` (see
+    ownership.py)'''
     p_array = [{
         'name' : "%s %s (%d)" % (player.first_name, player.last_name, i),
         'fname' : player.first_name,
@@ -391,7 +651,7 @@ def build_popular_team(players):
         'captain' : 'N/A',
         'club' : player.club,
         'cost' : player.cost,
-        'ownership' : player.ownership,
+        'ownership' : getattr(player, field),
         'uid' : i
     } for i, player in enumerate(players)]
 
@@ -412,10 +672,6 @@ def build_popular_team(players):
         else:
             print >>stderr, "Warning: No position of defined on", p
 
-
-
-    print [keeper.ownership for keeper in players]
-
     sort = lambda X: sorted(X, key=lambda k: k['ownership'])
 
     keepers = sort(keepers)
@@ -441,26 +697,29 @@ def build_popular_team(players):
 
 
 
-def print_results(r, players, fh=stdout, print_cost=True, budget=100.):
-    '''Take results object and players pool and print human-readable results'''
-    names = r.xf
+def chosen_candidates(r, players):
+    '''Candidates in `players` named in the results object.'''
+    if isinstance(r, Solution):
+        return r.roster
+
+    by_uid = dict((player['uid'], player) for player in players)
 
-    # Find selected players in `players` list
-    uids = []
-    for name in names:
-        # Get unique id from name
+    # Solvers only give back names, so read the unique id from each
+    uids = set()
+    for name in r.xf:
         m = re.search(r'\((\d+)\)', name)
         if m is None:
             raise ValueError("Can't find UID in %s" % name)
 
-        uid = int(m.group(1))
+        uids.add(int(m.group(1)))
 
-        uids.append(uid)
+    return [by_uid[uid] for uid in sorted(uids)]
 
-    roster = []
-    for player in players:
-        if player['uid'] in uids:
-            roster.append(player)
+
+
+def print_results(r, players, fh=stdout, print_cost=True, budget=100.):
+    '''Take results object and players pool and print human-readable results'''
+    roster = chosen_candidates(r, players)
 
     # Print details about selected roster
     # Note: row_format is read from a global so it can be shared with other
@@ -516,6 +775,7 @@ if __name__=='__main__':
     outfilename = None
     captain = 2.0
     popular = False
+    cache_dir = None
 
 
     # Get CL params
@@ -529,12 +789,43 @@ if __name__=='__main__':
         help="Salary cap in millions of pounds, default is 100")
     parser.add_argument('-e', '--bench', type=float, default=bench,
         help="Fraction of score to reduce substitutes by, default is 1/10")
+    parser.add_argument('--autosub', action="store_true",
+        help="Value substitutes by their chance of being autosubbed on")
+    parser.add_argument('--fixtures', action="store_true",
+        help="Scale scores by the difficulty of the next fixture")
+    parser.add_argument('--home', type=float, default=.1,
+        help="Home advantage used with --fixtures, default is .1")
     parser.add_argument('-a', '--adjustments', type=str, default=adjustments,
         help="List of adjustments to player worth (file name)")
+    parser.add_argument('--injuries-from', type=str, default=None,
+        help="Also fetch this source (e.g. premierleague) and devalue "
+        "injured players by it, instead of an adjustments file")
+    parser.add_argument('--identity', type=str, default=None,
+        help="Keep the player identity index between sources in this file")
+    parser.add_argument('--snapshots', type=str, default=None,
+        help="Save the fetched pool to this snapshot directory")
+    parser.add_argument('--gameweek', type=int, default=None,
+        help="Gameweek the snapshot is of, needed with --snapshots")
+    parser.add_argument('--form', type=str, default=None,
+        help="Keep rolling form aggregates (points_last3, points_ewma, ...) "
+        "in this file, needs --gameweek")
+    parser.add_argument('--rules', type=str, default=None,
+        help="File of extra league rules, one per line (see rules.py)")
+    parser.add_argument('--rule', type=str, action='append', default=[],
+        help="Extra league rule, e.g. 'max 3 per club'. Can be repeated")
+    parser.add_argument('--league-ownership', type=str, default=None,
+        help="Ownership table of your league, from ownership.py: adds "
+        "league_owned, league_eo, ... for --score, and --popular ranks "
+        "by league_eo")
+    parser.add_argument('--sensitivity', type=str, default=None,
+        help="Write how much every player's score and price can move "
+        "before the squad changes to this file (see sensitivity.py)")
     parser.add_argument('-s', '--score', type=str, default=score,
-        help="Player stat to be used in determining player's worth")
+        help="Player stat, or arithmetic over stats, to be used in "
+        "determining player's worth, e.g. '0.6*average_points + 0.4*form'")
     parser.add_argument('-S', '--solver', type=str, default=solver_lbl,
-        help="Solver to use. Can be interalg or glpk, or other KSP solvers.")
+        help="Solver to use. Can be interalg or glpk, or other KSP "
+        "solvers, or exact for small pools.")
     parser.add_argument('-u', '--username', type=str, default=username,
         help="Username (for official EPL site)")
     parser.add_argument('-p', '--password', type=str, default=password,
@@ -546,45 +837,113 @@ if __name__=='__main__':
     parser.add_argument('--nosolve', action="store_true",
         help="Don't execute the solver")
     parser.add_argument('-o', '--out', type=str, default=outfilename,
-        help="File to write team roster to")
+        help="File to write team roster to; JSON with player ids if it "
+        "ends in .json")
     parser.add_argument('-c', '--captain', type=float, default=captain,
         help="Bonus for being captain")
     parser.add_argument('-P', '--popular', action="store_true",
         help="Create a team of the most popular players")
+    parser.add_argument('-C', '--cache', type=str, default=cache_dir,
+        help="Directory to keep downloaded pages in for revalidation")
+    parser.add_argument('--record', type=str, default=None,
+        help="Record responses to this fixture archive")
+    parser.add_argument('--replay', type=str, default=None,
+        help="Replay responses from this fixture archive, offline")
+    parser.add_argument('--base-url', type=str, default=None,
+        help="Send requests to this host instead (see fakeserver.py)")
+    parser.add_argument('--risk', type=float, default=None,
+        help="Weight of CVaR vs. expected points, 0 to 1 (robust mode)")
+    parser.add_argument('--alpha', type=float, default=.2,
+        help="Share of worst simulated gameweeks averaged by CVaR")
+    parser.add_argument('--scenarios', type=int, default=200,
+        help="Simulated gameweeks in robust mode")
+    parser.add_argument('--metrics', type=str, default=None,
+        help="Write stage timings and counters to this JSON file")
+    parser.add_argument('--profile', type=str, default=None,
+        help="Run under cProfile and write stats to this file")
 
 
     cli = parser.parse_args()
 
+    # Check the score expression before spending time on downloads
+    try:
+        scoring.compile_score(cli.score)
+    except scoring.ScoreError as e:
+        parser.error(str(e))
+
+    # Likewise the league rules
+    rules = None
+    if cli.rules is not None or cli.rule:
+        import rules as rls
+        try:
+            rules = (rls.read_rules(cli.rules) if cli.rules else []) + \
+                rls.parse(cli.rule)
+        except (IOError, rls.RuleError) as e:
+            parser.error(str(e))
+
+    if cli.snapshots is not None and cli.gameweek is None:
+        parser.error("--snapshots needs --gameweek")
+    if cli.form is not None and cli.gameweek is None:
+        parser.error("--form needs --gameweek")
+    if cli.gameweek is not None and cli.gameweek < 1:
+        parser.error("--gameweek must be at least 1")
+
+
+    if cli.popular:
+        # Can't make popular team with optimizer. Doesn't make sense.
+        cli.nosolve = True
+
+        if cli.out is not None and cli.out.endswith('.json'):
+            parser.error("JSON rosters are only written for solved teams")
+
 
     # Make certain that solver is available. Warn if trying / forced to use
     # interalg that GLPK is much better.
     solver_lbl = cli.solver.lower()
-    if solver_lbl=='glpk':
+    # Robust mode is a matrix MILP, which interalg can't take, so there is
+    # nothing to fall back to.
+    if solver_lbl=='glpk' and not cli.nosolve and cli.risk is None:
         try:
             import glpk
         except ImportError:
             print >>stderr, "Warning: can't find GLPK. Using interalg solver instead."
             solver_lbl = 'interalg'
 
-    if solver_lbl=='interalg':
+    if solver_lbl=='interalg' and not cli.nosolve:
         print >>stderr, "Warning: interalg will take a long-ass time to solve this problem. Use GLPK if you can."
 
 
-    if cli.popular:
-        # Can't make popular team with optimizer. Doesn't make sense.
-        cli.nosolve = True
-
+    # Optionally profile everything from fetching to solving
+    profiler = None
+    if cli.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
 
     # Run optimizer
     r, players = optimize(season=cli.season, tolerance=cli.tolerance,
         budget=cli.budget, bench=cli.bench, adjustments=cli.adjustments,
         score=cli.score, solver=solver_lbl, source=cli.source,
         username=cli.username, password=cli.password,
-        threshold=cli.threshold, nosolve=cli.nosolve, captain=cli.captain)
+        threshold=cli.threshold, nosolve=cli.nosolve, captain=cli.captain,
+        cache_dir=cli.cache, record=cli.record, replay=cli.replay,
+        base_url=cli.base_url, risk=cli.risk, alpha=cli.alpha,
+        scenarios=cli.scenarios, autosub=cli.autosub, fixtures=cli.fixtures,
+        home=cli.home, injuries_from=cli.injuries_from,
+        identity_file=cli.identity, snapshots=cli.snapshots,
+        gameweek=cli.gameweek, form_file=cli.form, rules=rules,
+        sensitivity=cli.sensitivity, ownership_file=cli.league_ownership)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(cli.profile)
+        print >>stderr, "Profile written to %s" % cli.profile
 
     if cli.popular:
         # Make a popular team
-        r, players = build_popular_team(players)
+        r, players = build_popular_team(players,
+            field='ownership' if cli.league_ownership is None
+            else 'league_eo')
 
     # Output raw solution from openopt solver
     if r is not None:
@@ -594,7 +953,11 @@ if __name__=='__main__':
         # Print tidied-up results
         os.system('clear')
 
-        if cli.out is not None:
+        if cli.out is not None and cli.out.endswith('.json'):
+            # Machine-readable roster, with player ids
+            with open(cli.out, "w") as fh:
+                write_team_json(fh, r.entries())
+        elif cli.out is not None:
             # Write results to out file as necessary.
             with codecs.open(cli.out, "w", 'utf8') as fh:
                 print_results(r, players, fh=fh, print_cost=False)
@@ -602,7 +965,7 @@ if __name__=='__main__':
         print_results(r, players, budget=cli.budget)
     else:
         print >>stderr, "Players stats loaded in `players` variable"
-    
-
-
 
+    if cli.metrics is not None:
+        metrics.report()
+        metrics.dump(cli.metrics)
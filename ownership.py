@@ -0,0 +1,243 @@
+#-*-coding:utf8-*-
+'''
+ownership.py
+
+Who your league owns, starts and captains: effective ownership from real
+league rosters instead of the site-wide `ownership` field.
+
+---
+`OwnershipTable.build` reads any number of rosters (text or JSON roster
+files, see roster.py) and counts per player how many teams own, start and
+captain him. Every roster entry is mapped to a row once, by its `key` in
+JSON rosters or by normalized name and club otherwise, and the counts are
+then three np.bincount calls over all entries, so thousands of rosters
+take about as long as reading the files.
+
+The table is saved as one .npz and joined to a fetched pool later (see
+`for_pool`), with the same key-then-name lookup as roster.PoolIndex. From
+it, per player:
+
+ * league_owned       share of teams owning him
+ * league_started     share of teams starting him
+ * league_captained   share of teams captaining him
+ * league_eo          effective ownership: points multiplier per team on
+                      average, i.e. (starts + (captain - 1) * captaincies
+                      + bench * benched) / teams
+
+With `--league-ownership FILE`, optimize_roster.py sets these on every
+player, so they can be used in `--score` (`average_points * (1 -
+league_eo)` scores what a player gains you over the league), and
+`--popular` builds the league's template team, by `league_eo`, instead
+of the site's.
+
+Usage:
+>>> table = ownership.OwnershipTable.build(rosters)
+>>> table.save('league-eo.npz')
+>>> table = ownership.OwnershipTable.load('league-eo.npz')
+>>> table.annotate(players)
+
+or from the command line, to build a table and show the most owned:
+    $ python ownership.py league/ -o league-eo.npz
+
+---
+Joe Nudell
+'''
+
+from sys import stderr
+from roster import read_team_file, roster_files, PoolIndex
+from identity import normalize
+import metrics
+import numpy as np
+import argparse
+import codecs
+import os
+
+
+_text_fields = ['key', 'first_name', 'last_name', 'club', 'position']
+
+
+
+def entry_key(entry):
+    '''Identity of a roster entry: its player key from a JSON roster, else
+    normalized name and club.'''
+    if entry.get('key'):
+        return entry['key']
+    return "%s|%s|%s" % (normalize(entry['first_name']),
+        normalize(entry['last_name']), normalize(entry['club']))
+
+
+
+class OwnershipTable(object):
+    '''Counts of owners, starters and captains per player over `teams`
+    rosters, as columns.'''
+
+    def __init__(self, columns, teams):
+        self.columns = columns
+        self.teams = teams
+
+    def __len__(self):
+        return len(self.columns['key'])
+
+    @classmethod
+    @metrics.timed('ownership_build')
+    def build(cls, rosters):
+        '''Table of a list of rosters (lists of dicts as from
+        roster.read_team_file).'''
+        rows = {}
+        first = []      # first entry seen of every row
+        ids, starting, captain = [], [], []
+        seen = {}       # keys by raw name, to normalize each name once
+
+        for roster in rosters:
+            for entry in roster:
+                raw = (entry.get('key'), entry['first_name'],
+                    entry['last_name'], entry['club'])
+                k = seen.get(raw)
+                if k is None:
+                    k = seen[raw] = entry_key(entry)
+                if k not in rows:
+                    rows[k] = len(first)
+                    first.append((k, entry))
+                ids.append(rows[k])
+                starting.append(entry['starting'] == 'starter')
+                captain.append(bool(entry['capt.']))
+
+        n = len(first)
+        columns = dict((f, np.array([unicode(e.get(f, u'')) if f != 'key'
+            else k for k, e in first], dtype=np.unicode_))
+            for f in _text_fields)
+
+        ids = np.array(ids, dtype=int)
+        columns['owned'] = np.bincount(ids, minlength=n)
+        columns['started'] = np.bincount(ids,
+            weights=np.array(starting, dtype=float), minlength=n)
+        columns['captained'] = np.bincount(ids,
+            weights=np.array(captain, dtype=float), minlength=n)
+
+        metrics.count('ownership_entries', len(ids))
+
+        return cls(columns, len(rosters))
+
+    def save(self, path):
+        tmp = path + '.tmp.npz'
+        np.savez_compressed(tmp, teams=self.teams, **self.columns)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            columns = dict((f, data[f]) for f in data.files if f != 'teams')
+            return cls(columns, int(data['teams']))
+
+    def shares(self, captain=2., bench=0.):
+        '''{league_owned, league_started, league_captained, league_eo}
+        over the rows of the table.'''
+        teams = float(max(self.teams, 1))
+        c = self.columns
+        return {
+            'league_owned' : c['owned'] / teams,
+            'league_started' : c['started'] / teams,
+            'league_captained' : c['captained'] / teams,
+            'league_eo' : (c['started'] + (captain - 1.) * c['captained'] +
+                bench * (c['owned'] - c['started'])) / teams
+        }
+
+    def for_pool(self, players, captain=2., bench=0.):
+        '''The shares as arrays over `players`, 0 for players nobody in the
+        league has. Rows are joined by key, then by name.'''
+        index = PoolIndex(players)
+        rows = [index.find(dict((f, self.columns[f][j])
+            for f in _text_fields)) for j in range(len(self))]
+        found = np.array([i is not None for i in rows], dtype=bool)
+        where = np.array([i for i in rows if i is not None], dtype=int)
+
+        if (~found).any():
+            print >>stderr, "  %d players of the ownership table aren't " \
+                "in the pool" % (~found).sum()
+
+        # Rows for the same player (e.g. from text and JSON rosters) add up
+        return dict((name, np.bincount(where, weights=values[found],
+            minlength=len(players)))
+            for name, values in self.shares(captain, bench).items())
+
+    def annotate(self, players, captain=2., bench=0.):
+        '''Set the shares as attributes of every player.'''
+        for name, values in self.for_pool(players, captain, bench).items():
+            for p, v in zip(players, values):
+                setattr(p, name, float(v))
+
+
+
+def differentials(scores, eo):
+    '''Points a player gains a team over the league on average: his score
+    times the share of the league that doesn't have it.'''
+    return np.asarray(scores) * (1. - np.asarray(eo))
+
+
+
+def print_table(table, fh=None, top=20, captain=2.):
+    '''The `top` players by effective ownership.'''
+    row_format = u"{:<15}{:<15}{:<12}{:<5}{:>7}{:>9}{:>9}{:>7}"
+    shares = table.shares(captain=captain)
+    c = table.columns
+
+    print >>fh, row_format.format("First Name", "Last Name", "Position",
+        "Club", "Owned", "Started", "Captain", "EO")
+    print >>fh, row_format.format(*["---"] * 8)
+
+    for j in np.argsort(-shares['league_eo'], kind='mergesort')[:top]:
+        print >>fh, row_format.format(c['first_name'][j], c['last_name'][j],
+            c['position'][j], c['club'][j],
+            "%.2f" % shares['league_owned'][j],
+            "%.2f" % shares['league_started'][j],
+            "%.2f" % shares['league_captained'][j],
+            "%.2f" % shares['league_eo'][j])
+
+    print >>fh, "\n%d teams, %d players owned." % (table.teams, len(table))
+
+
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('rosters', type=str, nargs='*',
+        help="Roster files of the league, or directories of them")
+    parser.add_argument('-o', '--out', type=str, default=None,
+        help="Save the table to this .npz file")
+    parser.add_argument('-l', '--load', type=str, default=None,
+        help="Show a saved table instead of building one")
+    parser.add_argument('-n', '--top', type=int, default=20,
+        help="Number of players to show")
+    parser.add_argument('-c', '--captain', type=float, default=2.,
+        help="Captain's points multiplier")
+    parser.add_argument('--metrics', type=str, default=None,
+        help="Write stage timings and counters to this JSON file")
+
+    cli = parser.parse_args()
+
+    if cli.load is not None:
+        table = OwnershipTable.load(cli.load)
+    elif cli.rosters:
+        rosters = []
+        with metrics.span('read_rosters'):
+            for fn in roster_files(cli.rosters):
+                with codecs.open(fn, 'r', 'utf8') as fh:
+                    rosters.append(read_team_file(fh))
+        table = OwnershipTable.build(rosters)
+    else:
+        parser.error("Give roster files or --load")
+
+    if cli.out is not None:
+        table.save(cli.out)
+        print >>stderr, "Table saved to %s" % cli.out
+
+    print
+    print_table(table, top=cli.top, captain=cli.captain)
+    print
+
+    if cli.metrics is not None:
+        metrics.report()
+        metrics.dump(cli.metrics)
@@ -0,0 +1,428 @@
+#-*-coding:utf8-*-
+'''
+planner.py
+
+Plan transfers over the next few gameweeks.
+
+---
+Starting from the current squad (a roster file as written by
+optimize_roster.py), finds the squad, starting eleven and captain for each
+of the next `horizon` gameweeks, and the transfers in between, that
+maximize total points over the horizon:
+
+ * one free transfer per gameweek, of which one can be banked (at most 2)
+ * every extra transfer costs `hit` points
+ * transfers are paid for from the bank; the bank can't go negative
+ * squad, formation and captain rules as in optimize_roster.solve_roster
+
+The model is time-expanded: per gameweek and player there are squad,
+starter, captain, buy and sell columns, plus hits, free transfers and bank
+per gameweek. All rows are scipy.sparse (see model.py) and solved with
+GLPK. Before building it, players that at least as many others of their
+position beat on cost and on every gameweek's projection as the squad has
+places for are dropped, since no plan needs them. The current squad is
+always kept.
+
+Projections are `score` per gameweek. Only the next fixture is known from
+the stats (`place`, `opponent`), so the first gameweek is scaled by its
+difficulty (see fixtures.py, with `home` the home advantage); later
+gameweeks use the plain score.
+Pass `projections` to plug in anything better.
+
+Rolling re-solve: save the plan with `--save plan.json`, and next gameweek
+pass it back with `--previous plan.json`. Its players stay in the pool, and
+its remaining gameweeks (the last one repeated) are rebuilt as a plan from
+the current squad, bank and free transfers. If that plan is still
+feasible, the model gets one more row, that the objective is at least that
+plan's value, so GLPK's branch and bound discards every branch that can't
+beat it from the start. The plan is also passed as the starting point to
+solvers that take one.
+
+Usage:
+    $ python planner.py myteam.txt --horizon 6 --free-transfers 1 --bank .5
+
+---
+Joe Nudell
+'''
+
+from sys import stderr
+from model import Rows, solve_milp, squad_shape
+from roster import read_team_file
+import simulate
+import scoring
+import fixtures
+import eplstats
+import metrics
+import numpy as np
+import scipy.sparse as sp
+import argparse
+import codecs
+import json
+
+
+_positions = ['forwards', 'midfielders', 'defenders', 'keepers']
+
+# Per gameweek and player, in this order
+blocks = ['squad', 'start', 'captain', 'buy', 'sell']
+# Per gameweek
+scalars = ['hits', 'free', 'bank']
+
+
+
+def player_key(p):
+    return "%s %s (%s)" % (p.first_name, p.last_name, p.club)
+
+
+
+def projections_for(players, horizon, score='average_points', home=.1):
+    '''(horizon, players) array of projected points.'''
+    base = scoring.evaluate(score, players)
+    proj = np.tile(base, (horizon, 1))
+
+    proj[0] *= fixtures.table_for(players, home=home).factors(players)
+
+    return proj
+
+
+
+def prune(players, proj, keep):
+    '''Indices of players worth planning with: those in `keep`, plus
+    everyone not beaten on cost and every projection by as many others of
+    the same position as a squad holds.'''
+    cost = np.array([p.cost for p in players])
+    slots = dict((pos + 's', total) for pos, _, _, total in squad_shape)
+    kept = set(keep)
+
+    for position, total in slots.items():
+        mine = np.array([i for i, p in enumerate(players)
+            if p.position == position])
+        if not len(mine):
+            continue
+
+        c, x = cost[mine], proj[:, mine]
+        for j, i in enumerate(mine):
+            as_good = (c <= c[j]) & (x >= x[:, [j]]).all(0)
+            better = (c < c[j]) | (x > x[:, [j]]).any(0)
+            if (as_good & better).sum() < total:
+                kept.add(i)
+
+    return sorted(kept)
+
+
+
+class Layout(object):
+    '''Column positions of the time-expanded model.'''
+
+    def __init__(self, n, horizon):
+        self.n = n
+        self.horizon = horizon
+        self.per_week = len(blocks) * n + len(scalars)
+        self.width = horizon * self.per_week
+
+    def col(self, name, week, i=None):
+        base = week * self.per_week
+        if name in blocks:
+            return base + blocks.index(name) * self.n + \
+                (np.arange(self.n) if i is None else i)
+        return base + len(blocks) * self.n + scalars.index(name)
+
+
+
+def plan(players, current, horizon=4, projections=None,
+    score='average_points', home=.1, budget=100., bank=None,
+    free_transfers=1, hit=4., bench=.1, captain=2., solver='glpk',
+    previous=None, **solver_args):
+    '''Best transfers over `horizon` gameweeks. `current` are indices into
+    `players` of the current squad. `bank` defaults to `budget` less the
+    squad's cost. `previous` is a plan returned by an earlier call (or
+    loaded from --save) to warm start from. Returns the plan as a dict.'''
+    if projections is None:
+        projections = projections_for(players, horizon, score=score,
+            home=home)
+
+    if bank is None:
+        bank = budget - sum(players[i].cost for i in current)
+
+    keep = list(current)
+    if previous is not None:
+        keys = dict((player_key(p), i) for i, p in enumerate(players))
+        keep += [keys[k] for week in previous['weeks'] for k in week['squad']
+            if k in keys]
+
+    with metrics.span('prune'):
+        pool = prune(players, projections, keep)
+    metrics.count('planner_pool', len(pool))
+
+    P = [players[i] for i in pool]
+    proj = projections[:, pool]
+    n, H = len(pool), horizon
+    L = Layout(n, H)
+    owned = np.array([float(i in set(current)) for i in pool])
+    cost = np.array([p.cost for p in P])
+    ones = np.ones(n)
+    ub, eq = Rows(), Rows()
+
+    with metrics.span('build_plan'):
+        for w in range(H):
+            squad, start, capt = [L.col(name, w) for name in blocks[:3]]
+            buy, sell = L.col('buy', w), L.col('sell', w)
+
+            for i in range(n):
+                # Squad carries over, plus buys, minus sells
+                if w == 0:
+                    eq.add([squad[i], buy[i], sell[i]], [1., -1., 1.],
+                        owned[i])
+                else:
+                    eq.add([squad[i], L.col('squad', w-1, i), buy[i],
+                        sell[i]], [1., -1., -1., 1.], 0.)
+
+                # Only squad members start, only starters captain
+                ub.add([start[i], squad[i]], [1., -1.], 0.)
+                ub.add([capt[i], start[i]], [1., -1.], 0.)
+
+            for pos, lo, hi, total in squad_shape:
+                mine = np.flatnonzero([p.position == pos + 's' for p in P])
+                eq.add(squad[mine], ones[mine], total)
+                if lo == hi:
+                    eq.add(start[mine], ones[mine], lo)
+                else:
+                    ub.add(start[mine], -ones[mine], -lo)
+                    ub.add(start[mine], ones[mine], hi)
+
+            eq.add(start, ones, 11)
+            eq.add(capt, ones, 1)
+
+            # Bank after this gameweek's transfers
+            prev = [L.col('bank', w-1)] if w else []
+            eq.add(np.r_[L.col('bank', w), prev, buy, sell],
+                np.r_[1., -np.ones(len(prev)), cost, -cost],
+                bank if w == 0 else 0.)
+
+            # Transfers beyond the free ones are hits
+            ub.add(np.r_[buy, L.col('hits', w), L.col('free', w)],
+                np.r_[ones, -1., -1.], 0.)
+
+            # Unused free transfers roll over, up to the bound of 2
+            if w + 1 < H:
+                ub.add(np.r_[L.col('free', w+1), L.col('free', w), buy,
+                    L.col('hits', w)], np.r_[1., -1., ones, -1.], 1.)
+
+        A, b = ub.matrix(L.width)
+        Aeq, beq = eq.matrix(L.width)
+
+        # Substitutes earn `bench` of their points, starters all of them
+        f = np.zeros(L.width)
+        lower = np.zeros(L.width)
+        upper = np.ones(L.width)
+        for w in range(H):
+            f[L.col('squad', w)] = bench * proj[w]
+            f[L.col('start', w)] = (1. - bench) * proj[w]
+            f[L.col('captain', w)] = (captain - 1.) * proj[w]
+            f[L.col('hits', w)] = -hit
+            upper[L.col('hits', w)] = 15
+            upper[L.col('free', w)] = 2
+            upper[L.col('bank', w)] = np.inf
+
+        # Free transfers available this gameweek are given
+        lower[L.col('free', 0)] = upper[L.col('free', 0)] = free_transfers
+
+        int_vars = [j for j in range(L.width)
+            if j % L.per_week != L.col('bank', 0)]
+
+    x0 = None
+    if previous is not None:
+        x0 = _warm_start(previous, P, L, owned, cost, bank, free_transfers)
+
+        if x0 is not None and _feasible(x0, A, b, Aeq, beq, lower, upper):
+            # Nothing worse than the previous plan needs looking at
+            A = sp.vstack([A, sp.csr_matrix(-f)]).tocsr()
+            b = np.r_[b, 1e-6 - f.dot(x0)]
+            print >>stderr, "  previous plan is still feasible, worth " \
+                "%.1f: solving for better" % f.dot(x0)
+        else:
+            print >>stderr, "  previous plan isn't feasible any more, " \
+                "solving from scratch"
+            x0 = None
+
+    metrics.count('constraints', len(b) + len(beq))
+
+    r = solve_milp(f, A, b, Aeq, beq, lower, upper, int_vars, solver=solver,
+        x0=x0, **solver_args)
+
+    return _read_plan(np.asarray(r.xf), r.ff, P, proj, L, captain)
+
+
+
+def _warm_start(previous, P, L, owned, cost, bank, free):
+    '''Solution vector of the previous plan, moved on by a gameweek and
+    with its last gameweek repeated: its squads, lineups and captains, with
+    transfers, hits, free transfers and bank worked out from the current
+    squad (`owned`), `bank` and `free` transfers. None if it has players
+    who are no longer in the pool.'''
+    weeks = previous['weeks'][1:] or previous['weeks'][-1:]
+    weeks = weeks + [weeks[-1]] * (L.horizon - len(weeks))
+    index = dict((player_key(p), i) for i, p in enumerate(P))
+    x = np.zeros(L.width)
+    have = owned
+
+    for w, week in enumerate(weeks[:L.horizon]):
+        for name, keys in [('squad', week['squad']),
+            ('start', week['lineup']), ('captain', [week['captain']])]:
+            if any(k not in index for k in keys):
+                return None
+            x[L.col(name, w, np.array([index[k] for k in keys],
+                dtype=int))] = 1.
+
+        squad = x[L.col('squad', w)]
+        buy, sell = np.maximum(squad - have, 0), np.maximum(have - squad, 0)
+        hits = max(0., buy.sum() - free)
+        bank += cost.dot(sell) - cost.dot(buy)
+
+        x[L.col('buy', w)], x[L.col('sell', w)] = buy, sell
+        x[L.col('hits', w)] = hits
+        x[L.col('free', w)] = free
+        x[L.col('bank', w)] = bank
+
+        free = min(2., free - buy.sum() + hits + 1)
+        have = squad
+
+    return x
+
+
+
+def _feasible(x, A, b, Aeq, beq, lower, upper, tol=1e-6):
+    '''Whether `x` satisfies every row and bound of the model.'''
+    return (A.dot(x) <= b + tol).all() and \
+        (abs(Aeq.dot(x) - beq) <= tol).all() and \
+        (x >= lower - tol).all() and (x <= upper + tol).all()
+
+
+
+def _read_plan(x, value, P, proj, L, captain):
+    '''Turn a solution vector into a plan dict.'''
+    weeks = []
+
+    for w in range(L.horizon):
+        chosen = lambda name: [i for i in range(L.n)
+            if x[L.col(name, w, i)] > .5]
+        start = chosen('start')
+        capt = chosen('captain')
+
+        weeks.append({
+            'squad' : [player_key(P[i]) for i in chosen('squad')],
+            'lineup' : [player_key(P[i]) for i in start],
+            'captain' : player_key(P[capt[0]]),
+            'buy' : [player_key(P[i]) for i in chosen('buy')],
+            'sell' : [player_key(P[i]) for i in chosen('sell')],
+            'hits' : int(round(x[L.col('hits', w)])),
+            'free_transfers' : int(round(x[L.col('free', w)])),
+            'bank' : round(x[L.col('bank', w)], 1),
+            'points' : float(sum(proj[w, i] for i in start)
+                + (captain - 1.) * proj[w, capt[0]])
+        })
+
+    return {'value' : float(value), 'weeks' : weeks}
+
+
+
+def print_plan(plan, fh=None):
+    '''Human readable transfers, captain and points per gameweek.'''
+    for w, week in enumerate(plan['weeks']):
+        print >>fh, "Gameweek +%d: %.1f points, %d transfer(s), %d hit(s), " \
+            "bank %.1f" % (w + 1, week['points'], len(week['buy']),
+            week['hits'], week['bank'])
+        for out, new in map(None, week['sell'], week['buy']):
+            print >>fh, "    out: %-35s in: %s" % (out or '', new or '')
+        print >>fh, "    captain: %s" % week['captain']
+
+    print >>fh, ""
+    print >>fh, "Total (after hits): %.1f" % plan['value']
+
+
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('roster', type=str,
+        help="Current squad, as written by optimize_roster.py")
+    parser.add_argument('-H', '--horizon', type=int, default=4,
+        help="Number of gameweeks to plan for")
+    parser.add_argument('-f', '--free-transfers', type=int, default=1,
+        help="Free transfers available this gameweek (1 or 2)")
+    parser.add_argument('--hit', type=float, default=4.,
+        help="Points deducted per extra transfer")
+    parser.add_argument('-b', '--budget', type=float, default=100.,
+        help="Salary cap in millions of pounds, default is 100")
+    parser.add_argument('--bank', type=float, default=None,
+        help="Money in the bank, default is budget less squad cost")
+    parser.add_argument('-s', '--score', type=str, default='average_points',
+        help="Player stat, or arithmetic over stats, to project from")
+    parser.add_argument('--home', type=float, default=.1,
+        help="Home advantage in the next fixture's difficulty")
+    parser.add_argument('-e', '--bench', type=float, default=.1,
+        help="Fraction of score to reduce substitutes by, default is 1/10")
+    parser.add_argument('-c', '--captain', type=float, default=2.,
+        help="Bonus for being captain")
+    parser.add_argument('--previous', type=str, default=None,
+        help="Plan saved last gameweek; the new plan must be at least "
+        "as good as what is left of it")
+    parser.add_argument('--save', type=str, default=None,
+        help="Write the plan to this JSON file")
+    parser.add_argument('-y', '--season', type=int, default=2014,
+        help="ESPN endpoint only currently supports 2014 season")
+    parser.add_argument('-u', '--username', type=str, default='',
+        help="Username (for official EPL site)")
+    parser.add_argument('-p', '--password', type=str, default='',
+        help="Password (for official EPL site)")
+    parser.add_argument('-w', '--source', type=str, default='espn',
+        help="Stats source website. ESPN and EPL are supported.")
+    parser.add_argument('-C', '--cache', type=str, default=None,
+        help="Directory to keep downloaded pages in for revalidation")
+    parser.add_argument('--replay', type=str, default=None,
+        help="Replay responses from this fixture archive, offline")
+    parser.add_argument('--base-url', type=str, default=None,
+        help="Send requests to this host instead (see fakeserver.py)")
+    parser.add_argument('--metrics', type=str, default=None,
+        help="Write stage timings and counters to this JSON file")
+
+    cli = parser.parse_args()
+
+    print >>stderr, "Fetching stats from %s ..." % cli.source
+    downloader = eplstats.Downloader(source=cli.source,
+        username=cli.username, password=cli.password, cache_dir=cli.cache,
+        replay=cli.replay, base_url=cli.base_url)
+
+    players = []
+    for position in _positions:
+        players += downloader.get(position, source=cli.source,
+            season=cli.season)
+    print >>stderr, "Done."
+
+    with codecs.open(cli.roster, 'r', 'utf8') as fh:
+        team = read_team_file(fh)
+    current = list(simulate.encode([team], players)[0][0])
+
+    previous = None
+    if cli.previous is not None:
+        with open(cli.previous) as fh:
+            previous = json.load(fh)
+
+    print >>stderr, "Planning %d gameweeks ..." % cli.horizon
+    result = plan(players, current, horizon=cli.horizon, score=cli.score,
+        home=cli.home, budget=cli.budget, bank=cli.bank,
+        free_transfers=cli.free_transfers, hit=cli.hit, bench=cli.bench,
+        captain=cli.captain, previous=previous)
+
+    print
+    print_plan(result)
+
+    if cli.save is not None:
+        with open(cli.save, 'w') as fh:
+            json.dump(result, fh, indent=2)
+
+    if cli.metrics is not None:
+        metrics.report()
+        metrics.dump(cli.metrics)
@@ -0,0 +1,199 @@
+#-*-coding:utf8-*-
+'''
+replay.py
+
+Record raw HTTP responses to a fixture archive and serve them back later.
+
+---
+A fixture archive is a single zip file (deflate compressed). It holds an
+`index.json` describing every recorded exchange, plus one member per
+response body. Exchanges are keyed by method and URL only, so the archive
+never contains request bodies (i.e. login credentials). When the same
+request was made several times the responses are replayed in the order they
+were recorded, and the last one is repeated after that.
+
+Usage:
+>>> downloader = eplstats.Downloader(source='espn', record='espn.zip')
+>>> downloader.get('keepers')
+...
+>>> downloader = eplstats.Downloader(source='espn', replay='espn.zip')
+>>> downloader.get('keepers')     # No network access
+
+From the command line use `--record FILE` and `--replay FILE` with
+optimize_roster.py or teamdiff.py.
+'''
+
+import urllib
+import urllib2
+import httplib
+import hashlib
+import atexit
+import zipfile
+import json
+import time
+import os
+from StringIO import StringIO
+
+
+
+
+class FixtureArchive(object):
+    '''Compressed store of recorded responses.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = dict()
+        self._bodies = dict()
+        self._cursor = dict()
+
+        if os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def key(method, url):
+        return hashlib.sha1("%s %s" % (method, url)).hexdigest()
+
+    def load(self):
+        with zipfile.ZipFile(self.path, 'r') as zf:
+            self.entries = json.loads(zf.read('index.json'))['entries']
+
+            for exchanges in self.entries.values():
+                for ex in exchanges:
+                    self._bodies[ex['body']] = zf.read(ex['body'])
+
+    def save(self):
+        tmp = self.path + '.tmp'
+
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('index.json', json.dumps({
+                'version' : 1,
+                'entries' : self.entries
+            }, indent=1, sort_keys=True))
+
+            for name, body in self._bodies.iteritems():
+                zf.writestr(name, body)
+
+        os.rename(tmp, self.path)
+
+    def add(self, method, url, status, reason, headers, body, seconds=0.):
+        key = self.key(method, url)
+        exchanges = self.entries.setdefault(key, [])
+        name = "bodies/%s-%d" % (key, len(exchanges))
+
+        exchanges.append({
+            'method' : method,
+            'url' : url,
+            'status' : status,
+            'reason' : reason,
+            'headers' : headers,
+            'body' : name,
+            'seconds' : seconds
+        })
+        self._bodies[name] = body
+
+    def next(self, method, url):
+        '''Next recorded (exchange, body) for the request, or None.'''
+        key = self.key(method, url)
+        exchanges = self.entries.get(key)
+
+        if not exchanges:
+            return None
+
+        i = self._cursor.get(key, 0)
+        self._cursor[key] = i + 1
+        ex = exchanges[min(i, len(exchanges)-1)]
+
+        return ex, self._bodies[ex['body']]
+
+
+
+
+class RecordProcessor(urllib2.BaseHandler):
+    '''Archive every response as it comes back from the network. Sits after
+    transport.GzipProcessor so bodies are stored inflated, and before
+    urllib2's error processing so error pages are recorded too.
+
+    A 304 is recorded as the 200 it resolves to from `store` (the
+    transport.ResponseStore of the opener), so the archive replays without
+    that cache. The archive is written once, on `close` or at exit.'''
+    handler_order = 420
+
+    def __init__(self, archive, store=None):
+        self.archive = archive
+        self.store = store
+        self._started = dict()
+        self._dirty = False
+        atexit.register(self.close)
+
+    def close(self):
+        if self._dirty:
+            self.archive.save()
+            self._dirty = False
+
+    def http_request(self, req):
+        self._started[id(req)] = time.time()
+        return req
+
+    def http_response(self, req, resp):
+        body = resp.read()
+        seconds = time.time() - self._started.pop(id(req), time.time())
+
+        entry = None
+        if resp.code == 304 and self.store is not None:
+            entry = self.store.load(req.get_full_url())
+
+        if entry is not None:
+            self.archive.add(req.get_method(), req.get_full_url(), 200,
+                'OK', entry['headers'], entry['body'], seconds)
+        else:
+            self.archive.add(req.get_method(), req.get_full_url(),
+                resp.code, resp.msg, str(resp.info()), body, seconds)
+        self._dirty = True
+
+        new_resp = urllib.addinfourl(StringIO(body), resp.info(),
+            resp.geturl(), resp.code)
+        new_resp.msg = resp.msg
+        for name in ('wire_bytes', 'not_modified'):
+            if hasattr(resp, name):
+                setattr(new_resp, name, getattr(resp, name))
+
+        return new_resp
+
+    https_request = http_request
+    https_response = http_response
+
+
+
+
+class ReplayHandler(urllib2.BaseHandler):
+    '''Answer requests from a FixtureArchive instead of the network. If
+    `latency` is set, recorded response times are reproduced.'''
+    # Ahead of every real HTTP handler
+    handler_order = 100
+
+    def __init__(self, archive, latency=False):
+        self.archive = archive
+        self.latency = latency
+
+    def _open(self, req):
+        found = self.archive.next(req.get_method(), req.get_full_url())
+
+        if found is None:
+            raise urllib2.URLError("No recorded response for %s %s" \
+                % (req.get_method(), req.get_full_url()))
+
+        ex, body = found
+
+        if self.latency:
+            time.sleep(ex['seconds'])
+
+        headers = httplib.HTTPMessage(StringIO(ex['headers']))
+        resp = urllib.addinfourl(StringIO(body), headers, ex['url'],
+            ex['status'])
+        resp.msg = ex['reason']
+        resp.wire_bytes = 0
+
+        return resp
+
+    http_open = _open
+    https_open = _open
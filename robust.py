@@ -0,0 +1,148 @@
+#-*-coding:utf8-*-
+'''
+robust.py
+
+Downside-aware rosters: optimize over simulated gameweeks instead of a
+single expected score.
+
+---
+Draws `scenarios` gameweeks of player points with simulate.py, scaled so
+that each candidate's average over the draws is about its usual score, and
+maximizes
+
+    (1 - risk) * mean + risk * CVaR(alpha)
+
+where CVaR(alpha) is the average points of the worst `alpha` share of the
+scenarios. `risk` of 0 is the usual expected-points roster, 1 maximizes the
+bad-week average only; anything in between trades mean for a safer floor.
+
+The CVaR term is linear (Rockafellar & Uryasev):
+
+    CVaR = max  t - 1/(alpha S) sum_s u_s
+           s.t. u_s >= t - points_s,  u_s >= 0
+
+On top of the roster model (see model.py) there is one column per player
+holding the points weight he is picked with (0, bench fraction, 1 or
+captain multiplier, times any adjustment), so each scenario row has one
+entry per player who scored in it rather than one per candidate. All rows
+are scipy.sparse.
+
+Usage:
+>>> r = robust.solve(candidates, player_objs, scenarios=200, alpha=.2,
+...     risk=.5)
+
+or `--risk .5 --alpha .2 --scenarios 200` with optimize_roster.py.
+
+---
+Joe Nudell
+'''
+
+from exact import Result
+from model import roster_model, solve_milp
+import simulate
+import metrics
+import numpy as np
+import scipy.sparse as sp
+
+
+
+def scenario_points(players, scenarios=200, seed=0, dispersion=2.):
+    '''Simulated points of every player, divided by his expected points, so
+    that scenario points of a candidate are its score times this. Shape
+    (scenarios, players).'''
+    dist = simulate.distributions(players)
+    points = simulate.sample(dist, scenarios, seed=seed,
+        dispersion=dispersion).astype(float)
+
+    expected = dist['play'] * dist['mean']
+    scale = np.where(expected > 0, 1. / np.maximum(expected, 1e-12), 0.)
+
+    return points * scale
+
+
+
+def solve(candidates, players, budget=100., scenarios=200, alpha=.2,
+    risk=1., seed=0, dispersion=2., solver='glpk', rules=None, model=None,
+    relative=None, **solver_args):
+    '''Roster maximizing (1 - risk) * mean + risk * CVaR(alpha) of points
+    over simulated gameweeks. `players` are the Player objects the
+    candidates were built from (candidate pid i is players[i-1]). Returns a
+    Result with the chosen candidate names in `xf`, plus the `mean` and
+    `cvar` of the roster over the scenarios. `rules` are extra league rules
+    compiled by rules.compile_rules.
+
+    Callers solving many variants of one pool (see batch.py) can pass a
+    ready `model` from roster_model, which then stands for `budget` and
+    `rules`, and `relative` from scenario_points, which stands for
+    `players` and `scenarios`.'''
+    if not 0 < alpha <= 1:
+        raise ValueError("alpha must be in (0, 1], got %s" % alpha)
+
+    if relative is None:
+        with metrics.span('scenarios', scenarios=scenarios):
+            relative = scenario_points(players, scenarios, seed=seed,
+                dispersion=dispersion)
+
+    m = model
+    if m is None:
+        m = roster_model(candidates, budget=budget, rules=rules)
+    n, (S, P) = m['n'], relative.shape
+
+    # Columns: candidates x (n), player weights y (P), t (1), shortfalls u (S)
+    iy, it, iu = n, n + P, n + P + 1
+    width = n + P + 1 + S
+
+    # y_p - sum of score_j x_j over p's candidates = 0
+    scores = sp.csr_matrix((m['f'], (m['pids'] - 1, np.arange(n))),
+        shape=(P, n))
+    link = sp.hstack([-scores, sp.identity(P, format='csr'),
+        sp.csr_matrix((P, 1 + S))]).tocsr()
+
+    # t - sum_p points_sp y_p - u_s <= 0
+    nz = sp.csr_matrix(relative)
+    shortfall = sp.hstack([
+        sp.csr_matrix((S, n)),
+        -nz,
+        sp.csr_matrix(np.ones((S, 1))),
+        -sp.identity(S, format='csr')
+    ]).tocsr()
+    metrics.count('scenario_nonzeros', nz.nnz)
+
+    pad = lambda M: sp.hstack([M, sp.csr_matrix((M.shape[0],
+        width - n))]).tocsr()
+
+    A = sp.vstack([pad(m['A']), shortfall]).tocsr()
+    b = np.concatenate([m['b'], np.zeros(S)])
+    Aeq = sp.vstack([pad(m['Aeq']), link]).tocsr()
+    beq = np.concatenate([m['beq'], np.zeros(P)])
+
+    # The mean term uses the candidates' own scores, so risk=0 gives
+    # exactly the usual roster
+    f = np.zeros(width)
+    f[:n] = (1 - risk) * m['f']
+    f[it] = risk
+    f[iu:] = -risk / (alpha * S)
+
+    lb = np.zeros(width)
+    lb[it] = -np.inf
+    ub = np.empty(width)
+    ub.fill(np.inf)
+    ub[:n] = m['upper']
+
+    r = solve_milp(f, A, b, Aeq, beq, lb, ub, range(n), solver=solver,
+        **solver_args)
+
+    x = np.asarray(r.xf)
+    chosen = np.flatnonzero(x[:n] > .5)
+
+    # Report the roster's scenario distribution as a plain total
+    totals = relative.dot(x[iy:it])
+    worst = np.sort(totals)[:max(1, int(round(alpha * S)))]
+
+    result = Result([candidates[j]['name'] for j in chosen], r.ff,
+        getattr(r, 'elapsed', None))
+    result.mean = totals.mean()
+    result.cvar = worst.mean()
+    result.isFeasible = r.isFeasible
+
+    return result
@@ -0,0 +1,231 @@
+#-*-coding:utf8-*-
+'''
+rolling.py
+
+Rolling form aggregates per player, kept up to date one gameweek at a time.
+
+---
+Recomputing "points over the last five weeks" from the raw history costs
+more every week of the season. Instead a FormState keeps, per player id:
+
+ * the last `window` weeks of points and minutes played, as a ring buffer
+   indexed by gameweek modulo `window`
+ * exponentially weighted averages of points, minutes and price changes
+ * the running totals needed to turn the EPL's season `minutes` into
+   minutes per week, and the last price
+
+so folding in a new gameweek is a handful of array operations over the
+pool. A pool fetched again within the same gameweek replaces that week's
+values instead of adding another week: the averages are kept as they were
+before the week, too.
+
+Weeks skipped between two updates count as weeks without points or
+minutes. A player's first week counts his season average of minutes.
+
+The aggregates are set on the players as attributes, so `--score` can use
+them like any other stat:
+
+ * points_last3, points_last5     event_points summed over the last weeks
+ * points_ewma                    EWMA of event_points
+ * minutes_last3                  minutes played over the last three weeks
+ * minutes_trend                  EWMA of weekly minutes, less their
+                                  season average
+ * price_momentum                 EWMA of the weekly price change (millions)
+
+Players need an `id` and `event_points`, i.e. the EPL source.
+
+Usage:
+>>> state = rolling.FormState.load('form-2014.npz')
+>>> state.update(players, gameweek=6)
+>>> state.annotate(players)
+>>> state.save('form-2014.npz')
+
+or `--form FILE --gameweek N` with optimize_roster.py.
+
+---
+Joe Nudell
+'''
+
+import numpy as np
+import metrics
+import os
+
+
+aggregates = ['points_last3', 'points_last5', 'points_ewma',
+    'minutes_last3', 'minutes_trend', 'price_momentum']
+
+# Smoothing of the EWMAs: weight of the newest week
+alpha = .3
+
+# Per player state: (name, dtype)
+_fields = [
+    ('ids', np.int32),
+    ('seen', np.int16),             # weeks the player has been in the pool
+    ('points_ewma', np.float64),
+    ('minutes_ewma', np.float64),
+    ('price_momentum', np.float64),
+    ('minutes_total', np.float64),  # season minutes as of the last week
+    ('cost', np.float64)            # price as of the last week
+]
+
+
+
+def _value(players, name):
+    return np.array([float(p.get(name) or 0.) for p in players])
+
+
+
+class FormState(object):
+    '''Rolling aggregates for every player id seen so far.'''
+
+    def __init__(self, window=5):
+        self.window = window
+        self.gameweek = 0
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.points = np.zeros((0, window))
+        self.minutes = np.zeros((0, window))
+
+        # Per player state, as of the end of the last finished week and as
+        # of the current one
+        self.before = dict((f, np.zeros(0, dtype=t)) for f, t in _fields
+            if f != 'ids')
+        self.now = dict((f, a.copy()) for f, a in self.before.items())
+
+    def _grow(self, ids):
+        '''Add rows for ids not seen before. Returns row of every id.'''
+        new = np.setdiff1d(ids, self.ids)
+
+        if len(new):
+            merged = np.concatenate([self.ids, new])
+            order = np.argsort(merged, kind='mergesort')
+            self.ids = merged[order]
+
+            def grow(a):
+                pad = np.zeros((len(new),) + a.shape[1:], dtype=a.dtype)
+                return np.concatenate([a, pad])[order]
+
+            self.points = grow(self.points)
+            self.minutes = grow(self.minutes)
+            for state in (self.before, self.now):
+                for f in state:
+                    state[f] = grow(state[f])
+
+        return np.searchsorted(self.ids, ids)
+
+    @metrics.timed('form_update')
+    def update(self, players, gameweek):
+        '''Fold the pool as fetched in `gameweek` into the aggregates.'''
+        if gameweek < 1:
+            raise ValueError("Gameweeks start at 1, not %d" % gameweek)
+        if gameweek < self.gameweek:
+            raise ValueError("Form state is already at gameweek %d" %
+                self.gameweek)
+
+        players = [p for p in players if p.get('id') is not None]
+        rows = self._grow(np.array([int(p.id) for p in players],
+            dtype=np.int32))
+
+        if gameweek > self.gameweek:
+            # Close the last week, and clear the slots of this one and of
+            # any skipped in between
+            self.before = dict((f, a.copy()) for f, a in self.now.items())
+            for w in range(max(self.gameweek + 1, gameweek -
+                self.window + 1), gameweek + 1):
+                self.points[:, w % self.window] = 0.
+                self.minutes[:, w % self.window] = 0.
+            skipped = gameweek - self.gameweek - 1
+            self.gameweek = gameweek
+        else:
+            skipped = 0
+
+        b, now = self.before, self.now
+        slot = gameweek % self.window
+        keep = 1. - alpha
+
+        points = _value(players, 'event_points')
+        total = _value(players, 'minutes')
+        cost = _value(players, 'cost')
+
+        # A player's first week may be well into the season, so it gets his
+        # season average of minutes
+        new = b['seen'][rows] == 0
+        minutes = np.where(new, total / gameweek,
+            np.maximum(total - b['minutes_total'][rows], 0.))
+        change = np.where(new, 0., cost - b['cost'][rows])
+
+        self.points[rows, slot] = points
+        self.minutes[rows, slot] = minutes
+
+        # Skipped weeks decay the averages as weeks of nothing
+        decay = keep ** (skipped + 1)
+        now['points_ewma'][rows] = np.where(new, points,
+            decay * b['points_ewma'][rows] + alpha * points)
+        now['minutes_ewma'][rows] = np.where(new, minutes,
+            decay * b['minutes_ewma'][rows] + alpha * minutes)
+        now['price_momentum'][rows] = \
+            decay * b['price_momentum'][rows] + alpha * change
+        now['minutes_total'][rows] = total
+        now['cost'][rows] = cost
+        now['seen'][rows] = b['seen'][rows] + 1
+
+    def _last(self, ring, n):
+        '''Sum of the last `n` weeks of a ring buffer.'''
+        slots = [w % self.window for w in
+            range(self.gameweek - n + 1, self.gameweek + 1) if w > 0]
+        return ring[:, slots].sum(1)
+
+    def columns(self):
+        '''{aggregate: array over self.ids}.'''
+        now = self.now
+        weeks = max(self.gameweek, 1)
+
+        return {
+            'points_last3' : self._last(self.points, 3),
+            'points_last5' : self._last(self.points, min(5, self.window)),
+            'points_ewma' : now['points_ewma'],
+            'minutes_last3' : self._last(self.minutes, 3),
+            'minutes_trend' : now['minutes_ewma'] - now['minutes_total'] /
+                weeks,
+            'price_momentum' : now['price_momentum']
+        }
+
+    def annotate(self, players):
+        '''Set the aggregates as attributes of every player with an id.'''
+        players = [p for p in players if p.get('id') is not None]
+        ids = np.array([int(p.id) for p in players], dtype=np.int32)
+        rows = np.minimum(np.searchsorted(self.ids, ids),
+            max(len(self.ids) - 1, 0))
+        known = (self.ids[rows] == ids) if len(self.ids) else \
+            np.zeros(len(ids), dtype=bool)
+
+        for name, values in self.columns().items():
+            for p, row, k in zip(players, rows, known):
+                setattr(p, name, float(values[row]) if k else 0.)
+
+    def save(self, path):
+        arrays = dict(('before_' + f, a) for f, a in self.before.items())
+        arrays.update(('now_' + f, a) for f, a in self.now.items())
+
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, ids=self.ids, points=self.points, minutes=self.minutes,
+            gameweek=self.gameweek, window=self.window, **arrays)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, window=5):
+        '''Saved state at `path`, or a new one if there is none yet.'''
+        if not os.path.exists(path):
+            return cls(window)
+
+        data = np.load(path)
+        state = cls(int(data['window']))
+        state.gameweek = int(data['gameweek'])
+        state.ids = data['ids']
+        state.points = data['points']
+        state.minutes = data['minutes']
+
+        for f, _ in _fields[1:]:
+            state.before[f] = data['before_' + f]
+            state.now[f] = data['now_' + f]
+
+        return state
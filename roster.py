@@ -0,0 +1,297 @@
+#-*-coding:utf8-*-
+'''
+roster.py
+
+Name matching and roster file helpers shared by optimize_roster.py and
+teamdiff.py.
+
+---
+Nothing in here needs the solver or BeautifulSoup, so tools that only read
+and compare rosters start quickly.
+
+Roster files come in two formats, both written by optimize_roster.py and
+both read by `read_team_file`: the fixed-width text table, and JSON
+(`--out team.json`), which also has every player's source `id` and `key`
+(see changes.key). `PoolIndex` finds roster entries in a fetched pool with
+a dict lookup on the key, falling back on names only for entries that
+don't have one or whose key isn't in the pool (e.g. a roster written from
+another source).
+
+---
+Joe Nudell
+'''
+
+from sys import stderr
+from changes import key as player_key
+import metrics
+import json
+import os
+import re
+
+
+# Fixed-width layout of roster files written by optimize_roster.print_results
+roster_line_format= u"{:<15}{:<15}{:<15}{:<14}{:^6}{:<5}{:<7}"
+
+
+
+
+def get_injured_list(fn, has_header=True):
+    if not os.path.exists(fn):
+        raise IOError("Injured list file `%s` does not exist" % fn)
+
+    disabled_list = []
+
+    with open(fn) as fh:
+
+        for i, line in enumerate(fh.readlines()):
+            if has_header and i==0:
+                # Skip header line
+                continue
+
+            try:
+                # Sloppy splitting. Should maybe use struct module.
+                fname = line[:20].strip()
+                lname = line[20:40].strip()
+                club = line[40:50].strip()
+                factor = float(line[50:70].strip())
+                notes = line[70:].strip()
+
+            except Exception as e:
+                raise IOError("Injured list file `%s` is misformatted: %s" \
+                    %(fn, e))
+
+            try:
+                factor = float(factor)
+            except ValueError:
+                if i==0:
+                    if not has_header:
+                        print >>stderr, \
+                        "Warning: Header detected though has_header not set"
+                    continue
+                else:
+                    raise ValueError("Can't parse %s as float" % factor)
+
+            # Store player info
+            disabled_list.append({
+                'first_name' : fname,
+                'last_name' : lname,
+                'factor' : factor,
+                'club' : club,
+                'news' : notes
+            })
+
+    return disabled_list
+
+
+
+def sanitize(s):
+    try:
+        s = s.encode('ascii', 'replace')
+    except UnicodeDecodeError:
+        s = s.decode('utf8').encode('ascii', 'replace')
+
+    return re.sub(r'[^\w]', '', s.lower())
+
+
+
+
+def player_in_roster(player, roster,
+    first_name='first_name', last_name='last_name', club='club'):
+    '''Try to find given player (Player object) in roster (list of dicts).
+    Problem is hard because of possible variations in spelling, encoding, etc.
+    Heuristics used are to first match club, then try some variations of the
+    sanitized name.
+    Returns the player dict if found in roster, otherwise None.'''
+    fname = sanitize(player.first_name)
+    lname = sanitize(player.last_name)
+    pclub = sanitize(player.club)
+
+    for _aplayer in roster:
+        # Note : Right now the heuristics used for matching are *good enough*,
+        # but they could be better.
+
+        if sanitize(_aplayer[club]) == pclub:
+            # Correct club
+            _aln = sanitize(_aplayer[last_name])
+            _afn = sanitize(_aplayer[first_name])
+
+            if _aln==lname and _afn==fname:
+                # Simple case: total match for first name, last name
+                return _aplayer
+
+            elif _aln==lname and len(fname)==0:
+                # Helps match Brazilians, mostly
+                return _aplayer
+
+            elif _afn==fname and len(lname)==0:
+                # Same as previous
+                return _aplayer
+
+            elif fname[:1]==_afn[:1] and _aln==lname:
+                # First initial last name. Hopefully no collisions!
+                return _aplayer
+
+    return None
+
+
+
+
+@metrics.timed('match_adjustment')
+def get_adjustment(player, adjustments, threshold=1, silent=False):
+    '''Determine whether player should be devalued at all. Find given
+    player in the adjustments list. Try to match player names via several
+    heuristics. Use threshold to ignore adjustments above a certain level.
+    Useful e.g. if you don't want to devalue players who have a .75 chance
+    of playing --- these people could be back for the rest of the season.'''
+    adj = 1.
+
+    adj_player = player_in_roster(player, adjustments)
+
+    if adj_player is not None:
+        adj = adj_player['factor']
+
+    if adj >= threshold:
+        adj = 1.
+
+    if not silent and adj!=1.:
+        print >>stderr, " * Ignoring %s %s (%s) ~ %s" % \
+        (
+            adj_player['first_name'],
+            adj_player['last_name'],
+            adj_player['club'],
+            adj_player['news']
+        )
+
+    return adj
+
+
+
+
+def _get_line_slices(formatstr):
+    '''Get the fixed-width line break points from a format string'''
+    ms = re.findall(r'\{.+?(\d+?)\}', formatstr)
+
+    return [int(b) for b in ms]
+
+
+def _slice_line(line, points):
+    '''Slice a line into the pieces as specified by break points in `points`'''
+    slices = []
+
+    i = 0
+    for point in points:
+        slices.append(line[i:i+point].strip())
+        i += point
+
+    return slices
+
+
+def read_team_file(fh):
+    '''Read the team roster from the given file object. Should be in one of
+    the formats that are outputted by optimize_roster.'''
+    keys = []
+    roster = []
+    slice_points = _get_line_slices(roster_line_format)
+
+    text = fh.read()
+    if text.lstrip().startswith('{'):
+        return json.loads(text)['roster']
+
+    for i, line in enumerate(text.splitlines(True)):
+        if i == 0 :
+            # Header row: read as keys
+            keys = _slice_line(line, slice_points)
+
+            # Make header names easier to work with
+            keys = [re.sub(r'\s+', '_', k.lower()) for k in keys]
+            continue
+
+        elif i == 1:
+            # These are just delimeters
+            continue
+
+        else:
+            # Interpret content line
+            slices = _slice_line(line, slice_points)
+
+            # Adjust types
+            slices[-1] = float(slices[-1])
+            slices[-3] = len(slices[-3])>0
+
+            # Make dict using keys from header
+            new_player = dict(zip(keys, slices))
+
+            roster.append(new_player)
+
+    return roster
+
+
+
+def roster_files(paths):
+    '''Roster files named by `paths`, directories expanded.'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, fn) for fn in os.listdir(path)
+                if not fn.startswith('.'))
+        else:
+            files.append(path)
+    return files
+
+
+
+def write_team_json(fh, roster):
+    '''Write roster dicts, shaped as read_team_file returns them plus the
+    `id` and `key` of every player, as a JSON roster file.'''
+    json.dump({'roster': roster}, fh, indent=2)
+
+
+
+
+def _name_key(first_name, last_name, club):
+    return (sanitize(club), sanitize(last_name), sanitize(first_name))
+
+
+class PoolIndex(object):
+    '''Lookups from roster entries to positions in a list of Players.'''
+
+    def __init__(self, players):
+        self.players = players
+        self.by_key = {}
+        self.by_name = {}
+
+        for i, p in enumerate(players):
+            self.by_key.setdefault(player_key(p), i)
+            self.by_name.setdefault(_name_key(p.first_name, p.last_name,
+                p.club), i)
+
+    def find(self, entry):
+        '''Index of a roster entry in the pool, or None.'''
+        i = self.by_key.get(entry.get('key'))
+        if i is not None:
+            return i
+
+        i = self.by_name.get(_name_key(entry['first_name'],
+            entry['last_name'], entry['club']))
+        if i is not None:
+            return i
+
+        # Fall back on the fuzzy name matching
+        for i, p in enumerate(self.players):
+            if player_in_roster(p, [entry]) is not None:
+                return i
+
+        return None
+
+    def indices(self, roster):
+        '''Index of every entry of a roster. Raises ValueError for entries
+        that aren't in the pool.'''
+        out = []
+        for entry in roster:
+            i = self.find(entry)
+            if i is None:
+                raise ValueError("Can't find %s %s (%s) in pool" % \
+                    (entry['first_name'], entry['last_name'],
+                    entry['club']))
+            out.append(i)
+        return out
@@ -0,0 +1,253 @@
+#-*-coding:utf8-*-
+'''
+rules.py
+
+League rules beyond the standard squad, compiled to sparse model rows.
+
+---
+Rules are written one per line, in a file (`--rules FILE`) or on the
+command line (`--rule '...'`, any number of times). Case doesn't matter,
+and `#` starts a comment.
+
+    max 3 per club                  at most 3 players from any one club
+    max 2 starters per club         ... counting starters only
+    min 2 starters from ARS, CHE    at least 2 starters from these clubs
+    exactly 1 from LIV              (`subs` counts substitutes only)
+    max price 10.5                  nobody costing more than 10.5
+    include Sergio Aguero (MCI)     this player must be in the squad
+    exclude Suarez (LIV)            this one mustn't
+
+Players are named `First Last (CLUB)`, with the club optional; names are
+matched the way adjustment files are (see roster.player_in_roster).
+
+`compile_rules` turns rules into rows over the candidates from
+optimize_roster.get_player_stats:
+
+ * exclusions and price ceilings don't make rows at all: they fix the
+   candidates' columns at 0 (`excluded`), and those columns are dropped
+   from every row
+ * every other rule gives one row per club it covers, a sum over the
+   candidates of those players (each player is picked at most once, so
+   the sum counts players). `min` rows are negated into `<=` rows
+ * rows are then grouped by their columns: duplicates keep only the
+   tightest bound, and `<=` rows that can't bind (more than
+   the squad could ever put in them) are dropped
+
+so dozens of overlapping club rules only add the rows that matter.
+
+Usage:
+>>> rules = rules.parse(['max 3 per club', 'exclude Suarez (LIV)'])
+>>> compiled = rules.compile_rules(rules, candidates, player_objs)
+>>> compiled.ub.rows, compiled.excluded
+
+model.roster_model and optimize_roster.solve_roster take the compiled
+rules as `rules`.
+
+---
+Joe Nudell
+'''
+
+from roster import sanitize, player_in_roster
+from model import Rows
+import numpy as np
+import metrics
+import re
+
+
+# Most players a squad can put into a row, by who is counted
+role_caps = {'players': 15, 'starters': 11, 'subs': 4}
+
+_count_re = re.compile(r'^(max|min|exactly)\s+(\d+)\s*'
+    r'(players|starters|subs)?\s+(per\s+club|from\s+(.+))$')
+_price_re = re.compile(r'^max\s+(?:price|cost)\s+([\d.]+)$')
+_player_re = re.compile(r'^(include|exclude)\s+(.+?)\s*(?:\((\w+)\))?$',
+    re.I)
+
+
+
+class RuleError(ValueError):
+    pass
+
+
+
+class Rule(object):
+    '''One parsed rule. `kind` is count, price, include or exclude.'''
+
+    def __init__(self, source, kind, **attrs):
+        self.source = source
+        self.kind = kind
+        self.__dict__.update(attrs)
+
+    def __repr__(self):
+        return "<Rule %s>" % self.source
+
+
+
+def parse_rule(line):
+    '''Rule from one line of text, or None for blanks and comments.'''
+    source = line.split('#', 1)[0].strip()
+    text = re.sub(r'\s+', ' ', source.lower())
+
+    if not text:
+        return None
+
+    m = _count_re.match(text)
+    if m is not None:
+        op, n, role, scope, clubs = m.groups()
+        return Rule(source, 'count', op=op, n=int(n),
+            role=role or 'players', per_club=clubs is None,
+            clubs=[c.strip() for c in (clubs or '').split(',')
+                if c.strip()])
+
+    m = _price_re.match(text)
+    if m is not None:
+        return Rule(source, 'price', ceiling=float(m.group(1)))
+
+    m = _player_re.match(source.strip())
+    if m is not None:
+        name, club = m.group(2).split(), m.group(3)
+        return Rule(source, m.group(1).lower(),
+            first_name=' '.join(name[:-1]), last_name=name[-1], club=club)
+
+    raise RuleError("Can't understand rule `%s`" % source)
+
+
+
+def parse(lines):
+    '''Rules from lines of text.'''
+    return [r for r in (parse_rule(l) for l in lines) if r is not None]
+
+
+
+def read_rules(fn):
+    with open(fn) as fh:
+        return parse(fh.readlines())
+
+
+
+def _matches(player, rule):
+    '''Is the Player the one named in an include/exclude rule?'''
+    if rule.club is not None:
+        return player_in_roster(player, [{'first_name': rule.first_name,
+            'last_name': rule.last_name, 'club': rule.club}]) is not None
+
+    full = sanitize(rule.first_name + rule.last_name)
+    if rule.first_name:
+        return sanitize(player.first_name + player.last_name) == full
+    return full in (sanitize(player.last_name), sanitize(player.first_name))
+
+
+
+class Compiled(object):
+    '''Rules as rows over candidate columns: `ub` (sum <= rhs) and `eq`
+    (sum == rhs) are model.Rows, `excluded` flags columns fixed at 0.'''
+
+    def __init__(self, rules, n):
+        self.rules = rules
+        self.excluded = np.zeros(n, dtype=bool)
+        self.ub = Rows()
+        self.eq = Rows()
+
+    def upper(self):
+        '''Upper bound of every candidate column.'''
+        return np.where(self.excluded, 0., 1.)
+
+    def __len__(self):
+        return len(self.ub.rhs) + len(self.eq.rhs)
+
+
+
+@metrics.timed('compile_rules')
+def compile_rules(rules, candidates, players):
+    '''Compile rules over `candidates`, built from Players `players`
+    (candidate pid i is players[i-1]).'''
+    n = len(candidates)
+    compiled = Compiled(rules, n)
+
+    pids = np.array([c['pid'] for c in candidates])
+    clubs = np.array([sanitize(c['club']) for c in candidates])
+    cost = np.array([c['cost'] for c in candidates], dtype=float)
+    sub = np.array([c['bench'] == 'sub' for c in candidates])
+    roles = {'players': np.ones(n, dtype=bool), 'starters': ~sub,
+        'subs': sub}
+
+    # Fixed columns first, so rows are grouped as they will be solved
+    for rule in rules:
+        if rule.kind == 'price':
+            compiled.excluded |= cost > rule.ceiling + 1e-9
+        elif rule.kind == 'exclude':
+            compiled.excluded |= _players(rule, players)[pids - 1]
+
+    live = ~compiled.excluded
+
+    # Rows as {columns: rhs}, grouped so duplicates keep the tightest
+    ub, eq = {}, {}
+
+    for rule in rules:
+        if rule.kind == 'include':
+            _add(ub, eq, 'exactly', 'players',
+                _players(rule, players)[pids - 1] & live, 1, rule)
+        elif rule.kind == 'count':
+            groups = [[sanitize(c) for c in rule.clubs]]
+            if rule.per_club:
+                groups = [[c] for c in np.unique(clubs)]
+
+            unknown = set(groups[0]) - set(clubs)
+            if unknown:
+                raise RuleError("No club %s in `%s`" % (
+                    ", ".join(sorted(unknown)), rule.source))
+
+            for group in groups:
+                on = np.in1d(clubs, group) & roles[rule.role] & live
+                _add(ub, eq, rule.op, rule.role, on, rule.n, rule)
+
+    for key, rhs in sorted(eq.items()):
+        on = np.array(key, dtype=int)
+        compiled.eq.add(on, np.ones(len(on)), rhs)
+
+    for (key, sign), (rhs, cap) in sorted(ub.items()):
+        on = np.array(key, dtype=int)
+        most = min(cap, len(np.unique(pids[on])))
+
+        if sign > 0 and rhs >= most or sign < 0 and rhs >= 0:
+            # Can't bind
+            continue
+        if sign < 0 and -rhs > most:
+            raise RuleError("Rules can't be met: a `min` rule asks for "
+                "more players than there are")
+        compiled.ub.add(on, sign * np.ones(len(on)), rhs)
+
+    metrics.count('rule_rows', len(compiled))
+
+    return compiled
+
+
+
+def _players(rule, players):
+    '''Which of `players` an include/exclude rule names.'''
+    mine = np.array([_matches(p, rule) for p in players], dtype=bool)
+    if not mine.any():
+        raise RuleError("No player matches `%s`" % rule.source)
+    return mine
+
+
+
+def _add(ub, eq, op, role, on, n, rule):
+    '''Group a row over columns `on` with the others.'''
+    key = tuple(np.flatnonzero(on))
+    cap = role_caps[role]
+
+    if op == 'exactly':
+        if not key and n:
+            raise RuleError("Rules can't be met at `%s`: every player it "
+                "covers is excluded" % rule.source)
+        if eq.get(key, n) != n:
+            raise RuleError("Rules contradict each other at `%s`" %
+                rule.source)
+        eq[key] = n
+    elif op == 'max':
+        old = ub.get((key, 1), (n, cap))
+        ub[(key, 1)] = (min(old[0], n), cap)
+    else:
+        old = ub.get((key, -1), (-n, cap))
+        ub[(key, -1)] = (min(old[0], -n), cap)
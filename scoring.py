@@ -0,0 +1,180 @@
+#-*-coding:utf8-*-
+'''
+scoring.py
+
+Score expressions: value players by arithmetic over their stats.
+
+---
+`--score` takes an expression over Player attributes, e.g.
+
+    0.6*average_points*chance_of_playing_next_round + 0.4*form
+
+A plain attribute name is just the simplest expression. Expressions may use
+numbers, attribute names, + - * / ** and parentheses, and the functions in
+`functions` (min and max are elementwise with two arguments). Calls with
+the wrong number of arguments are rejected when the expression is
+compiled, and scores that come out infinite or NaN when it is evaluated.
+
+An expression is parsed and checked once. Evaluating it over a list of
+players pulls each attribute it mentions into one array and computes the
+whole expression with NumPy in one go. Attributes a player doesn't have
+count as `defaults` (1 for the chance of playing, 0 otherwise); the EPL
+source gives some numbers as strings, which are converted.
+
+Usage:
+>>> expr = scoring.compile_score('0.5*average_points + 0.5*form')
+>>> expr.columns
+['average_points', 'form']
+>>> expr.evaluate(players)
+array([ 4.1, 2.9, ...])
+
+`evaluate(score, players)` also takes a callable, which is called once per
+player.
+
+---
+Joe Nudell
+'''
+
+import ast
+import numpy as np
+
+
+# Name: (function, number of arguments)
+functions = {
+    'abs' : (np.abs, 1),
+    'log' : (np.log, 1),
+    'sqrt' : (np.sqrt, 1),
+    'exp' : (np.exp, 1),
+    'min' : (np.minimum, 2),
+    'max' : (np.maximum, 2)
+}
+
+defaults = {
+    'chance_of_playing_next_round' : 1.,
+    'chance_of_playing_this_round' : 1.
+}
+
+_operators = {
+    ast.Add : np.add,
+    ast.Sub : np.subtract,
+    ast.Mult : np.multiply,
+    ast.Div : np.true_divide,
+    ast.Pow : np.power
+}
+
+_unary = {
+    ast.USub : np.negative,
+    ast.UAdd : lambda x: x
+}
+
+
+
+class ScoreError(ValueError):
+    pass
+
+
+
+class Expression(object):
+    '''A checked score expression. `columns` are the Player attributes it
+    reads.'''
+
+    def __init__(self, source):
+        self.source = source
+
+        try:
+            self.tree = ast.parse(source.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise ScoreError("Can't parse score `%s`: %s" % (source, e.msg))
+
+        self.columns = []
+        self._check(self.tree)
+
+    def _check(self, node):
+        if isinstance(node, ast.Num):
+            return
+        elif isinstance(node, ast.Name):
+            if node.id not in self.columns:
+                self.columns.append(node.id)
+        elif isinstance(node, ast.BinOp) and type(node.op) in _operators:
+            self._check(node.left)
+            self._check(node.right)
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _unary:
+            self._check(node.operand)
+        elif isinstance(node, ast.Call) and \
+            isinstance(node.func, ast.Name) and node.func.id in functions \
+            and not node.keywords and not node.starargs \
+            and not node.kwargs:
+            arity = functions[node.func.id][1]
+            if len(node.args) != arity:
+                raise ScoreError("%s() takes %d argument%s in score `%s`, "
+                    "not %d" % (node.func.id, arity, "s" * (arity != 1),
+                    self.source, len(node.args)))
+            for arg in node.args:
+                self._check(arg)
+        else:
+            raise ScoreError("Not allowed in score `%s`: %s" % \
+                (self.source, type(node).__name__))
+
+    def _eval(self, node, cols):
+        if isinstance(node, ast.Num):
+            return float(node.n)
+        elif isinstance(node, ast.Name):
+            return cols[node.id]
+        elif isinstance(node, ast.BinOp):
+            return _operators[type(node.op)](self._eval(node.left, cols),
+                self._eval(node.right, cols))
+        elif isinstance(node, ast.UnaryOp):
+            return _unary[type(node.op)](self._eval(node.operand, cols))
+        else:
+            return functions[node.func.id][0](*[self._eval(arg, cols)
+                for arg in node.args])
+
+    def evaluate(self, players):
+        '''Score of every player in `players`, as an array. Raises
+        ScoreError if any score isn't a finite number.'''
+        cols = dict((name, column(players, name)) for name in self.columns)
+        with np.errstate(all='ignore'):
+            out = np.ones(len(players)) * self._eval(self.tree, cols)
+
+        bad = ~np.isfinite(out)
+        if bad.any():
+            raise ScoreError("Score `%s` isn't a finite number for %d of "
+                "%d players (division by zero, or log or sqrt out of "
+                "range?)" % (self.source, bad.sum(), len(out)))
+
+        return out
+
+    def __repr__(self):
+        return "<Expression %s>" % self.source
+
+
+
+def column(players, name, required=True):
+    '''Attribute `name` of every player as a float array. Unless it isn't
+    `required`, at least one player must have it.'''
+    default = defaults.get(name, 0.)
+    values = [p.get(name) for p in players]
+
+    if required and players and all(v is None for v in values):
+        raise ScoreError("No player has a `%s`" % name)
+
+    return np.array([default if v is None else float(v) for v in values])
+
+
+
+_compiled = {}
+
+def compile_score(source):
+    '''Parse and check `source` once; later calls get the same
+    Expression.'''
+    if source not in _compiled:
+        _compiled[source] = Expression(source)
+    return _compiled[source]
+
+
+
+def evaluate(score, players):
+    '''Scores of `players` as an array, for an expression or a callable.'''
+    if hasattr(score, '__call__'):
+        return np.array([float(score(p)) for p in players])
+    return compile_score(score).evaluate(players)
@@ -0,0 +1,395 @@
+#-*-coding:utf8-*-
+'''
+sensitivity.py
+
+How good or how cheap would a player have to be to make the squad, and how
+much room do the chosen ones have?
+
+---
+The thresholds are those of a full re-solve, without re-solving once per
+player and score. Call one player's starter score x; his sub and captain
+scores are fixed ratios of it, as get_player_stats builds them. The best
+squad with him in is worth
+
+    max over his role r of  ratio_r * x + rest_r(budget - his cost)
+
+where rest_r is the best the other 14 players can add around him in that
+role (starter, sub, or captain starting or on the bench): as in exact.py,
+a max over formations and over who else may be captain of his position's
+subsets of the others combined with the other three positions. The best
+squad without him doesn't depend on x. So the score he needs is where a
+few straight lines cross a constant, and the highest price at which he is
+in is a bisection over rest_r.
+
+The pieces are the tables exact.solve builds: per position, the best value
+at every cost of its subsets (of the squad size, and one smaller for the
+others around a fixed player), and max-plus convolutions of the other
+three positions. Positions are pruned as in exact.py but with one spare
+slot, so the tables stay exact with any one player taken out; only players
+who survive that pruning need tables without them, everyone else shares
+his position's. Subsets are valued with numpy, all at once.
+
+Per player the report has:
+
+ * not chosen:  the lowest score at which he is in the best squad
+                (`needs score`) and in which role, and the highest price at
+                which his current score gets him in (`max cost`)
+ * chosen:      how far his score can fall before the best squad is one
+                without him (`slack`), and the highest price at which he
+                stays in (`max cost`)
+
+Ties count as in. Like exact.py this relies on sub and captain scores
+being proportional to the starter score. League rules (rules.py) are left
+out, and `--risk` solves get no report: their objective isn't a squad
+value.
+
+Usage:
+>>> report = sensitivity.analyze(candidates, player_objs, chosen,
+...     budget=100.)
+>>> sensitivity.print_report(report, fh)
+
+or `--sensitivity FILE` with optimize_roster.py.
+
+---
+Joe Nudell
+'''
+
+from itertools import combinations
+from exact import player_table, positions, squad_counts, formations, \
+    prune, convolve
+import numpy as np
+import metrics
+
+
+# A player's roles in a squad, as keys of exact.player_table rows
+roles = ['starter', 'sub', 'cap_starter', 'cap_sub']
+role_names = ['starter', 'sub', 'captain', 'captain on bench']
+
+
+
+def player_arrays(candidates, n=None):
+    '''Per pid (index pid - 1): position index, cost in tenths of a million,
+    and the score of every role (columns as `roles`), with its ratio to the
+    starter score. `known` is False for pids without candidates.'''
+    table = player_table(candidates)
+    n = max(table) if n is None else n
+
+    known = np.zeros(n, dtype=bool)
+    pos = np.zeros(n, dtype=int)
+    cost = np.zeros(n, dtype=int)
+    values = np.zeros((n, len(roles)))
+
+    for pid, row in table.iteritems():
+        i = pid - 1
+        known[i] = True
+        pos[i] = positions.index(row['position'])
+        cost[i] = row['cost']
+        values[i] = [row[r][0] for r in roles]
+
+    score = values[:, 0]
+    scored = known & (score != 0)
+    ratio = np.ones(values.shape)
+    ratio[scored] = values[scored] / score[scored, None]
+
+    # Players without a score take the ratios of their position
+    for p in range(len(positions)):
+        known_p = scored & (pos == p)
+        if known_p.any():
+            ratio[~scored & (pos == p)] = np.median(ratio[known_p], axis=0)
+
+    return {'known': known, 'position': pos, 'cost': cost, 'score': score,
+        'values': values, 'ratio': ratio}
+
+
+
+def subset_values(values, starters, captain):
+    '''Value of every row of (subsets, size, roles) scores with `starters`
+    of them starting and the captain among them if `captain`, picked as in
+    exact.subset_value.'''
+    count, size = values.shape[:2]
+    if starters > size:
+        return np.full(count, -np.inf)
+
+    gain = values[:, :, 0] - values[:, :, 1]
+    rank = np.argsort(np.argsort(-gain, axis=1, kind='mergesort'), axis=1)
+    start = rank < starters
+
+    base = np.where(start, values[:, :, 0], values[:, :, 1])
+    value = base.sum(1)
+    if captain:
+        value += (np.where(start, values[:, :, 2], values[:, :, 3]) -
+            base).max(1)
+
+    return value
+
+
+
+class Subsets(object):
+    '''All subsets of `size` of the players `rows` within `budget`, ordered
+    by cost.'''
+
+    def __init__(self, rows, size, values, cost, budget):
+        members = np.array(list(combinations(rows, size)),
+            dtype=int).reshape(-1, size)
+        total = cost[members].sum(1)
+        order = np.argsort(total, kind='mergesort')
+        order = order[total[order] <= budget]
+
+        self.members = members[order]
+        self.cost = total[order]
+        self.costs, self.starts = np.unique(self.cost, return_index=True)
+        self.budget = budget
+        self._values = values
+        self._cache = {}
+
+    def table(self, starters, captain, without=None):
+        '''Best value with cost at most c, for every c in [0, budget], of
+        the subsets that don't hold player `without`.'''
+        key = (starters, captain)
+        if key not in self._cache:
+            self._cache[key] = subset_values(self._values[self.members],
+                starters, captain)
+        value = self._cache[key]
+
+        if without is not None:
+            value = np.where((self.members == without).any(1), -np.inf,
+                value)
+
+        best = np.full(self.budget + 1, -np.inf)
+        if len(value):
+            best[self.costs] = np.maximum.reduceat(value, self.starts)
+        return np.maximum.accumulate(best)
+
+
+
+class Tables(object):
+    '''Position tables and convolutions of a pool, for best squad values
+    with one player taken out or fixed in a role.'''
+
+    def __init__(self, arrays, budget):
+        self.a = arrays
+        self.budget = budget
+        pos, values = arrays['position'], arrays['values']
+        cost, known = arrays['cost'], arrays['known']
+
+        self.rows, self.full, self.rest = {}, {}, {}
+        for p, name in enumerate(positions):
+            size = squad_counts[name]
+            rows = prune([{'i': i, 'cost': cost[i],
+                'starter': (values[i, 0],)}
+                for i in np.flatnonzero(known & (pos == p))], size + 1)
+            self.rows[p] = set(r['i'] for r in rows)
+            ids = sorted(self.rows[p])
+            self.full[p] = Subsets(ids, size, values, cost, budget)
+            self.rest[p] = Subsets(ids, size - 1, values, cost, budget)
+
+        self._tables = {}
+        self._others = {}
+        self._stacks = {}
+        self._rest = {}
+
+    def _table(self, p, starters, captain):
+        key = (p, starters, captain)
+        if key not in self._tables:
+            self._tables[key] = self.full[p].table(starters, captain)
+        return self._tables[key]
+
+    def others(self, p, formation, cap_pos):
+        '''Best value at every cost of the three positions other than `p`,
+        with the captain at `cap_pos` (None for no captain among them).'''
+        parts = tuple((q, formation[q], q == cap_pos)
+            for q in range(len(positions)) if q != p)
+
+        for k in range(1, len(parts) + 1):
+            key = parts[:k]
+            if key in self._others:
+                continue
+            table = self._table(*key[-1])
+            if k > 1:
+                table = convolve(self._others[key[:-1]], table)[0]
+            self._others[key] = table
+
+        return self._others[parts]
+
+    def without(self, i=None):
+        '''Value of the best squad without player `i` (any squad if None).'''
+        best = -np.inf
+        ps = range(len(positions)) if i is None else [self.a['position'][i]]
+
+        for p in ps:
+            for f in formations:
+                for cap in range(len(positions)):
+                    own = self.full[p].table(f[p], cap == p, without=i)
+                    other = self.others(p, f, None if cap == p else cap)
+                    best = max(best, _at(own, other[::-1], self.budget))
+
+        return best
+
+    def _pairs(self, p, role):
+        '''(starters, captain) of the position's others and the captain's
+        position among the other positions, per formation, around a player
+        in `role`.'''
+        size = squad_counts[positions[p]]
+        elsewhere = [q for q in range(len(positions)) if q != p]
+        pairs = []
+
+        for f in formations:
+            k = f[p] - (roles[role] in ('starter', 'cap_starter'))
+            if k > size - 1:
+                continue
+            if roles[role].startswith('cap_'):
+                pairs.append((f, k, False, None))
+            else:
+                pairs.append((f, k, True, None))
+                pairs += [(f, k, False, q) for q in elsewhere]
+
+        return pairs
+
+    def _stack(self, i, role):
+        '''Tables of the position's others around player `i` and reversed
+        tables of the other positions, one row per entry of `_pairs`.'''
+        p = self.a['position'][i]
+        own = i if i in self.rows[p] else None
+        key = (p, own, role)
+
+        if key not in self._stacks:
+            if own is not None:
+                # Only one player's stacks are kept at a time
+                for k in [k for k in self._stacks
+                    if k[1] is not None and k[1] != own]:
+                    del self._stacks[k]
+
+            pairs = self._pairs(p, role)
+            if not pairs:
+                self._stacks[key] = None
+            else:
+                self._stacks[key] = (
+                    np.array([self.rest[p].table(k, cap, without=own)
+                        for f, k, cap, q in pairs]),
+                    np.array([self.others(p, f, q)[::-1]
+                        for f, k, cap, q in pairs]))
+
+        return key, self._stacks[key]
+
+    def rest_value(self, i, role, b):
+        '''Best value of the other 14 players around player `i` in `role`,
+        with `b` left to spend on them.'''
+        key, stack = self._stack(i, role)
+        if stack is None or b < 0:
+            return -np.inf
+
+        if key + (b,) not in self._rest:
+            self._rest[key + (b,)] = _at(stack[0], stack[1], b)
+        return self._rest[key + (b,)]
+
+
+
+def _at(table, reversed_other, b):
+    '''Max-plus convolution of two "cost at most" tables at cost `b`; the
+    second is given reversed. Either may have one table per row.'''
+    n = table.shape[-1]
+    return (table[..., :b + 1] + reversed_other[..., n - 1 - b:]).max()
+
+
+
+@metrics.timed('sensitivity')
+def analyze(candidates, players, chosen, budget=100.):
+    '''Sensitivity of every player to the squad made of candidates
+    `chosen`. Returns a list of dicts, one per player in `players`.'''
+    a = player_arrays(candidates, len(players))
+    budget = int(round(budget * 10))
+    tables = Tables(a, budget)
+
+    squad = set(c['pid'] - 1 for c in chosen)
+    best = tables.without()
+    ratio, score, cost = a['ratio'], a['score'], a['cost']
+
+    report = []
+    for i, p in enumerate(players):
+        r = {
+            'player' : p,
+            'chosen' : i in squad,
+            'score' : score[i],
+            'cost' : cost[i] / 10.,
+            'needs_score' : np.nan,
+            'max_cost' : np.nan,
+            'slack' : np.nan,
+            'role' : None
+        }
+        report.append(r)
+
+        if not a['known'][i]:
+            continue
+
+        # Ties count as in
+        target = (tables.without(i) if i in squad else best) - 1e-9
+
+        def rest(c):
+            return np.array([tables.rest_value(i, k, budget - c)
+                for k in range(len(roles))])
+
+        # Lowest score at which some role gets him in
+        room = rest(cost[i])
+        need = np.full(len(roles), np.inf)
+        fits = np.isfinite(room)
+        need[fits] = np.maximum((target - room[fits]) /
+            np.maximum(ratio[i, fits], 1e-12), 0.)
+        if np.isfinite(need).any():
+            k = int(np.argmin(need))
+            r['needs_score'], r['role'] = need[k], role_names[k]
+
+        # Highest price at which his current score gets him in
+        def makes_it(c):
+            return (ratio[i] * score[i] + rest(c)).max() >= target
+
+        if makes_it(0):
+            lo, hi = 0, budget + 1
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if makes_it(mid):
+                    lo = mid
+                else:
+                    hi = mid
+            r['max_cost'] = lo / 10.
+
+        if i in squad:
+            r['slack'] = score[i] - r['needs_score']
+
+    return report
+
+
+
+def print_report(report, fh=None):
+    '''One table: chosen players first, then the others by how far they
+    are from getting in.'''
+    row_format = u"{:<15}{:<15}{:<12}{:<5}{:>7}{:>8}  {:<7}{:>8}{:>9}" \
+        u"  {}"
+
+    def num(x, fmt="%.2f"):
+        return "-" if x is None or np.isnan(x) else fmt % x
+
+    print >>fh, row_format.format("First Name", "Last Name", "Position",
+        "Club", "Cost", "Score", "Chosen", "Needs", "Max cost",
+        "Role / slack")
+    print >>fh, row_format.format(*["---"] * 10)
+
+    gap = lambda r: r['needs_score'] - r['score'] \
+        if not np.isnan(r['needs_score']) else np.inf
+
+    rows = sorted([r for r in report if r['chosen']],
+        key=lambda r: r['slack']) + \
+        sorted([r for r in report if not r['chosen']], key=gap)
+
+    for r in rows:
+        p = r['player']
+        if r['chosen']:
+            last = "slack %s" % num(r['slack'])
+        elif r['role'] is not None:
+            last = "as %s" % r['role']
+        else:
+            last = "can't afford"
+
+        print >>fh, row_format.format(p.first_name, p.last_name,
+            p.position, p.club, "%.1f" % r['cost'], num(r['score']),
+            "X" if r['chosen'] else "", num(r['needs_score']),
+            num(r['max_cost'], "%.1f"), last)
@@ -0,0 +1,192 @@
+#-*-coding:utf8-*-
+'''
+shared.py
+
+The player pool and candidate arrays in shared memory, for worker
+processes to read without copying.
+
+---
+Handing a list of Players or candidate dicts to a multiprocessing worker
+pickles all of it for every task, and every worker ends up with its own
+copy. Instead the owner writes the pool once as columns, one .npy file per
+column in a directory on /dev/shm (a RAM-backed filesystem; elsewhere the
+system temporary directory), and hands workers a `Handle`: the directory
+and column names, a few hundred bytes to pickle.
+
+`attach(handle)` memory maps the columns read-only. Every process maps the
+same pages, so a worker costs neither serialization time nor memory for
+the pool, and a process attaches to a handle only once however many tasks
+it runs.
+
+Columns of a pool (`pool_columns`):
+ * first_name, last_name, club, position     fixed-width unicode
+ * one float column per field in `player_fields`, NaN where a player
+   doesn't have it
+
+and of candidates (`candidate_columns`), in get_player_stats order:
+ * pid (1-based index into the pool), cost, score, captain, sub
+
+The owner removes the files with `handle.unlink()`, or by using the handle
+as a context manager.
+
+Usage, in the owner:
+>>> with shared.share_pool(players, candidates) as handle:
+...     results = pool.map(work, [(handle, task) for task in tasks])
+
+and in a worker:
+>>> cols = shared.attach(handle)
+>>> cols['candidate_score'][cols['candidate_pid'] == 3]
+
+Any dict of arrays can be shared the same way with `share`.
+
+---
+Joe Nudell
+'''
+
+import numpy as np
+import tempfile
+import shutil
+import os
+
+
+player_fields = ['cost', 'total_points', 'average_points', 'form',
+    'event_points', 'minutes', 'ownership', 'chance_of_playing_next_round',
+    'chance_of_playing_this_round']
+
+_text_fields = ['first_name', 'last_name', 'club', 'position']
+
+
+
+def _shm_dir():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+
+class Handle(object):
+    '''Where a set of shared arrays lives. Cheap to pickle.'''
+
+    def __init__(self, directory, names):
+        self.directory = directory
+        self.names = list(names)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.npy')
+
+    def unlink(self):
+        '''Remove the arrays. Processes attached keep their maps.'''
+        shutil.rmtree(self.directory, ignore_errors=True)
+        _attached.pop(self.directory, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
+
+    def __repr__(self):
+        return "<Handle %s %s>" % (self.directory, ", ".join(self.names))
+
+
+
+def share(arrays, directory=None):
+    '''Write a dict of arrays to shared memory. Returns a Handle.'''
+    target = tempfile.mkdtemp(prefix='eplpool-',
+        dir=directory or _shm_dir())
+
+    for name, a in arrays.items():
+        np.save(os.path.join(target, name + '.npy'), np.ascontiguousarray(a))
+
+    return Handle(target, sorted(arrays))
+
+
+
+# Arrays attached in this process, by directory
+_attached = {}
+
+def attach(handle):
+    '''{name: read-only array} for a Handle, mapped once per process.'''
+    if handle.directory not in _attached:
+        _attached[handle.directory] = dict((name,
+            np.load(handle.path(name), mmap_mode='r'))
+            for name in handle.names)
+
+    return _attached[handle.directory]
+
+
+
+def _text(v):
+    if v is None:
+        return u''
+    if isinstance(v, str):
+        return v.decode('utf8', 'replace')
+    return unicode(v)
+
+
+
+def pool_columns(players):
+    '''Columns of a list of Players, as a dict of arrays.'''
+    cols = {}
+
+    for f in _text_fields:
+        cols[f] = np.array([_text(p.get(f)) for p in players],
+            dtype=np.unicode_)
+
+    for f in player_fields:
+        cols[f] = np.array([np.nan if p.get(f) is None else float(p.get(f))
+            for p in players])
+
+    return cols
+
+
+
+def candidate_columns(candidates):
+    '''Columns of candidates as returned by
+    optimize_roster.get_player_stats.'''
+    return {
+        'pid' : np.array([c['pid'] for c in candidates], dtype=np.int32),
+        'cost' : np.array([c['cost'] for c in candidates]),
+        'score' : np.array([c['score'] for c in candidates]),
+        'captain' : np.array([c['captain'] for c in candidates],
+            dtype=bool),
+        'sub' : np.array([c['bench'] == 'sub' for c in candidates],
+            dtype=bool)
+    }
+
+
+
+def share_pool(players, candidates=None, directory=None):
+    '''Share a pool, and optionally its candidates, prefixed `player_` and
+    `candidate_`. Returns a Handle.'''
+    arrays = dict(('player_' + k, v) for k, v in
+        pool_columns(players).items())
+
+    if candidates is not None:
+        arrays.update(('candidate_' + k, v) for k, v in
+            candidate_columns(candidates).items())
+
+    return share(arrays, directory=directory)
+
+
+
+def players(handle):
+    '''Players rebuilt from a shared pool, for code that needs objects.
+    Each one copies its row, so only use it for a few players or once per
+    process.'''
+    from eplstats import Player
+
+    cols = attach(handle)
+    names = [n[len('player_'):] for n in handle.names
+        if n.startswith('player_')]
+    out = []
+
+    for i in range(len(cols['player_club'])):
+        p = Player()
+        for f in names:
+            v = cols['player_' + f][i]
+            if f in _text_fields:
+                setattr(p, f, unicode(v))
+            elif not np.isnan(v):
+                setattr(p, f, float(v))
+        out.append(p)
+
+    return out
@@ -0,0 +1,352 @@
+#-*-coding:utf8-*-
+'''
+simulate.py
+
+Monte Carlo evaluation of rosters: distributions of gameweek points instead
+of a single expected score.
+
+---
+Every player's points for a gameweek are drawn in two steps:
+
+ 1. Whether he plays at all. The chance is his chance_of_playing_next_round
+    (1 if the source doesn't give one) times how regularly he has appeared
+    so far, i.e. his appearances (total_points / average_points) relative
+    to the most regular player in the pool.
+ 2. If he plays, his points. They are negative binomial (a Poisson whose
+    rate is itself gamma distributed) with mean `average_points`, blended
+    with `form` where the source has it. `dispersion` sets the shape of the
+    gamma: smaller means more blanks and more hauls.
+
+A roster's points in a scenario are the sum over its players of points
+times weight, where starters weigh 1, substitutes `bench` (a fraction, or
+one fraction per bench slot in roster order) and the captain `captain`.
+
+All rosters are scored against the same scenarios, so differences between
+them are not down to luck of the draw. Scenarios are drawn in chunks, each
+from a seed derived from `seed` and the chunk number, so results don't
+depend on how many processes the chunks are spread over. Only players on
+some roster are drawn, not the whole pool, each from a stream of his own
+(seeded by the chunk's seed and his index in the pool), so a roster's
+points don't depend on which other rosters it is simulated with, and runs
+with the same seed share their draws. Each chunk is drawn once and scored
+against the rosters `roster_chunk` at a time with a matrix product. Only
+sums and a histogram of points are kept per roster, so memory doesn't grow
+with the number of scenarios; percentiles are read off the histograms, to
+within `resolution` points.
+
+Usage:
+>>> dist = simulate.distributions(players)
+>>> idx, weights = simulate.encode(rosters, players)
+>>> summary = simulate.evaluate(dist, idx, weights, scenarios=20000,
+...     processes=4)
+>>> summary['mean'], summary['std'], summary['percentiles']
+
+From the command line, compare roster files written by optimize_roster.py:
+    $ python simulate.py team1.txt team2.txt -n 20000 --processes 4
+
+---
+Joe Nudell
+'''
+
+from multiprocessing import Pool
+from sys import stderr
+from roster import PoolIndex, read_team_file
+import eplstats
+import metrics
+import scoring
+import shared
+import numpy as np
+import argparse
+import codecs
+
+
+percentiles = [5, 25, 50, 75, 95]
+
+_positions = ['forwards', 'midfielders', 'defenders', 'keepers']
+
+
+
+def distributions(players, score='average_points', form_weight=.5):
+    '''Per-player parameters of the points distribution, as a dict of
+    arrays: `play` (probability of playing) and `mean` (expected points
+    when playing).'''
+    n = len(players)
+    mean = scoring.evaluate(score, players)
+
+    # Blend in form where the source has it
+    form = np.array([np.nan if p.get('form') is None else float(p.form)
+        for p in players])
+    has_form = ~np.isnan(form)
+    mean[has_form] = (1 - form_weight) * mean[has_form] + \
+        form_weight * form[has_form]
+
+    chance = scoring.column(players, 'chance_of_playing_next_round',
+        required=False)
+
+    average = scoring.column(players, 'average_points')
+    apps = np.where(average > 0,
+        scoring.column(players, 'total_points') / np.maximum(average, 1e-9),
+        0.)
+
+    regularity = np.ones(n)
+    if apps.max() > 0:
+        regularity = np.clip(apps / apps.max(), 0., 1.)
+
+    return {
+        'play' : np.clip(chance * regularity, 0., 1.),
+        'mean' : np.clip(mean, 0., None)
+    }
+
+
+
+def sample(dist, scenarios, seed=0, dispersion=2., players=None):
+    '''Points for every player in `scenarios` draws, shape
+    (scenarios, players). With `players`, the pool indices of the rows of
+    `dist`, every player's points come from his own stream, seeded by
+    `seed` and his index, so they don't depend on who else is drawn.'''
+    if players is None:
+        rnd = np.random.RandomState(seed)
+        shape = (scenarios, len(dist['mean']))
+
+        plays = rnd.random_sample(shape) < dist['play']
+        rate = rnd.gamma(dispersion, dist['mean'] / dispersion, size=shape)
+
+        return np.where(plays, rnd.poisson(rate), 0).astype(np.float32)
+
+    points = np.empty((scenarios, len(players)), dtype=np.float32)
+    for k, i in enumerate(players):
+        rnd = np.random.RandomState(list(np.ravel(seed)) + [int(i)])
+        plays = rnd.random_sample(scenarios) < dist['play'][k]
+        rate = rnd.gamma(dispersion, dist['mean'][k] / dispersion,
+            size=scenarios)
+        points[:, k] = np.where(plays, rnd.poisson(rate), 0)
+
+    return points
+
+
+
+def encode(rosters, players, bench=.1, captain=2.):
+    '''Turn rosters (lists of dicts as from roster.read_team_file) into
+    arrays (idx, weights), both shaped (rosters, squad size): index into
+    `players` and weight of each roster slot.'''
+    index = PoolIndex(players)
+
+    size = max(len(r) for r in rosters)
+    idx = np.zeros((len(rosters), size), dtype=int)
+    weights = np.zeros((len(rosters), size))
+
+    for k, roster in enumerate(rosters):
+        subs = 0
+
+        for j, (entry, i) in enumerate(zip(roster, index.indices(roster))):
+            idx[k, j] = i
+
+            if entry['starting'] == 'starter':
+                weights[k, j] = captain if entry['capt.'] else 1.
+            else:
+                weights[k, j] = np.ravel(bench)[min(subs, np.size(bench)-1)]
+                subs += 1
+
+    return idx, weights
+
+
+
+def _simulate_chunk(args):
+    '''Score every roster in one chunk of scenarios. Returns per roster the
+    sum and sum of squares of its points, and a histogram of them.'''
+    data, scenarios, seed, dispersion, roster_chunk, bins, resolution = args
+
+    # Workers get the arrays as a shared.Handle
+    if isinstance(data, shared.Handle):
+        data = shared.attach(data)
+
+    dist = {'play': data['play'], 'mean': data['mean']}
+    idx, weights = data['idx'], data['weights']
+    n = len(dist['mean'])
+
+    points = sample(dist, scenarios, seed=seed, dispersion=dispersion,
+        players=data['players'])
+
+    sums = np.zeros(len(idx))
+    squares = np.zeros(len(idx))
+    hist = np.zeros((len(idx), bins), dtype=int)
+
+    for i in range(0, len(idx), roster_chunk):
+        chunk = slice(i, i + roster_chunk)
+        k = len(idx[chunk])
+
+        # Dense (players, rosters) weight matrix, so scoring is one matmul
+        W = np.zeros((n, k))
+        cols = np.repeat(np.arange(k), idx.shape[1])
+        np.add.at(W, (idx[chunk].ravel(), cols), weights[chunk].ravel())
+
+        # Rounded so that a roster's totals don't depend on the order the
+        # weights were summed in, i.e. on the other rosters of the chunk
+        totals = np.round(points.dot(W), 6)
+        sums[chunk] = totals.sum(0)
+        squares[chunk] = (totals ** 2).sum(0)
+
+        b = np.clip((totals / resolution).astype(int), 0, bins - 1)
+        b += np.arange(k) * bins
+        hist[chunk] = np.bincount(b.ravel(),
+            minlength=k * bins).reshape(k, bins)
+
+    return sums, squares, hist
+
+
+
+def _percentiles(hist, q, resolution):
+    '''Percentiles from per-row histograms, interpolating within bins.'''
+    cum = np.cumsum(hist, axis=1)
+    rows = np.arange(len(hist))
+    out = np.empty((len(hist), len(q)))
+
+    for j, pct in enumerate(q):
+        target = pct / 100. * cum[:, -1]
+        b = np.minimum((cum < target[:, None]).sum(1), hist.shape[1] - 1)
+        below = np.where(b > 0, cum[rows, b - 1], 0)
+        frac = (target - below) / np.maximum(hist[rows, b], 1)
+        out[:, j] = (b + frac) * resolution
+
+    return out
+
+
+
+def evaluate(dist, idx, weights, scenarios=10000, seed=0, dispersion=2.,
+    scenario_chunk=2000, roster_chunk=512, processes=None, q=percentiles,
+    resolution=.25, ceiling=300.):
+    '''Simulate rosters given as (idx, weights) from `encode`. Returns a
+    dict of arrays over rosters: mean, var, std, and percentiles (one
+    column per entry of `q`). Percentiles are read from histograms with
+    bins `resolution` points wide up to `ceiling`.'''
+    bins = int(ceiling / resolution) + 1
+
+    # Only players on some roster are drawn, each from his own stream;
+    # idx is remapped onto them
+    used = np.unique(idx)
+    data = {'play': dist['play'][used], 'mean': dist['mean'][used],
+        'players': used, 'idx': np.searchsorted(used, idx),
+        'weights': weights}
+    parallel = processes and scenarios > scenario_chunk
+
+    # Processes read the arrays from shared memory instead of getting a
+    # pickled copy with every chunk
+    handle = shared.share(data) if parallel else None
+
+    tasks = [(handle or data, min(scenario_chunk, scenarios - start),
+        [seed, c], dispersion, roster_chunk, bins, resolution)
+        for c, start in enumerate(range(0, scenarios, scenario_chunk))]
+
+    with metrics.span('simulate', rosters=len(idx), scenarios=scenarios):
+        if parallel:
+            pool = Pool(processes)
+            try:
+                results = pool.map(_simulate_chunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+                handle.unlink()
+        else:
+            results = map(_simulate_chunk, tasks)
+
+        sums, squares, hist = [sum(r) for r in zip(*results)]
+
+    metrics.count('scenarios_scored', scenarios * len(idx))
+
+    mean = sums / scenarios
+    var = np.maximum(squares / scenarios - mean ** 2, 0.)
+
+    return {
+        'mean' : mean,
+        'var' : var,
+        'std' : np.sqrt(var),
+        'percentiles' : _percentiles(hist, q, resolution),
+        'q' : list(q)
+    }
+
+
+
+def print_summary(summary, labels, fh=None):
+    '''Table of the simulated points of every roster.'''
+    row_format = u"{:<30}{:>9}{:>9}" + u"{:>8}" * len(summary['q'])
+
+    print >>fh, row_format.format("Roster", "Mean", "Std",
+        *["P%d" % q for q in summary['q']])
+
+    for i, label in enumerate(labels):
+        print >>fh, row_format.format(label[-30:],
+            "%.2f" % summary['mean'][i], "%.2f" % summary['std'][i],
+            *["%.1f" % v for v in summary['percentiles'][i]])
+
+
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('rosters', type=str, nargs='+',
+        help="Roster files as written by optimize_roster.py")
+    parser.add_argument('-n', '--scenarios', type=int, default=10000,
+        help="Number of simulated gameweeks")
+    parser.add_argument('--seed', type=int, default=0,
+        help="Random seed for the scenarios")
+    parser.add_argument('--dispersion', type=float, default=2.,
+        help="Gamma shape of points when playing; smaller is more erratic")
+    parser.add_argument('--processes', type=int, default=None,
+        help="Simulate scenario chunks in this many processes")
+    parser.add_argument('-e', '--bench', type=float, default=.1,
+        help="Weight of substitutes' points")
+    parser.add_argument('-c', '--captain', type=float, default=2.,
+        help="Multiplier of the captain's points")
+    parser.add_argument('-y', '--season', type=int, default=2014,
+        help="ESPN endpoint only currently supports 2014 season")
+    parser.add_argument('-u', '--username', type=str, default='',
+        help="Username (for official EPL site)")
+    parser.add_argument('-p', '--password', type=str, default='',
+        help="Password (for official EPL site)")
+    parser.add_argument('-w', '--source', type=str, default='espn',
+        help="Stats source website. ESPN and EPL are supported.")
+    parser.add_argument('-C', '--cache', type=str, default=None,
+        help="Directory to keep downloaded pages in for revalidation")
+    parser.add_argument('--replay', type=str, default=None,
+        help="Replay responses from this fixture archive, offline")
+    parser.add_argument('--base-url', type=str, default=None,
+        help="Send requests to this host instead (see fakeserver.py)")
+    parser.add_argument('--metrics', type=str, default=None,
+        help="Write stage timings and counters to this JSON file")
+
+    cli = parser.parse_args()
+
+    print >>stderr, "Fetching stats from %s ..." % cli.source
+    downloader = eplstats.Downloader(source=cli.source,
+        username=cli.username, password=cli.password, cache_dir=cli.cache,
+        replay=cli.replay, base_url=cli.base_url)
+
+    players = []
+    for position in _positions:
+        players += downloader.get(position, source=cli.source,
+            season=cli.season)
+    print >>stderr, "Done."
+
+    rosters = []
+    for fn in cli.rosters:
+        with codecs.open(fn, 'r', 'utf8') as fh:
+            rosters.append(read_team_file(fh))
+
+    idx, weights = encode(rosters, players, bench=cli.bench,
+        captain=cli.captain)
+
+    print >>stderr, "Simulating %d gameweeks ..." % cli.scenarios
+    summary = evaluate(distributions(players), idx, weights,
+        scenarios=cli.scenarios, seed=cli.seed, dispersion=cli.dispersion,
+        processes=cli.processes)
+
+    print
+    print_summary(summary, cli.rosters)
+    print
+
+    if cli.metrics is not None:
+        metrics.report()
+        metrics.dump(cli.metrics)
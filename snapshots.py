@@ -0,0 +1,212 @@
+#-*-coding:utf8-*-
+'''
+snapshots.py
+
+Append-only store of the player pool as it was at every fetch.
+
+---
+Each fetch is saved as one compressed columnar file,
+
+    <directory>/gw<gameweek>-<fetch time>.npz
+
+holding an `id` column sorted ascending and one column per field in
+`columns` and `text_columns`. Nothing is ever overwritten, so a gameweek
+fetched twice has two files; queries use the latest one.
+
+.npz members are compressed, so they can't be memory mapped directly. The
+first time a snapshot is read its members are unpacked once into
+`<directory>/.columns/<snapshot>/<column>.npy`, and from then on every read
+is a memory map of those files: only the pages a query touches are loaded.
+
+Queries never build Players. `history` lines up the requested players
+across weeks by binary search on the sorted `id` column and fills a
+(players x weeks) array per field, NaN (or '' for text) where a player is
+missing from a week.
+
+Players without an `id` (e.g. from the ESPN source) can't be keyed and
+are left out.
+
+Usage:
+>>> store = snapshots.SnapshotStore('history')
+>>> store.append(players, gameweek=5)
+>>> h = store.history(['event_points', 'cost'], ids=[12, 40], weeks=(1, 5))
+>>> h['event_points'].sum(1)
+
+or `--snapshots DIR --gameweek N` with optimize_roster.py.
+
+---
+Joe Nudell
+'''
+
+from sys import stderr
+import numpy as np
+import metrics
+import zipfile
+import time
+import os
+import re
+
+
+# Numeric fields kept per snapshot, stored as float32 with NaN for missing
+columns = ['cost', 'total_points', 'average_points', 'event_points',
+    'event_cost', 'form', 'minutes', 'ownership', 'selected',
+    'transfers_in_event', 'transfers_out_event',
+    'chance_of_playing_next_round', 'chance_of_playing_this_round']
+
+# Text fields, stored as fixed width unicode
+text_columns = ['news', 'status', 'club', 'position']
+
+_name_re = re.compile(r'^gw(\d+)-(\d+)\.npz$')
+
+
+
+def _text(v):
+    if v is None:
+        return u''
+    if isinstance(v, str):
+        return v.decode('utf8', 'replace')
+    return unicode(v)
+
+
+
+def _number(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+
+class SnapshotStore(object):
+    '''Directory of per-fetch pool snapshots.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._columns = os.path.join(directory, '.columns')
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def snapshots(self):
+        '''{gameweek: file name of its latest snapshot}.'''
+        latest = {}
+
+        for name in os.listdir(self.directory):
+            m = _name_re.match(name)
+            if m is None:
+                continue
+            week, stamp = int(m.group(1)), int(m.group(2))
+            if week not in latest or stamp > latest[week][0]:
+                latest[week] = (stamp, name)
+
+        return dict((w, name) for w, (_, name) in latest.iteritems())
+
+    def gameweeks(self):
+        return sorted(self.snapshots())
+
+    @metrics.timed('snapshot_append')
+    def append(self, players, gameweek):
+        '''Save a snapshot of `players` for `gameweek`. Returns its path.'''
+        keyed = [p for p in players if p.get('id') is not None]
+
+        if len(keyed) < len(players):
+            print >>stderr, "  %d players without an id not snapshotted" \
+                % (len(players) - len(keyed))
+
+        keyed.sort(key=lambda p: int(p.id))
+
+        arrays = {'id': np.array([int(p.id) for p in keyed], dtype=np.int32)}
+
+        for c in columns:
+            arrays[c] = np.array([_number(p.get(c)) for p in keyed],
+                dtype=np.float32)
+
+        for c in text_columns:
+            arrays[c] = np.array([_text(p.get(c)) for p in keyed],
+                dtype=np.unicode_)
+
+        # Never replace an earlier fetch, even within the same second
+        stamp = int(time.time() * 1000)
+        path = os.path.join(self.directory, "gw%02d-%d.npz" % (gameweek,
+            stamp))
+        while os.path.exists(path):
+            stamp += 1
+            path = os.path.join(self.directory, "gw%02d-%d.npz" % (gameweek,
+                stamp))
+
+        # Write under a temporary name so readers never see half a file
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fh:
+            np.savez_compressed(fh, **arrays)
+        os.rename(tmp, path)
+
+        return path
+
+    def _unpack(self, name):
+        '''Directory of the uncompressed .npy members of snapshot `name`.'''
+        target = os.path.join(self._columns, name[:-len('.npz')])
+
+        if not os.path.isdir(target):
+            tmp = target + '.tmp'
+            with zipfile.ZipFile(os.path.join(self.directory, name)) as zf:
+                zf.extractall(tmp)
+            os.rename(tmp, target)
+
+        return target
+
+    def snapshot(self, gameweek, fields=None):
+        '''{column: memory-mapped array} of the latest snapshot of
+        `gameweek`, always including `id`.'''
+        name = self.snapshots()[gameweek]
+        target = self._unpack(name)
+
+        if fields is None:
+            fields = columns + text_columns
+
+        return dict((c, np.load(os.path.join(target, c + '.npy'),
+            mmap_mode='r')) for c in ['id'] + list(fields))
+
+    @metrics.timed('snapshot_history')
+    def history(self, fields, ids=None, weeks=None):
+        '''{field: (len(ids), len(weeks)) array} of `fields` for players
+        `ids` over `weeks`, plus 'ids' and 'weeks'. `weeks` is a list, or a
+        (first, last) pair inclusive, and defaults to every stored week;
+        `ids` defaults to every player seen in them.'''
+        stored = self.snapshots()
+
+        if weeks is None:
+            weeks = sorted(stored)
+        elif isinstance(weeks, tuple):
+            weeks = range(weeks[0], weeks[1] + 1)
+        weeks = [w for w in weeks if w in stored]
+
+        snaps = [self.snapshot(w, fields) for w in weeks]
+
+        if ids is None:
+            ids = np.unique(np.concatenate([s['id'] for s in snaps])) \
+                if snaps else np.zeros(0, dtype=np.int32)
+        ids = np.asarray(ids, dtype=np.int32)
+
+        out = {'ids': ids, 'weeks': np.array(weeks, dtype=int)}
+
+        for f in fields:
+            dtype = snaps[0][f].dtype if snaps else np.float32
+            text = dtype.kind == 'U'
+            # Text columns may be of different widths from week to week
+            if text:
+                dtype = max((s[f].dtype for s in snaps),
+                    key=lambda d: d.itemsize)
+            out[f] = np.full((len(ids), len(weeks)), u'' if text else np.nan,
+                dtype=dtype)
+
+        for j, s in enumerate(snaps):
+            have = s['id']
+            if not len(have):
+                continue
+            rows = np.minimum(np.searchsorted(have, ids), len(have) - 1)
+            found = have[rows] == ids
+
+            for f in fields:
+                out[f][found, j] = s[f][rows[found]]
+
+        return out
@@ -0,0 +1,183 @@
+#-*-coding:utf8-*-
+'''
+synthetic.py
+
+Generate fake player pools, adjustment lists and rosters of any size.
+
+---
+Pools look like the real thing: positions come in the 2:5:5:3 ratio of a
+squad, players are spread evenly over 20 clubs, prices are skewed towards
+the cheap end of each position's range, and points grow with price. Every
+generator takes a seed, so the same arguments always give the same data.
+
+Usage:
+>>> players = synthetic.make_players(600, seed=1)
+>>> adjustments = synthetic.make_adjustments(players, seed=1)
+>>> synthetic.write_roster(open('roster.txt', 'w'),
+...     synthetic.make_roster(players, seed=1))
+
+`SyntheticDownloader` stands in for eplstats.Downloader wherever a pool is
+fetched, e.g. optimize_roster.get_player_stats(downloader=...).
+
+---
+Joe Nudell
+'''
+
+from eplstats import Player
+from roster import roster_line_format
+import random
+
+
+clubs = ['ARS', 'AVL', 'CAR', 'CHE', 'CRY', 'EVE', 'FUL', 'HUL', 'LIV',
+    'MCI', 'MUN', 'NEW', 'NOR', 'SOU', 'STK', 'SUN', 'SWA', 'TOT', 'WBA',
+    'WHU']
+
+positions = ['keepers', 'defenders', 'midfielders', 'forwards']
+
+# Squad slots per position, and (min cost, max cost) in millions
+squad_counts = {'keepers': 2, 'defenders': 5, 'midfielders': 5,
+    'forwards': 3}
+price_ranges = {'keepers': (4.0, 6.5), 'defenders': (4.0, 8.5),
+    'midfielders': (4.5, 13.5), 'forwards': (4.5, 13.5)}
+
+# Share of players with an injury flag, and the chances they are given
+injury_rate = .12
+injury_chances = [0, 0, 25, 50, 75]
+
+
+
+def make_players(n=600, seed=0, gameweeks=38):
+    '''List of `n` Players with both ESPN and PL style fields filled in.'''
+    rnd = random.Random(seed)
+    players = []
+
+    for position in positions:
+        share = squad_counts[position] / 15.
+        lo, hi = price_ranges[position]
+
+        for i in range(int(round(n * share))):
+            p = Player()
+            uid = len(players)
+
+            p.id = uid + 1
+            p.first_name = "First%d" % uid
+            p.last_name = "Last%d" % uid
+            p.position = position
+            p.club = clubs[uid % len(clubs)]
+
+            # Cheap players are much more common than expensive ones
+            p.cost = round(2 * (lo + (hi - lo) * rnd.betavariate(1.2, 4.)))
+            p.cost /= 2.
+            p.average_points = round(max(0.,
+                rnd.gauss(.9 * (p.cost - lo) + 1.5, 1.2)), 1)
+            p.minutes = int(rnd.uniform(.2, 1.) * 90 * gameweeks)
+            p.total_points = int(p.average_points * p.minutes / 90.)
+            p.form = round(max(0., rnd.gauss(p.average_points, 1.5)), 1)
+            p.event_points = max(0, int(rnd.gauss(p.average_points, 2.)))
+            p.ownership = round(min(1., .001 + rnd.betavariate(.4, 6.)
+                * (1 + p.average_points / 3.)), 3)
+            p.opponent = rnd.choice([c for c in clubs if c != p.club])
+            p.place = rnd.choice('HA')
+
+            if rnd.random() < injury_rate:
+                chance = rnd.choice(injury_chances)
+                p.chance_of_playing_next_round = chance / 100.
+                p.news = "Knock - %d%% chance of playing" % chance
+            else:
+                p.chance_of_playing_next_round = 1.
+                p.news = ''
+
+            players.append(p)
+
+    return players
+
+
+
+def make_adjustments(players, seed=0, rate=injury_rate):
+    '''Adjustments list (as from roster.get_injured_list) for a random
+    subset of `players`.'''
+    rnd = random.Random(seed)
+
+    return [{
+        'first_name' : p.first_name,
+        'last_name' : p.last_name,
+        'club' : p.club,
+        'factor' : p.get('chance_of_playing_next_round', 1.) \
+            if p.get('chance_of_playing_next_round', 1.) < 1. \
+            else rnd.choice(injury_chances) / 100.,
+        'news' : p.get('news') or "Knock"
+    } for p in players if rnd.random() < rate]
+
+
+
+def write_adjustments(fh, adjustments):
+    '''Write adjustments in the fixed-width format read by
+    roster.get_injured_list.'''
+    row_format = u"{:<20}{:<20}{:<10}{:<20}{:<60}"
+    print >>fh, row_format.format(
+        "First Name", "Last Name", "Club", "Adjustment", "Notes")
+
+    for adj in adjustments:
+        print >>fh, row_format.format(adj['first_name'], adj['last_name'],
+            adj['club'], adj['factor'], adj['news'])
+
+
+
+def make_roster(players, seed=0):
+    '''Pick a random legal squad of 15 from `players`: 2 keepers,
+    5 defenders, 5 midfielders and 3 forwards, with 11 starters in a 4-4-2
+    and one captain. Returns a list of roster dicts in the shape
+    roster.read_team_file returns.'''
+    rnd = random.Random(seed)
+    starters = {'keepers': 1, 'defenders': 4, 'midfielders': 4,
+        'forwards': 2}
+    roster = []
+
+    for position in positions:
+        pool = [p for p in players if p.position == position]
+        for i, p in enumerate(rnd.sample(pool, squad_counts[position])):
+            roster.append({
+                'first_name' : p.first_name,
+                'last_name' : p.last_name,
+                'position' : position[:-1],
+                'starting' : 'starter' if i < starters[position] else 'sub',
+                'capt.' : False,
+                'club' : p.club,
+                'salary' : p.cost
+            })
+
+    rnd.choice([r for r in roster if r['starting'] == 'starter'])['capt.'] \
+        = True
+
+    return roster
+
+
+
+def write_roster(fh, roster):
+    '''Write a roster in the fixed-width format of
+    optimize_roster.print_results.'''
+    print >>fh, roster_line_format.format('First Name',
+        'Last Name', 'Position', 'Starting', 'Capt.', 'Club', 'Salary')
+    print >>fh, roster_line_format.format(*["---"]*7)
+
+    for r in roster:
+        print >>fh, roster_line_format.format(r['first_name'],
+            r['last_name'], r['position'], r['starting'],
+            "X" if r['capt.'] else "", r['club'], r['salary'])
+
+
+
+
+class SyntheticDownloader(object):
+    '''Quacks like eplstats.Downloader, serving a generated pool.'''
+
+    def __init__(self, players=None, n=600, seed=0):
+        self.players = players if players is not None \
+            else make_players(n, seed)
+        self.fetch_log = []
+
+    def get(self, position, source=None, season=None, adjustments=None):
+        return [p for p in self.players if p.position == position]
+
+    def print_fetch_report(self, fh=None):
+        pass
@@ -4,80 +4,29 @@ teamdiff.py
 
 Determine the uniqueness of a team given a control team.
 
+---
+Team files can be text or JSON rosters from optimize_roster.py. JSON ones
+carry player ids, so they are joined to the pool without name matching.
+
 ---
 Joe Nudell, 2013
 '''
 
 # local
 import eplstats
-import optimize_roster as optr
+import roster as rst
+import metrics
+from roster import read_team_file
 # 3rd party
 import numpy as np
 # stdlib
 import os
-import re
 import codecs
 import argparse
 from sys import stderr, exit
 
 
 
-def _get_line_slices(formatstr):
-    '''Get the fixed-width line break points from a format string'''
-    ms = re.findall(r'\{.+?(\d+?)\}', formatstr)
-
-    return [int(b) for b in ms]
-
-
-def _slice_line(line, points):
-    '''Slice a line into the pieces as specified by break points in `points`'''
-    slices = []
-
-    i = 0
-    for point in points:
-        slices.append(line[i:i+point].strip())
-        i += point
-
-    return slices
-
-
-def read_team_file(fh):
-    '''Read the team roster from the given file object. Should be in the
-    format that is outputted by optimize_roster.'''
-    keys = []
-    roster = []
-    slice_points = _get_line_slices(optr.roster_line_format)
-
-    for i, line in enumerate(fh.readlines()):
-        if i == 0 :
-            # Header row: read as keys
-            keys = _slice_line(line, slice_points)
-
-            # Make header names easier to work with
-            keys = [re.sub(r'\s+', '_', k.lower()) for k in keys]
-            continue
-
-        elif i == 1:
-            # These are just delimeters
-            continue
-
-        else:
-            # Interpret content line
-            slices = _slice_line(line, slice_points)
-
-            # Adjust types
-            slices[-1] = float(slices[-1])
-            slices[-3] = len(slices[-3])>0
-
-            # Make dict using keys from header
-            new_player = dict(zip(keys, slices))
-
-            roster.append(new_player)
-
-    return roster
-
-
-
 def team_similarity(roster1, roster2, players, freqfield='ownership'):
     '''Compare the rosters of two teams using statistics provided in the list
     `players`. Comparison is cosine similarity of TF-IDF vectors created from
@@ -85,27 +34,19 @@ def team_similarity(roster1, roster2, players, freqfield='ownership'):
     teams are identical. A value of 0 means that teams share no players in
     common.'''
 
+    index = rst.PoolIndex(players)
     v1 = np.zeros(len(players))
     v2 = np.zeros(len(players))
 
-    for i, player in enumerate(players):
-        # Calculate inverse frequency of player selection for all players
-        # selected in both teams. Same idea as TF-IDF in document similarity.
-        in_team_one = optr.player_in_roster(player, roster1) is not None
-        in_team_two = optr.player_in_roster(player, roster2) is not None
-
-        if not in_team_one and not in_team_two:
-            continue
-
-        freq = float(getattr(player, freqfield))
-
-        ipf = np.log(1./freq)
-
-        if in_team_one:
-            v1[i] = ipf
+    for v, roster in [(v1, roster1), (v2, roster2)]:
+        for entry in roster:
+            i = index.find(entry)
+            if i is None:
+                continue
 
-        if in_team_two:
-            v2[i] = ipf
+            # Inverse frequency of player selection. Same idea as TF-IDF
+            # in document similarity.
+            v[i] = np.log(1. / float(getattr(players[i], freqfield)))
 
     # TODO - verify that there are 15 elements in both teams?
 
@@ -118,12 +59,14 @@ def team_similarity(roster1, roster2, players, freqfield='ownership'):
 
 
 
-def get_player_stats(source, username=None, password=None):
+def get_player_stats(source, username=None, password=None, cache_dir=None,
+    record=None, replay=None, base_url=None):
     '''Execute downloading of all player stats from provided source.'''
     positions = ['forwards', 'midfielders', 'defenders', 'keepers']
 
     downloader = eplstats.Downloader(source=source,
-        username=username, password=password)
+        username=username, password=password, cache_dir=cache_dir,
+        record=record, replay=replay, base_url=base_url)
 
     all_players = []
 
@@ -134,6 +77,8 @@ def get_player_stats(source, username=None, password=None):
 
         all_players += _partial_players
 
+    downloader.print_fetch_report()
+
     return all_players
 
 
@@ -141,13 +86,11 @@ def get_player_stats(source, username=None, password=None):
 
 def score_team(roster, players, field="total_points"):
     '''Calculate fantasy score of team'''
+    index = rst.PoolIndex(players)
     score = 0.
 
-    for i, player in enumerate(players):
-        in_team = optr.player_in_roster(player, roster) is not None
-
-        if in_team:
-            score += getattr(player, field)
+    for i in set(index.find(entry) for entry in roster) - set([None]):
+        score += getattr(players[i], field)
 
     return score
 
@@ -186,6 +129,16 @@ if __name__=='__main__':
         help="Stats source website. ESPN and EPL are supported.")
     parser.add_argument('-s', '--score', type=str, default=score,
         help="Attribute to calculate expected team score from")
+    parser.add_argument('-C', '--cache', type=str, default=None,
+        help="Directory to keep downloaded pages in for revalidation")
+    parser.add_argument('--record', type=str, default=None,
+        help="Record responses to this fixture archive")
+    parser.add_argument('--replay', type=str, default=None,
+        help="Replay responses from this fixture archive, offline")
+    parser.add_argument('--base-url', type=str, default=None,
+        help="Send requests to this host instead (see fakeserver.py)")
+    parser.add_argument('--metrics', type=str, default=None,
+        help="Write stage timings and counters to this JSON file")
 
     cli = parser.parse_args()
 
@@ -201,7 +154,8 @@ if __name__=='__main__':
     # Run stats downloader
     print >>stderr, "Fetching stats from %s ..." % cli.source
     players = get_player_stats(cli.source,
-        username=cli.username, password=cli.password)
+        username=cli.username, password=cli.password, cache_dir=cli.cache,
+        record=cli.record, replay=cli.replay, base_url=cli.base_url)
     print >>stderr, "Done."
 
     # Get team rosters
@@ -217,13 +171,15 @@ if __name__=='__main__':
 
     # Calculate similarity
     print >>stderr, "Calculating similarity ...",
-    similarity = team_similarity(roster1, roster2, players)
+    with metrics.span('team_similarity'):
+        similarity = team_similarity(roster1, roster2, players)
     print >>stderr, "done."
 
     # Calculate fantasy score expected by teams
     print >>stderr, "Calculating expected scores ...",
-    score1 = score_team(roster1, players, field=cli.score)
-    score2 = score_team(roster2, players, field=cli.score)
+    with metrics.span('score_team'):
+        score1 = score_team(roster1, players, field=cli.score)
+        score2 = score_team(roster2, players, field=cli.score)
     print >>stderr, "done."
 
 
@@ -235,9 +191,8 @@ if __name__=='__main__':
     print "Expected season fantasy scores:"
     print " Team 1", "\t", score1
     print " Team 2", "\t", score2
-    print 
-
-
-
-
+    print
 
+    if cli.metrics is not None:
+        metrics.report()
+        metrics.dump(cli.metrics)
@@ -0,0 +1,97 @@
+#-*-coding:utf8-*-
+'''
+Best transfers against a brute force over every swap.
+'''
+
+from itertools import combinations
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import transfers
+
+
+class Player(object):
+    def __init__(self, position, cost):
+        self.position = position
+        self.cost = cost
+        self.first_name = self.last_name = self.club = ''
+
+
+def squad(pool, counts, cost):
+    for pos, n in counts:
+        pool += [Player(pos, cost) for _ in range(n)]
+
+
+def brute_force(players, current, scores, bank, bench=.1, captain=2.):
+    '''Best value with exactly two transfers, by trying them all.'''
+    cost = np.array([p.cost for p in players])
+    position = [p.position for p in players]
+    others = [i for i in range(len(players)) if i not in current]
+    best = None
+
+    for sold in combinations(current, 2):
+        limit = bank + cost[list(sold)].sum()
+        for bought in combinations(others, 2):
+            if sorted(position[i] for i in sold) != \
+                sorted(position[i] for i in bought):
+                continue
+            if cost[list(bought)].sum() > limit + 1e-9:
+                continue
+            new = [i for i in current if i not in sold] + list(bought)
+            value = transfers.squad_value(scores[new],
+                [position[i] for i in new], bench=bench, captain=captain)
+            best = value if best is None else max(best, value)
+
+    return best
+
+
+class BestTransfersTest(unittest.TestCase):
+
+    def test_captain_beats_sum_of_scores(self):
+        # Two 6s add more points than a 10 and a 1, but the 10 as captain
+        # is worth more
+        players = []
+        squad(players, [('keepers', 2), ('defenders', 5),
+            ('midfielders', 5), ('forwards', 3)], 5.)
+        current = range(len(players))
+        scores = [2.] * len(players)
+
+        for score, cost in [(10., 9.), (1., 1.)] + [(6., 5.)] * 6:
+            players.append(Player('midfielders', cost))
+            scores.append(score)
+        scores = np.array(scores)
+
+        results = transfers.best_transfers(players, current, scores, k=2)
+        expected = brute_force(players, current, scores, 0.)
+
+        self.assertAlmostEqual(expected, 40.7)
+        self.assertAlmostEqual(results[2][0], expected)
+
+    def test_random_pools(self):
+        rnd = np.random.RandomState(0)
+        counts = [('keepers', 2), ('defenders', 5), ('midfielders', 5),
+            ('forwards', 3)]
+
+        for _ in range(20):
+            players = []
+            squad(players, counts, 5.)
+            current = range(len(players))
+            for pos, _ in counts:
+                players += [Player(pos, c) for c in rnd.randint(8, 21, 6) / 2.]
+
+            scores = rnd.gamma(2., 2., len(players))
+            bank = rnd.randint(0, 6) / 2.
+
+            results = transfers.best_transfers(players, current, scores,
+                bank=bank, k=2)
+            self.assertAlmostEqual(results[2][0],
+                brute_force(players, current, scores, bank))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,320 @@
+#-*-coding:utf8-*-
+'''
+transfers.py
+
+Best one or two transfers from an existing squad.
+
+---
+Most weeks the question isn't "what is the best squad" but "which one or two
+players should I swap, with the money I have". A full re-solve ignores the
+current squad; this searches swaps directly.
+
+For every position the players not in the squad are indexed by cost, with
+a running best (and second best) score, so "the best player of this
+position costing at most c" is one binary search. Then:
+
+ * k = 1: for each player sold, the best affordable replacement of his
+   position.
+ * k = 2: for each pair sold, every possible first buy at once (vectorized),
+   each with the best second buy the money left allows.
+
+A squad's value (best formation, captain, and `bench` times the
+substitutes) never drops when a player's score goes up, so the best buy
+for given money is always the best-scoring affordable one. The sum of the
+two scores bought doesn't order pairs by squad value, though, since one of
+them may become captain. So pairs are checked with the real squad value in
+order of an upper bound on it: the squad with the two sold players scoring
+nothing, plus the better of the two bought as captain and the other as a
+starter. The search stops once the bound can't beat the best swap found.
+
+Usage:
+    $ python transfers.py myteam.txt --bank 1.5 -k 2
+
+---
+Joe Nudell
+'''
+
+from itertools import combinations
+from sys import stderr
+from roster import read_team_file, get_injured_list, get_adjustment
+import simulate
+import scoring
+import eplstats
+import metrics
+import numpy as np
+import argparse
+import codecs
+
+
+_positions = ['forwards', 'midfielders', 'defenders', 'keepers']
+
+# Starters per position as (defenders, midfielders, forwards)
+formations = [(d, m, 10-d-m) for d in range(3, 6) for m in range(3, 6)
+    if 1 <= 10-d-m <= 3]
+
+
+class CostIndex(object):
+    '''Players of one position sorted by cost, with the best and second
+    best score among everyone costing at most as much.'''
+
+    def __init__(self, ids, cost, score):
+        order = np.argsort(cost, kind='mergesort')
+        self.ids = np.asarray(ids)[order]
+        self.cost = np.asarray(cost)[order]
+        self.score = np.asarray(score)[order]
+
+        n = len(order)
+        self.best = np.zeros(n, dtype=int)
+        self.second = np.zeros(n, dtype=int)
+        best = second = -1
+
+        for i in range(n):
+            if best < 0 or self.score[i] > self.score[best]:
+                best, second = i, best
+            elif second < 0 or self.score[i] > self.score[second]:
+                second = i
+            self.best[i] = best
+            self.second[i] = second
+
+    def affordable(self, limit):
+        '''Position in the index of the last player costing <= `limit`,
+        -1 if none (vectorized over `limit`).'''
+        return np.searchsorted(self.cost, np.asarray(limit) + 1e-9,
+            side='right') - 1
+
+
+
+def squad_value(score, positions, bench=.1, captain=2.):
+    '''Points of a squad given each member's score and position: best
+    formation, best captain, `bench` of the substitutes.'''
+    by_pos = {}
+    for s, pos in zip(score, positions):
+        by_pos.setdefault(pos, []).append(s)
+    for pos in by_pos:
+        by_pos[pos].sort(reverse=True)
+
+    total = float(sum(score))
+    best = None
+
+    for lineup in formations:
+        starters = by_pos['keepers'][:1]
+        for pos, k in zip(['defenders', 'midfielders', 'forwards'], lineup):
+            starters = starters + by_pos[pos][:k]
+
+        value = (1. - bench) * sum(starters) + bench * total \
+            + (captain - 1.) * max(starters)
+        if best is None or value > best:
+            best = value
+
+    return best
+
+
+
+def _best_pairs(first, second, limit, same):
+    '''Arrays (i, j, score of i, score of j): for every i from `first`,
+    the best j from `second` the money left of `limit` allows.'''
+    j = second.affordable(limit - first.cost)
+    ok = j >= 0
+    i = np.flatnonzero(ok)
+    j = j[ok]
+
+    pick = second.best[j]
+    if same:
+        # Can't buy the same player twice; his runner-up will do
+        clash = second.ids[pick] == first.ids[i]
+        pick = np.where(clash, second.second[j], pick)
+        keep = pick >= 0
+        i, pick = i[keep], pick[keep]
+
+    return first.ids[i], second.ids[pick], first.score[i], \
+        second.score[pick]
+
+
+
+def _gain_bound(a, b, bench=.1, captain=2.):
+    '''Most that scores `a` and `b` can add to a squad where their places
+    score nothing: one as captain, the other as a starter (or `bench` of
+    a negative score).'''
+    def part(s, weight):
+        return np.where(s >= 0, weight * s, bench * s)
+    return np.maximum(part(a, captain) + part(b, 1.),
+        part(a, 1.) + part(b, captain))
+
+
+
+@metrics.timed('best_transfers')
+def best_transfers(players, current, scores, bank=0., k=2, bench=.1,
+    captain=2.):
+    '''Best squad reachable with exactly 1..k transfers. `current` are
+    indices into `players` of the squad and `scores` the score of every
+    player. Returns [(value, sold, bought, bank left)] for 0..k transfers,
+    with sold and bought as lists of indices.'''
+    cost = np.array([p.cost for p in players])
+    position = [p.position for p in players]
+    owned = set(current)
+
+    index = {}
+    for pos in _positions:
+        ids = [i for i, p in enumerate(position)
+            if p == pos and i not in owned]
+        index[pos] = CostIndex(ids, cost[ids], scores[ids])
+
+    def value_of(squad):
+        return squad_value(scores[squad], [position[i] for i in squad],
+            bench=bench, captain=captain)
+
+    results = [(value_of(list(current)), [], [], bank)]
+
+    for n in range(1, k + 1):
+        best = None
+
+        for sold in combinations(current, n):
+            limit = bank + cost[list(sold)].sum()
+            swaps = []
+
+            if n == 1:
+                ix = index[position[sold[0]]]
+                last = ix.affordable(limit)
+                if last >= 0:
+                    swaps = [[ix.ids[ix.best[last]]]]
+            elif n == 2:
+                a, b = [index[position[s]] for s in sold]
+                i, j, si, sj = _best_pairs(a, b, limit,
+                    position[sold[0]] == position[sold[1]])
+
+                # The sold pair's places scoring nothing
+                zeroed = scores.copy()
+                zeroed[list(sold)] = 0.
+                base = squad_value(zeroed[list(current)],
+                    [position[s] for s in current], bench=bench,
+                    captain=captain)
+                bound = base + _gain_bound(si, sj, bench, captain)
+
+                for o in np.argsort(-bound, kind='mergesort'):
+                    if best is not None and bound[o] <= best[0] + 1e-9:
+                        break
+                    bought = [i[o], j[o]]
+                    squad = [s for s in current if s not in sold] + bought
+                    value = value_of(squad)
+                    if best is None or value > best[0]:
+                        best = (value, list(sold), bought,
+                            limit - cost[bought].sum())
+            else:
+                raise ValueError("Only up to 2 transfers are supported")
+
+            for bought in swaps:
+                squad = [i for i in current if i not in sold] + bought
+                value = value_of(squad)
+                if best is None or value > best[0]:
+                    best = (value, list(sold), bought,
+                        limit - cost[bought].sum())
+
+        if best is not None:
+            results.append(best)
+
+    return results
+
+
+
+def player_scores(players, score='average_points', adjustments=None,
+    threshold=1.):
+    '''Score of every player, with any adjustments from the file applied.'''
+    scores = scoring.evaluate(score, players)
+
+    if adjustments is not None:
+        adj = get_injured_list(adjustments)
+        scores *= [get_adjustment(p, adj, threshold=threshold, silent=True)
+            for p in players]
+
+    return scores
+
+
+
+def print_transfers(results, players, hit=4., free=1, fh=None):
+    '''One block per number of transfers, best first.'''
+    base = results[0][0]
+    name = lambda i: "%s %s (%s)" % (players[i].first_name,
+        players[i].last_name, players[i].club)
+
+    for n, (value, sold, bought, left) in enumerate(results):
+        hits = max(0, n - free) * hit
+        print >>fh, "%d transfer(s): %.2f points (%+.2f after %g hit " \
+            "points), bank %.1f" % (n, value, value - base - hits, hits, left)
+        for out, new in zip(sold, bought):
+            print >>fh, "    out: %-35s in: %s" % (name(out), name(new))
+
+
+
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('roster', type=str,
+        help="Current squad, as written by optimize_roster.py")
+    parser.add_argument('-k', '--transfers', type=int, default=2,
+        help="Most transfers to consider (1 or 2)")
+    parser.add_argument('--bank', type=float, default=0.,
+        help="Money in the bank, in millions")
+    parser.add_argument('-f', '--free-transfers', type=int, default=1,
+        help="Free transfers available")
+    parser.add_argument('--hit', type=float, default=4.,
+        help="Points deducted per extra transfer")
+    parser.add_argument('-s', '--score', type=str, default='average_points',
+        help="Player stat, or arithmetic over stats, to value players by")
+    parser.add_argument('-a', '--adjustments', type=str, default=None,
+        help="List of adjustments to player worth (file name)")
+    parser.add_argument('-r', '--threshold', type=float, default=1.,
+        help="Threshold for devaluing injured players at all")
+    parser.add_argument('-e', '--bench', type=float, default=.1,
+        help="Fraction of score to reduce substitutes by, default is 1/10")
+    parser.add_argument('-c', '--captain', type=float, default=2.,
+        help="Bonus for being captain")
+    parser.add_argument('-y', '--season', type=int, default=2014,
+        help="ESPN endpoint only currently supports 2014 season")
+    parser.add_argument('-u', '--username', type=str, default='',
+        help="Username (for official EPL site)")
+    parser.add_argument('-p', '--password', type=str, default='',
+        help="Password (for official EPL site)")
+    parser.add_argument('-w', '--source', type=str, default='espn',
+        help="Stats source website. ESPN and EPL are supported.")
+    parser.add_argument('-C', '--cache', type=str, default=None,
+        help="Directory to keep downloaded pages in for revalidation")
+    parser.add_argument('--replay', type=str, default=None,
+        help="Replay responses from this fixture archive, offline")
+    parser.add_argument('--base-url', type=str, default=None,
+        help="Send requests to this host instead (see fakeserver.py)")
+    parser.add_argument('--metrics', type=str, default=None,
+        help="Write stage timings and counters to this JSON file")
+
+    cli = parser.parse_args()
+
+    print >>stderr, "Fetching stats from %s ..." % cli.source
+    downloader = eplstats.Downloader(source=cli.source,
+        username=cli.username, password=cli.password, cache_dir=cli.cache,
+        replay=cli.replay, base_url=cli.base_url)
+
+    players = []
+    for position in _positions:
+        players += downloader.get(position, source=cli.source,
+            season=cli.season)
+    print >>stderr, "Done."
+
+    with codecs.open(cli.roster, 'r', 'utf8') as fh:
+        team = read_team_file(fh)
+    current = list(simulate.encode([team], players)[0][0])
+
+    scores = player_scores(players, score=cli.score,
+        adjustments=cli.adjustments, threshold=cli.threshold)
+
+    results = best_transfers(players, current, scores, bank=cli.bank,
+        k=cli.transfers, bench=cli.bench, captain=cli.captain)
+
+    print
+    print_transfers(results, players, hit=cli.hit, free=cli.free_transfers)
+    print
+
+    if cli.metrics is not None:
+        metrics.report()
+        metrics.dump(cli.metrics)
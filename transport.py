@@ -0,0 +1,326 @@
+#-*-coding:utf8-*-
+'''
+transport.py
+
+HTTP plumbing for eplstats.Downloader.
+
+---
+The stock urllib2 handlers open a fresh connection for every request, never
+ask for compressed content and always download a page in full. The handlers
+in this module plug into a normal urllib2 opener and fix all three:
+
+ * KeepAliveHTTPHandler / KeepAliveHTTPSHandler
+        Keep one persistent connection per host and reuse it between
+        requests. A GET or HEAD that fails on a stale pooled connection is
+        retried once on a fresh one; other methods, like a login POST, are
+        never sent twice.
+
+ * GzipProcessor
+        Sends `Accept-Encoding: gzip` and transparently inflates responses.
+
+ * ConditionalProcessor
+        Remembers the last response for every GET in a ResponseStore and
+        revalidates it with `If-None-Match` / `If-Modified-Since`. A 304 from
+        the server is turned back into the stored response, flagged with
+        `not_modified = True` so callers can skip re-parsing. Responses
+        without an ETag or Last-Modified are stored too, so what was parsed
+        from them is still known next time, but they are always downloaded
+        in full.
+
+Responses passing through the keep-alive handlers carry a `wire_bytes`
+attribute (bytes actually received from the network, before inflation).
+
+---
+Usage:
+>>> store = transport.ResponseStore('.eplcache')
+>>> opener = urllib2.build_opener(*transport.handlers(store))
+'''
+
+import urllib
+import urllib2
+import httplib
+import socket
+import zlib
+import hashlib
+import pickle
+import os
+from StringIO import StringIO
+
+
+
+
+def _wrap(body, headers, url, code, msg):
+    '''Build a urllib2-style response object around a string body.'''
+    resp = urllib.addinfourl(StringIO(body), headers, url, code)
+    resp.msg = msg
+    return resp
+
+
+def _copy_attrs(old, new, names=('wire_bytes', 'not_modified')):
+    for name in names:
+        if hasattr(old, name):
+            setattr(new, name, getattr(old, name))
+    return new
+
+
+
+
+class _KeepAliveMixin(object):
+    '''Shared do_open for the keep-alive handlers. Connections are pooled by
+    (connection class, host) and reused until the server asks to close.'''
+
+    def __init__(self, *args, **kwargs):
+        self._pool = dict()
+
+    def close_all(self):
+        for conn in self._pool.values():
+            conn.close()
+        self._pool.clear()
+
+    def do_open(self, http_class, req, **http_conn_args):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        if req._tunnel_host:
+            # Proxy tunnels are rare enough to leave to the stock handler
+            return urllib2.AbstractHTTPHandler.do_open(self, http_class,
+                req, **http_conn_args)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                        if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        key = (http_class, host)
+
+        for attempt in range(2):
+            conn = self._pool.pop(key, None)
+            reused = conn is not None
+
+            if conn is None:
+                conn = http_class(host, timeout=req.timeout,
+                    **http_conn_args)
+
+            try:
+                conn.request(req.get_method(), req.get_selector(),
+                    req.data, headers)
+                r = conn.getresponse(buffering=True)
+                body = r.read()
+
+            except (socket.error, httplib.HTTPException) as err:
+                conn.close()
+                if reused and req.get_method() in ('GET', 'HEAD'):
+                    # Server dropped the idle connection. Try a new one,
+                    # unless the request may have had an effect already.
+                    continue
+                raise urllib2.URLError(err)
+
+            break
+
+        if r.will_close:
+            conn.close()
+        else:
+            self._pool[key] = conn
+
+        resp = _wrap(body, r.msg, req.get_full_url(), r.status, r.reason)
+        resp.wire_bytes = len(body)
+
+        return resp
+
+
+
+class KeepAliveHTTPHandler(_KeepAliveMixin, urllib2.HTTPHandler):
+
+    def __init__(self, debuglevel=0):
+        _KeepAliveMixin.__init__(self)
+        urllib2.HTTPHandler.__init__(self, debuglevel=debuglevel)
+
+    def http_open(self, req):
+        return self.do_open(httplib.HTTPConnection, req)
+
+
+
+class KeepAliveHTTPSHandler(_KeepAliveMixin, urllib2.HTTPSHandler):
+
+    def __init__(self, debuglevel=0):
+        _KeepAliveMixin.__init__(self)
+        urllib2.HTTPSHandler.__init__(self, debuglevel=debuglevel)
+
+    def https_open(self, req):
+        return self.do_open(httplib.HTTPSConnection, req)
+
+
+
+
+class GzipProcessor(urllib2.BaseHandler):
+    '''Ask for gzip and inflate it on the way back.'''
+    # Run before the conditional processor so it stores plain bodies
+    handler_order = 400
+
+    def http_request(self, req):
+        req.add_unredirected_header('Accept-Encoding', 'gzip')
+        return req
+
+    def http_response(self, req, resp):
+        encoding = resp.info().get('Content-Encoding', '')
+
+        if encoding.lower() not in ('gzip', 'x-gzip'):
+            return resp
+
+        body = zlib.decompress(resp.read(), 16 + zlib.MAX_WBITS)
+
+        headers = resp.info()
+        del headers['Content-Encoding']
+        del headers['Content-Length']
+
+        new_resp = _wrap(body, headers, resp.geturl(), resp.code, resp.msg)
+        return _copy_attrs(resp, new_resp)
+
+    https_request = http_request
+    https_response = http_response
+
+
+
+
+class ResponseStore(object):
+    '''Last known good response per URL, plus whatever the caller derived
+    from it (see `get_parsed` / `set_parsed`). Kept in memory, and also on
+    disk if `path` is given so revalidation works across runs.'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = dict()
+
+        if path is not None and not os.path.exists(path):
+            os.makedirs(path)
+
+    def _fn(self, url):
+        return os.path.join(self.path,
+            hashlib.sha1(url).hexdigest() + '.pickle')
+
+    def load(self, url):
+        if url in self._entries:
+            return self._entries[url]
+
+        if self.path is None or not os.path.exists(self._fn(url)):
+            return None
+
+        with open(self._fn(url), 'rb') as fh:
+            entry = pickle.load(fh)
+
+        self._entries[url] = entry
+        return entry
+
+    def _save(self, url, entry):
+        self._entries[url] = entry
+
+        if self.path is not None:
+            with open(self._fn(url), 'wb') as fh:
+                pickle.dump(entry, fh, pickle.HIGHEST_PROTOCOL)
+
+    def save(self, url, body, headers):
+        '''Store a fresh 200 response. Whatever was parsed from the old body
+        is kept as `previous` until the new one is parsed.'''
+        old = self.load(url)
+        previous = None
+        if old is not None:
+            previous = old['parsed'] if old['parsed'] is not None \
+                else old.get('previous')
+
+        self._save(url, {
+            'body' : body,
+            'headers' : str(headers),
+            'etag' : headers.get('ETag'),
+            'last_modified' : headers.get('Last-Modified'),
+            'parsed' : None,
+            'previous' : previous
+        })
+
+    def get_parsed(self, url):
+        entry = self.load(url)
+        return entry['parsed'] if entry is not None else None
+
+    def get_previous(self, url):
+        '''What was parsed from the body before the current one.'''
+        entry = self.load(url)
+        return entry.get('previous') if entry is not None else None
+
+    def set_parsed(self, url, value):
+        entry = self.load(url)
+        if entry is not None:
+            entry['parsed'] = value
+            entry['previous'] = None
+            self._save(url, entry)
+
+
+
+
+class ConditionalProcessor(urllib2.BaseHandler):
+    '''Revalidate GETs against a ResponseStore.'''
+    handler_order = 450
+
+    def __init__(self, store):
+        self.store = store
+
+    def http_request(self, req):
+        if req.get_method() != 'GET':
+            return req
+
+        entry = self.store.load(req.get_full_url())
+        if entry is None:
+            return req
+
+        if entry['etag']:
+            req.add_unredirected_header('If-None-Match', entry['etag'])
+        if entry['last_modified']:
+            req.add_unredirected_header('If-Modified-Since',
+                entry['last_modified'])
+
+        return req
+
+    def http_response(self, req, resp):
+        if req.get_method() != 'GET' or resp.code != 200:
+            return resp
+
+        # Stored even without validators to revalidate against, so
+        # set_parsed / get_previous work for every page
+        headers = resp.info()
+        body = resp.read()
+        self.store.save(req.get_full_url(), body, headers)
+
+        new_resp = _wrap(body, headers, resp.geturl(), resp.code, resp.msg)
+        return _copy_attrs(resp, new_resp)
+
+    def http_error_304(self, req, fp, code, msg, headers):
+        entry = self.store.load(req.get_full_url())
+        if entry is None:
+            return None
+
+        stored_headers = httplib.HTTPMessage(StringIO(entry['headers']))
+        resp = _wrap(entry['body'], stored_headers, req.get_full_url(),
+            200, 'OK')
+        resp.not_modified = True
+        resp.wire_bytes = getattr(fp, 'wire_bytes', 0)
+
+        return resp
+
+    https_request = http_request
+    https_response = http_response
+
+
+
+
+def handlers(store=None):
+    '''All the handlers needed for a pooled, compressed, revalidating opener.
+    Pass the result to urllib2.build_opener.'''
+    if store is None:
+        store = ResponseStore()
+
+    return [
+        KeepAliveHTTPHandler(debuglevel=0),
+        KeepAliveHTTPSHandler(debuglevel=0),
+        GzipProcessor(),
+        ConditionalProcessor(store)
+    ]